@@ -0,0 +1,231 @@
+"""
+Spec size scaling benchmark for the parser. Extends tests/test_std_spec.json and tests/test_std_def.json
+with synthetic keyword structures and binary operators with up to 50 overloads each, then loads each
+spec and parses the same source against it, writing spec load time, time per token, the structure
+candidates the index returns and the structures attempted per token, and the structures a linear scan
+over the spec would try per token, as JSON. Run from the repository root:
+
+    python benchmarks/spec_scaling_benchmark.py --output results.json
+    python benchmarks/spec_scaling_benchmark.py --compare results.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from ldm.ast.parsing import parse
+from ldm.lib_config2.spec_registry import build_version
+from ldm.source_tokenizer.tokenize import Tokenizer
+
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests')
+SPEC_FILE = os.path.join(TESTS_DIR, 'test_std_spec.json')
+DEF_FILE = os.path.join(TESTS_DIR, 'test_std_def.json')
+SIZES = {'10': 10, '100': 100, '1K': 1_000, '5K': 5_000}
+MAX_OVERLOADS = 50
+
+OPERATOR_CHARS = '~^|&%'
+'''Characters the std spec does not use, so synthetic operators never extend its operators'''
+OVERLOAD_TYPES = ['bool', 'string', 'float', 'int8']
+USED_SYNTHETIC = 4
+'''Synthetic keywords and operators the source uses, which every spec size has'''
+
+
+def operator_symbols():
+    for length in itertools.count(1):
+        for chars in itertools.product(OPERATOR_CHARS, repeat=length):
+            yield ''.join(chars)
+
+
+def operator_overloads(name: str, count: int) -> list[dict]:
+    """count overloads of a binary operator, ending with the int one the source uses"""
+    concrete = list(itertools.product(OVERLOAD_TYPES, repeat=2))
+    overloads = []
+    for i in range(count - 1):
+        if i < len(concrete):
+            left, right = concrete[i]
+            overloads.append({'type': 'operator_overload', 'name': name, 'left': left, 'right': right,
+                              'return': left})
+        else:
+            # generic overloads are matched in order rather than found by their types
+            generic = f'$typename<T{i}>'
+            overloads.append({'type': 'operator_overload', 'name': name, 'left': generic,
+                              'right': OVERLOAD_TYPES[i % len(OVERLOAD_TYPES)], 'return': generic})
+    overloads.append({'type': 'operator_overload', 'name': name, 'left': 'int', 'right': 'int', 'return': 'int'})
+    return overloads
+
+
+def build_spec_items(size: int, seed: int = 0) -> tuple[list[dict], list[dict]]:
+    """
+    The std spec and definition items with size synthetic structures added: half keyword statements like
+    kw3 ( $condition ) $body, half binary operators with 1 to MAX_OVERLOADS overloads
+    """
+    rng = random.Random(seed)
+    with open(SPEC_FILE) as f:
+        spec_items = json.load(f)
+    with open(DEF_FILE) as f:
+        def_items = json.load(f)
+
+    keywords = size // 2
+    for k in range(keywords):
+        name = f'kw{k}'
+        spec_items.append({'type': 'structure', 'name': name, 'components': [
+            {'base': 'expression', 'name': 'condition'},
+            {'base': 'structure', 'name': 'body', 'structure': 'main_block',
+             'modifiers': {'body': {'scope': 'local'}}},
+        ]})
+        def_items.append({'type': 'structure', 'name': name, 'structure': f'{name} ( $condition ) $body'})
+
+    symbols = operator_symbols()
+    for k in range(size - keywords):
+        name = f'op{k}'
+        spec_items.append({'type': 'structure', 'name': name, 'components': [
+            {'base': 'expression', 'name': 'left'},
+            {'base': 'expression', 'name': 'right'},
+        ], 'create_operator': {'overload_fields': ['left', 'right']}, 'expression_only': True})
+        count = MAX_OVERLOADS if k < USED_SYNTHETIC else rng.randint(1, MAX_OVERLOADS)
+        spec_items.extend(operator_overloads(name, count))
+        def_items.append({'type': 'structure', 'name': name, 'structure': f'$left {next(symbols)} $right',
+                          'create_operator': {'precedence': 4, 'associativity': 'left-to-right'}})
+    return spec_items, def_items
+
+
+def build_source(lines: int, seed: int = 0) -> str:
+    """Declarations, functions and statements using the std structures and the first synthetic ones"""
+    rng = random.Random(seed)
+    symbols = list(itertools.islice(operator_symbols(), USED_SYNTHETIC))
+    source = []
+    for i in range(lines // 4):
+        op = rng.choice(symbols)
+        keyword = f'kw{rng.randrange(USED_SYNTHETIC)}'
+        source.append(f'int a{i} = {rng.randint(0, 1000)} * 2 + {rng.randint(0, 1000)};')
+        source.append(f'int b{i} = a{i} {op} {rng.randint(0, 99)} - (a{i} {rng.choice(symbols)} 3);')
+        source.append(f'{keyword} (a{i} < b{i}) {{ int c = a{i} {op} b{i}; }}')
+        source.append(f'int f{i}(int p, bool q) {{ int r = p + {i}; }}')
+    return '\n'.join(source) + '\n'
+
+
+def count_structures(version, tokens) -> dict[str, int]:
+    """
+    Counts, in an untimed parse of tokens, the steps where the parser picks structures, the candidates
+    the index returns for them and the structures attempted: the candidates that pass the lookahead and
+    are reached before one commits on its match. A linear scan would try every structure at each step.
+    """
+    index = version.index
+    candidates = index.candidates
+    lookahead_matches = index.lookahead_matches
+    counts = {'steps': 0, 'candidates': 0, 'attempted': 0}
+
+    def counting_candidates(*args, **kwargs):
+        result = candidates(*args, **kwargs)
+        counts['steps'] += 1
+        counts['candidates'] += len(result)
+        return result
+
+    def counting_lookahead_matches(*args, **kwargs):
+        matches = lookahead_matches(*args, **kwargs)
+        counts['attempted'] += matches
+        return matches
+
+    index.candidates = counting_candidates
+    index.lookahead_matches = counting_lookahead_matches
+    try:
+        parse(tokens, version.parsing_items(), version.tokenizer_items)
+    finally:
+        del index.candidates
+        del index.lookahead_matches
+    return counts
+
+
+def measure(spec_items: list[dict], def_items: list[dict], source: str, repeats: int) -> dict:
+    best_load = float('inf')
+    version = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        version = build_version(0, spec_items, def_items, None, None, True)
+        best_load = min(best_load, time.perf_counter() - start)
+
+    tokens = Tokenizer(version.tokenizer_items).tokenize(source)
+    best = float('inf')
+    for _ in range(repeats):
+        # fresh items each run, so overloads are resolved again rather than read from the last run
+        items = version.parsing_items()
+        start = time.perf_counter()
+        parse(tokens, items, version.tokenizer_items)
+        best = min(best, time.perf_counter() - start)
+    counts = count_structures(version, tokens)
+    structures = len(version.spec.structured_objects)
+
+    return {
+        'structures': structures,
+        'overloads': sum(len(so.create_operator.overloads) for so in version.spec.structured_objects.values()
+                         if so.create_operator is not None),
+        'load_seconds': best_load,
+        'tokens': len(tokens),
+        'parse_seconds': best,
+        'seconds_per_token': best / len(tokens),
+        'candidates_per_token': counts['candidates'] / len(tokens),
+        'attempted_per_token': counts['attempted'] / len(tokens),
+        'linear_scan_per_token': counts['steps'] * structures / len(tokens),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--lines', type=int, default=200, help='lines in the parsed source')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    source = build_source(args.lines)
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'lines': args.lines,
+        'sizes': {},
+    }
+    for name in args.sizes:
+        spec_items, def_items = build_spec_items(SIZES[name])
+        result = measure(spec_items, def_items, source, args.repeats)
+        results['sizes'][name] = result
+        print(f"{name:>4}: {result['structures']:6} structures {result['overloads']:7} overloads "
+              f"{result['load_seconds'] * 1e3:9.1f}ms load "
+              f"{result['seconds_per_token'] * 1e6:8.2f}us/token "
+              f"{result['candidates_per_token']:7.2f} candidates/token "
+              f"{result['attempted_per_token']:6.2f} attempted/token "
+              f"{result['linear_scan_per_token']:9.1f} scanned/token without the index")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        for name, result in results['sizes'].items():
+            if name in previous['sizes']:
+                ratio = previous['sizes'][name]['seconds_per_token'] / result['seconds_per_token']
+                load_ratio = previous['sizes'][name]['load_seconds'] / result['load_seconds']
+                print(f"{name:>4}: {ratio:.2f}x the parse speed and {load_ratio:.2f}x the load speed of "
+                      f"{previous.get('commit') or args.compare}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
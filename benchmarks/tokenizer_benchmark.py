@@ -0,0 +1,133 @@
+"""
+Throughput benchmark for ldm.source_tokenizer. Builds sources with a realistic mix of identifiers,
+long string literals, floats, operator runs and separators, times Tokenizer.tokenize on them and
+writes the results as JSON. Run from the repository root:
+
+    python benchmarks/tokenizer_benchmark.py --output results.json
+    python benchmarks/tokenizer_benchmark.py --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from ldm.lib_config2.spec_parsing import parse_spec
+from ldm.source_tokenizer.tokenize import Tokenizer, TokenizerItems
+
+
+SPEC_FILE = os.path.join(os.path.dirname(__file__), '..', 'tests', 'test_std_spec.json')
+SIZES = {'1K': 1_000, '100K': 100_000, '10M': 10_000_000}
+
+IDENTIFIERS = ['count', 'total_size', 'x', 'y', 'index', 'buffer', 'node_left', 'result', 'i', 'value2']
+TYPES = ['int', 'float', 'string', 'bool']
+OPERATORS = ['=', '+', '-', '*', '<', '>', '.', '?', ':', '+ -', '* (', ') *', '- -']
+
+
+def build_source(size: int, seed: int = 0) -> str:
+    """A source of at least size characters made of declarations, expressions and string literals"""
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.35:
+            line = f'{rng.choice(TYPES)} {rng.choice(IDENTIFIERS)} = {rng.randint(0, 100000)};'
+        elif kind < 0.6:
+            terms = [rng.choice(IDENTIFIERS) if rng.random() < 0.5 else f'{rng.uniform(0, 1000):.4f}'
+                     for _ in range(rng.randint(2, 8))]
+            line = rng.choice(IDENTIFIERS) + ' = ' + f' {rng.choice(OPERATORS)} '.join(terms) + ';'
+        elif kind < 0.8:
+            text = ' '.join(rng.choice(IDENTIFIERS) for _ in range(rng.randint(5, 30)))
+            line = f'string {rng.choice(IDENTIFIERS)} = "{text}";'
+        elif kind < 0.9:
+            line = f'if ({rng.choice(IDENTIFIERS)} < {rng.randint(0, 99)}) {{'
+        else:
+            line = '}'
+        line = '    ' * rng.randint(0, 3) + line
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines) + '\n'
+
+
+def measure(tokenizer: Tokenizer, source: str, repeats: int) -> dict:
+    best = float('inf')
+    token_count = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        tokens = tokenizer.tokenize(source)
+        best = min(best, time.perf_counter() - start)
+        token_count = len(tokens)
+        del tokens
+
+    # tracemalloc slows allocation down, so memory is measured in a separate run
+    tracemalloc.start()
+    tokens = tokenizer.tokenize(source)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tokens
+
+    return {
+        'chars': len(source),
+        'tokens': token_count,
+        'seconds': best,
+        'chars_per_second': len(source) / best,
+        'tokens_per_second': token_count / best,
+        'peak_memory_bytes': peak,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    with open(SPEC_FILE) as f:
+        spec = parse_spec(json.load(f))
+    tokenizer = Tokenizer(TokenizerItems(spec.primitive_types, spec.expression_separators))
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': {},
+    }
+    for name in args.sizes:
+        source = build_source(SIZES[name])
+        result = measure(tokenizer, source, args.repeats)
+        results['sizes'][name] = result
+        print(f"{name:>5}: {result['chars_per_second'] / 1e6:8.2f}M chars/s "
+              f"{result['tokens_per_second'] / 1e6:8.2f}M tokens/s "
+              f"{result['peak_memory_bytes'] / 2 ** 20:9.2f}MiB peak")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        for name, result in results['sizes'].items():
+            if name in previous['sizes']:
+                ratio = result['chars_per_second'] / previous['sizes'][name]['chars_per_second']
+                print(f"{name:>5}: {ratio:.2f}x the throughput of {previous.get('commit') or args.compare}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
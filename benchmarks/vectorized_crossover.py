@@ -0,0 +1,55 @@
+"""
+Compares Tokenizer with VectorizedTokenizer over growing sources to find the size from which the
+NumPy prepass is faster. Run from the repository root: python benchmarks/vectorized_crossover.py
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from ldm.lib_config2.spec_parsing import parse_spec
+from ldm.source_tokenizer.tokenize import Tokenizer, TokenizerItems
+from ldm.source_tokenizer.vectorized import VectorizedTokenizer
+
+
+SPEC_FILE = os.path.join(os.path.dirname(__file__), '..', 'tests', 'test_std_spec.json')
+SAMPLE = 'int count = 12;\nfloat ratio = count * 2.5 + 0.125;\nstring name = "a sample string";\nbool ok = true;\n'
+SIZES = [100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+
+def best_time(tokenize, source: str, repeats: int) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        tokenize(source)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    with open(SPEC_FILE) as f:
+        spec = parse_spec(json.load(f))
+    items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+    scalar = Tokenizer(items)
+    vectorized = VectorizedTokenizer(items)
+
+    crossover = None
+    print(f"{'chars':>10} {'Tokenizer':>12} {'Vectorized':>12} {'speedup':>8}")
+    for size in SIZES:
+        source = (SAMPLE * (size // len(SAMPLE) + 1))[:size]
+        source = source[:source.rindex('\n') + 1]
+        repeats = max(1, 1_000_000 // size)
+        scalar_time = best_time(scalar.tokenize_table, source, repeats)
+        vectorized_time = best_time(vectorized.tokenize_table, source, repeats)
+        speedup = scalar_time / vectorized_time
+        if crossover is None and speedup > 1:
+            crossover = size
+        print(f"{size:>10} {scalar_time * 1000:>10.3f}ms {vectorized_time * 1000:>10.3f}ms {speedup:>7.2f}x")
+
+    print(f"VectorizedTokenizer is faster from {crossover} characters" if crossover else
+          "VectorizedTokenizer was not faster at any measured size")
+
+
+if __name__ == '__main__':
+    main()
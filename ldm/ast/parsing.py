@@ -1,12 +1,15 @@
 from __future__ import annotations
 from ldm.source_tokenizer.tokenize import TokenizerItems
 from ldm.ast.parsing_types import ParsingContext, TokenIterator, ParsingItems, Token
+from ldm.source_tokenizer.tokenizer_types import TokenTable
 from ldm.ast.structure_parser import StructureParser
 
 
-def parse(tokens: list[Token], parsing_items: ParsingItems, tokenizer_items: TokenizerItems):
+def parse(tokens: list[Token] | TokenTable, parsing_items: ParsingItems, tokenizer_items: TokenizerItems):
     # create context to be used when parsing
     context = ParsingContext()
+    # types declared by an earlier parse with the same items are not types in this one
+    parsing_items.declared_types = set()
     iterator = TokenIterator(tokens)
 
     # create structure parser
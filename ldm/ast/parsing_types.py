@@ -1,16 +1,18 @@
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any
 
 from ldm.lib_config2.spec_parsing import string_to_typespec
-from ldm.source_tokenizer.tokenizer_types import Token
+from ldm.source_tokenizer.tokenizer_types import Token, TokenTable
+from ldm.ast.structure_index import StructureIndex
 from ldm.lib_config2.parsing_types import Spec, TypeSpec, StructuredObject, ComponentType, \
-    StructureComponentType, StructureComponent, OperatorType
+    StructureComponentType, StructureComponent, OperatorType, TypeHierarchy, OperatorOverload, ComponentPath
 
 
 class TokenIterator:
-    def __init__(self, tokens: list[Token]):
-        self.tokens = [*tokens]
+    def __init__(self, tokens: list[Token] | TokenTable):
+        # tokens are only read, so a list or TokenTable is walked in place
+        self.tokens = tokens
         self.index = 0
 
     def __next__(self) -> tuple[Token, int]:
@@ -46,6 +48,40 @@ class TokenIterator:
 @dataclass
 class ParsingItems:
     config_spec: Spec
+    index: StructureIndex | None = field(default=None, init=False, repr=False, compare=False)
+    """First-token index of the spec's structures, built on first use"""
+    types: TypeHierarchy | None = field(default=None, init=False, repr=False, compare=False)
+    """Copy of the spec's type hierarchy that created types are declared in"""
+    resolved_overloads: dict[tuple, tuple[OperatorOverload, dict[str, TypeSpec]]] = \
+        field(default_factory=dict, init=False, repr=False, compare=False)
+    """{(operator name, argument types): (overload, generics)} for overloads that only depend on the types"""
+    declared_types: set[str] = field(default_factory=set, init=False, repr=False, compare=False)
+    """
+    Names of the types create_type structures declared in the current parse, which tokenize as identifiers.
+    Reset by parse, so ParsingItems reused for another parse do not carry them over.
+    """
+
+    def structure_index(self, tokenizer_items) -> StructureIndex:
+        """
+        The structure index for tokens of tokenizer_items, shared by every ParsingItems of the spec and
+        rebuilt if structures were added since
+        """
+        index = self.index
+        structured_objects = self.config_spec.structured_objects
+        if index is None or index.tokenizer_items is not tokenizer_items or \
+                index.structure_count != len(structured_objects):
+            index = self.config_spec.structure_indexes.get(tokenizer_items)
+            if index is None or index.structure_count != len(structured_objects):
+                index = StructureIndex(structured_objects, tokenizer_items)
+                self.config_spec.structure_indexes.put(index)
+            self.index = index
+        return index
+
+    def type_hierarchy(self) -> TypeHierarchy:
+        """Subtype closure of the spec's types and the types created while parsing"""
+        if self.types is None:
+            self.types = self.config_spec.get_type_hierarchy().copy()
+        return self.types
 
 
 @dataclass
@@ -145,86 +181,31 @@ class StructuredObjectInstance:
         if not so.create_operator:
             return
 
-        first_is_expression = so.structure.component_defs[0].component_type == StructureComponentType.Variable and \
-                              so.get_nth_component(0).base == ComponentType.EXPRESSION
-        last_is_expression = so.structure.component_defs[-1].component_type == StructureComponentType.Variable and \
-                             so.get_nth_component(-1).base == ComponentType.EXPRESSION
-
-        if first_is_expression and last_is_expression:
-            op_type = OperatorType.BINARY
-        elif first_is_expression and not last_is_expression:
-            op_type = OperatorType.UNARY_LEFT
-        elif not first_is_expression and last_is_expression:
-            op_type = OperatorType.UNARY_RIGHT
-        else:
-            op_type = OperatorType.INTERNAL
-
+        op_type = so.get_compiled().operator_type
         self.operator_fields = OperatorFields(TypeSpec("", 0, []), op_type)
 
     def clone(self):
         return StructuredObjectInstance(self.so, {})
 
     def get_nth_component(self, n: int):
-        defs = self.so.structure.component_defs
-        def_vars: list[StructureComponent] = list(
-            filter(lambda v: v.component_type == StructureComponentType.Variable, defs)
-        )
-        sc = def_vars[n]
+        sc = self.so.get_compiled().variable_defs[n]
         return self.components[sc.value]
 
     def operator_fields_filled(self):
         if not self.so.create_operator:
             raise RuntimeError(f'{self.so.name} is not an operator')
-        fields = self.so.create_operator.fields
+        field_paths = self.so.create_operator.field_paths
         total = 0
-        for field in fields:
-            components = self.extract_from_path(field)
-            if components is not None:
+        for path in field_paths.values():
+            if path.head in self.components:
                total += 1
         return total
 
     def operator_num_lefts(self):
-        num = 0
-        for d in self.so.structure.component_defs:
-            if d.component_type == StructureComponentType.Variable and \
-                    self.so.structure.component_specs[d.value].base == ComponentType.EXPRESSION:
-                num += 1
-            else:
-                break
-        return num
-
-    def extract_from_path(self, path: str) -> ValueError | list[SOInstanceItem] | list[str]:
-        if path.startswith('$'):
-            path = path[1:]
-
-        parts = path.split('.')
-        item = self.components[parts[0]]
-
-        stack = [item]
-
-        for p_num in range(1, len(parts)):
-            p = parts[p_num]
-            sub_items = []
-            for stack_item in stack:
-                if stack_item.item_type == ComponentType.REPEATED_ELEMENT:
-                    for i in range(len(stack_item.value)):
-                        if p not in stack_item.value[i].components:
-                            return ValueError(f'item {p_num+1} ({p}) not found in {path}')
-                        sub_item = stack_item.value[i].components[p]
-                        sub_items.append(sub_item)
-                else:
-                    if p not in stack_item.value:
-                        return ValueError(f'item {p_num+1} ({p}) not found in {path}')
-                    sub_item = stack_item.value[p]
-                    sub_items.append(sub_item)
-            stack = sub_items
-
-        variables = []
-
-        for item in stack:
-            variables.append(item)
-
-        return variables
+        return self.so.get_compiled().num_lefts
+
+    def extract_from_path(self, path: ComponentPath) -> list[SOInstanceItem] | list[str]:
+        return path.extract(self.components)
 
     def __str__(self):
         return f"StructuredObjectInstance({self.so.name} {self.components})"
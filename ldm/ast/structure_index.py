@@ -0,0 +1,404 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from heapq import merge
+from typing import Callable, Collection
+
+from ldm.lib_config2.parsing_types import StructuredObject, StructureComponent, StructureSpecComponent, \
+    StructureComponentType, ComponentType, OPERATOR_FILTER_TYPES, operator_filter_type
+from ldm.source_tokenizer.tokenizer_types import TokenType
+
+
+LOOKAHEAD = 3
+'''Number of tokens checked before a candidate structure is parsed'''
+MAX_SEQUENCES = 64
+'''Lookahead sets larger than this are dropped, so the structure is always parsed'''
+
+# lookahead predicates besides literal token values
+TYPENAME = ('typename',)
+'''A token classified as a primitive type or declared type'''
+ANY = ('any',)
+'''Any single token'''
+STOP = ('stop',)
+'''Any tokens from here on'''
+
+
+def could_be_typename(literal: str, identifier_types) -> bool:
+    """Whether a literal token is, or could later be declared as, a type"""
+    token_type = identifier_types.get(literal)
+    if token_type is None:
+        return literal.isidentifier()
+    return token_type in (TokenType.PrimitiveType, TokenType.Type)
+
+
+def predicates_overlap(p, q, identifier_types) -> bool:
+    """Whether some token can match both lookahead predicates"""
+    if p is ANY or q is ANY:
+        return True
+    if p is TYPENAME:
+        return q is TYPENAME or could_be_typename(q, identifier_types)
+    if q is TYPENAME:
+        return could_be_typename(p, identifier_types)
+    return p == q
+
+
+def sequences_overlap(a: tuple, b: tuple, identifier_types) -> bool:
+    """Whether some tokens can start both lookahead sequences"""
+    for p, q in zip(a, b):
+        if p is STOP or q is STOP:
+            return True
+        if not predicates_overlap(p, q, identifier_types):
+            return False
+    return True
+
+
+def lookaheads_overlap(a: frozenset[tuple] | None, b: frozenset[tuple] | None, identifier_types) -> bool:
+    if a is None or b is None:
+        return True
+    return any(sequences_overlap(x, y, identifier_types) for x in a for y in b)
+
+
+@dataclass
+class Ambiguity:
+    """Two structures that can both be parsed from the same tokens, where the longer one wins"""
+    first: str
+    second: str
+    skip_first_expressions: bool
+    '''Whether this is for structures continuing after leading expressions'''
+
+    def __str__(self):
+        where = 'after an expression' if self.skip_first_expressions else 'at the start of a statement'
+        return f"{self.first} and {self.second} can start with the same tokens {where}"
+
+
+class FirstComponentIndex:
+    """
+    Structures grouped by their first component: literals by their first token value, variables by
+    component kind. Every group keeps spec order, as (ordinal, structure) pairs.
+    """
+    def __init__(self):
+        self.literals: dict[str, list[tuple[int, StructuredObject]]] = {}
+        self.always: list[tuple[int, StructuredObject]] = []
+        '''Structures that start with an empty literal, which matches at any token'''
+        self.typenames: list[tuple[int, StructuredObject]] = []
+        self.names: list[tuple[int, StructuredObject]] = []
+        self.expressions: list[tuple[int, StructuredObject]] = []
+        self.others: list[tuple[int, StructuredObject]] = []
+        '''Structures starting with a component kind that cannot start a structure, kept so they still error'''
+
+    def add(self, ordinal: int, so: StructuredObject, first_index: int):
+        first = so.structure.component_defs[first_index]
+        entry = (ordinal, so)
+        if first.component_type == StructureComponentType.String:
+            literal_tokens = so.compiled.literal_tokens[first_index]
+            if literal_tokens:
+                self.literals.setdefault(literal_tokens[0], []).append(entry)
+            else:
+                self.always.append(entry)
+        elif first.component_type == StructureComponentType.Variable:
+            base = so.structure.component_specs[first.value].base
+            if base == ComponentType.EXPRESSION:
+                self.expressions.append(entry)
+            elif base == ComponentType.TYPENAME:
+                self.typenames.append(entry)
+            elif base == ComponentType.NAME:
+                self.names.append(entry)
+            else:
+                self.others.append(entry)
+
+
+def first_sequences(defs: list[StructureComponent], specs: dict[str, StructureSpecComponent], index: int, k: int,
+                    tokenizer_items, structured_objects: dict[str, StructuredObject],
+                    after: Callable[[int], set[tuple]], visiting: frozenset[str] = frozenset()) -> set[tuple]:
+    """
+    FIRST-k set of defs from index on: every sequence of up to k predicates the next tokens can match,
+    continued by the sequences of after once defs are done. A sequence ending in STOP allows anything next.
+    """
+    if k == 0:
+        return {()}
+    if index == len(defs):
+        return after(k)
+
+    d = defs[index]
+
+    def rest(remaining: int) -> set[tuple]:
+        return first_sequences(defs, specs, index + 1, remaining, tokenizer_items, structured_objects, after, visiting)
+
+    if d.component_type == StructureComponentType.String:
+        prefix = tokenizer_items.literal_tokens(d.value)[:k]
+        return {prefix + r for r in rest(k - len(prefix))}
+    if d.component_type != StructureComponentType.Variable or d.value not in specs:
+        return {(STOP,)}
+
+    spec_component = specs[d.value]
+    base = spec_component.base
+    if base == ComponentType.TYPENAME:
+        return {(TYPENAME,) + r for r in rest(k - 1)}
+    if base == ComponentType.NAME:
+        return {(ANY,) + r for r in rest(k - 1)}
+    if base == ComponentType.REPEATED_ELEMENT and d.inner_structure is not None:
+        # either no elements, or an element followed by a separator or the end, which is left open
+        inner = first_sequences(d.inner_structure, spec_component.other['components'], 0, k, tokenizer_items,
+                                structured_objects, lambda remaining: {(STOP,)}, visiting)
+        return rest(k) | inner
+    if base == ComponentType.STRUCTURE:
+        name = spec_component.other.get('structure')
+        if name in structured_objects and name not in visiting:
+            nested = structured_objects[name].structure
+            return first_sequences(nested.component_defs, nested.component_specs, 0, k, tokenizer_items,
+                                   structured_objects, rest, visiting | {name})
+    # expressions can be any number of tokens
+    return {(STOP,)}
+
+
+def referenced_structures(specs: dict[str, StructureSpecComponent]) -> set[str]:
+    """Names of the structures the structure components in specs, or in their repeated elements, parse"""
+    names = set()
+    for spec_component in specs.values():
+        if spec_component.base == ComponentType.STRUCTURE:
+            names.add(spec_component.other.get('structure'))
+        elif spec_component.base == ComponentType.REPEATED_ELEMENT:
+            names |= referenced_structures(spec_component.other['components'])
+    return names
+
+
+class StructureIndex:
+    """
+    Index from the token a structure could start at to the structures that could start there,
+    for the structures of a spec as split into tokens by one TokenizerItems. Each structure also
+    gets the token sequences it can start with, to reject it before parsing, and its bit in the
+    masks StructureFilters compile to.
+
+    Given the index of a previous version of the structures, the lookaheads of structures that are
+    the same objects and only parse structures that are too are reused rather than recomputed.
+    """
+    def __init__(self, structured_objects: dict[str, StructuredObject], tokenizer_items,
+                 previous: StructureIndex | None = None):
+        self.tokenizer_items = tokenizer_items
+        self.structured_objects = structured_objects
+        self.structure_count = len(structured_objects)
+        self.from_start = FirstComponentIndex()
+        self.after_expressions = FirstComponentIndex()
+        '''Index by the first component after the leading expressions'''
+        self.statements_from_start = FirstComponentIndex()
+        self.statements_after_expressions = FirstComponentIndex()
+        '''The same indexes without the structures only parsed in expressions'''
+        self.lookahead: dict[str, tuple[frozenset[tuple] | None, frozenset[tuple] | None]] = {}
+        '''{structure name: (sequences from the first component, sequences after the leading expressions)}'''
+        self.ordinals: dict[str, int] = {}
+        '''{structure name: ordinal}, in spec order'''
+        self.all_mask = (1 << len(structured_objects)) - 1
+        self.contains_masks: dict[str, int] = {'create_variable': 0, 'create_type': 0, 'create_operator': 0}
+        self.operator_type_masks: dict[str, int] = {operator_type: 0 for operator_type in OPERATOR_FILTER_TYPES}
+
+        reusable = {}
+        if previous is not None and previous.tokenizer_items is tokenizer_items:
+            reusable = previous.__unchanged_lookaheads(structured_objects)
+
+        for ordinal, so in enumerate(structured_objects.values()):
+            self.ordinals[so.name] = ordinal
+            self.__add_to_masks(ordinal, so)
+            if len(so.structure.component_defs) == 0:
+                continue
+            compiled = so.get_compiled(tokenizer_items)
+            self.from_start.add(ordinal, so, 0)
+            self.after_expressions.add(ordinal, so, compiled.first_component_index)
+            if not so.expression_only:
+                self.statements_from_start.add(ordinal, so, 0)
+                self.statements_after_expressions.add(ordinal, so, compiled.first_component_index)
+            lookahead = reusable.get(so.name)
+            if lookahead is None:
+                lookahead = (self.__lookahead(so, 0, structured_objects),
+                             self.__lookahead(so, compiled.num_lefts, structured_objects))
+            self.lookahead[so.name] = lookahead
+
+        self.ambiguities: list[Ambiguity] = []
+        '''Pairs of structures with overlapping lookaheads, in spec order'''
+        self.unpredictable: tuple[list[str], list[str]] = ([], [])
+        '''Structures without a lookahead, which may start with any tokens, from the start and after expressions'''
+        self.ambiguous: tuple[frozenset[str], frozenset[str]] = (frozenset(), frozenset())
+        '''
+        Structures another structure can be parsed alongside, so they are never taken as soon as they parse,
+        from the start and after expressions
+        '''
+        self.ambiguous_statements: tuple[frozenset[str], frozenset[str]] = (frozenset(), frozenset())
+        '''The same, when structures only parsed in expressions cannot be candidates'''
+        self.__analyse(structured_objects)
+
+    def __analyse(self, structured_objects: dict[str, StructuredObject]):
+        found = []
+        found_statements = []
+        ordinals = self.ordinals
+        for skip in (False, True):
+            objects = [so for so in structured_objects.values() if so.name in self.lookahead]
+            predictable = [so for so in objects if self.lookahead[so.name][skip] is not None]
+            unpredictable = [so for so in objects if self.lookahead[so.name][skip] is None]
+            self.unpredictable[skip].extend(so.name for so in unpredictable)
+
+            # structures without a lookahead overlap every other one
+            ambiguous = {so.name for so in objects} if unpredictable else set()
+            ambiguous_statements = {so.name for so in objects} \
+                if any(not so.expression_only for so in unpredictable) else set()
+            ambiguous_statements.update(so.name for so in unpredictable)
+
+            # only structures whose lookaheads can share a first token are compared
+            by_first: dict[str, list[StructuredObject]] = {}
+            wide: list[StructuredObject] = []
+            '''Structures that can start with a name or typename'''
+            for so in predictable:
+                firsts = {sequence[0] for sequence in self.lookahead[so.name][skip]}
+                if ANY in firsts or TYPENAME in firsts:
+                    wide.append(so)
+                for first in firsts - {ANY, TYPENAME}:
+                    by_first.setdefault(first, []).append(so)
+
+            pairs = set()
+            for so in predictable:
+                if so in wide:
+                    others = predictable
+                else:
+                    firsts = {sequence[0] for sequence in self.lookahead[so.name][skip]}
+                    others = [other for first in firsts for other in by_first[first]] + wide
+                for other in others:
+                    if ordinals[other.name] > ordinals[so.name]:
+                        pairs.add((so.name, other.name))
+
+            for first, second in sorted(pairs, key=lambda pair: (ordinals[pair[0]], ordinals[pair[1]])):
+                if not lookaheads_overlap(self.lookahead[first][skip], self.lookahead[second][skip],
+                                          self.tokenizer_items.identifier_types):
+                    continue
+                self.ambiguities.append(Ambiguity(first, second, skip))
+                ambiguous.update((first, second))
+                if not structured_objects[first].expression_only and not structured_objects[second].expression_only:
+                    ambiguous_statements.update((first, second))
+
+            found.append(frozenset(ambiguous))
+            found_statements.append(frozenset(ambiguous_statements))
+        self.ambiguous = (found[0], found[1])
+        self.ambiguous_statements = (found_statements[0], found_statements[1])
+
+    def overlapping(self, name: str, skip_first_expressions: bool, expressions_allowed: bool = True) -> list[str]:
+        """
+        The structures name can be parsed alongside, which keep it from being taken as soon as it parses:
+        those it shares an ambiguity with and those without a lookahead, in spec order. Without
+        expressions_allowed, structures only parsed in expressions are left out.
+        """
+        others = set(self.unpredictable[skip_first_expressions])
+        for ambiguity in self.ambiguities:
+            if ambiguity.skip_first_expressions == skip_first_expressions and name in (ambiguity.first, ambiguity.second):
+                others.update((ambiguity.first, ambiguity.second))
+        others.discard(name)
+        if not expressions_allowed:
+            others = {other for other in others if not self.structured_objects[other].expression_only}
+        return sorted(others, key=self.ordinals.__getitem__)
+
+    def commits_on_match(self, so: StructuredObject, skip_first_expressions: bool, expressions_allowed: bool) -> bool:
+        """
+        Whether so can be taken as soon as it parses, since no other candidate can parse from the same
+        tokens. expressions_allowed tells if structures only parsed in expressions can be candidates.
+        """
+        names = self.ambiguous if expressions_allowed else self.ambiguous_statements
+        return so.name in self.lookahead and so.name not in names[skip_first_expressions]
+
+    def __unchanged_lookaheads(self, structured_objects: dict[str, StructuredObject]) -> dict[str, tuple]:
+        """Lookaheads of this index that are still right for structured_objects"""
+        old = self.structured_objects
+        changed = {name for name in old.keys() | structured_objects.keys()
+                   if old.get(name) is not structured_objects.get(name)}
+        unchanged = {}
+        for name, lookahead in self.lookahead.items():
+            seen = set()
+            stack = [name]
+            while stack and not seen & changed:
+                current = stack.pop()
+                if current in seen:
+                    continue
+                seen.add(current)
+                if current in old:
+                    stack.extend(referenced_structures(old[current].structure.component_specs))
+            if not seen & changed:
+                unchanged[name] = lookahead
+        return unchanged
+
+    def __add_to_masks(self, ordinal: int, so: StructuredObject):
+        bit = 1 << ordinal
+        if so.create_variable is not None:
+            self.contains_masks['create_variable'] |= bit
+        if so.create_type is not None:
+            self.contains_masks['create_type'] |= bit
+        if so.create_operator is not None:
+            self.contains_masks['create_operator'] |= bit
+            operator_type = operator_filter_type(so)
+            if operator_type is not None:
+                self.operator_type_masks[operator_type] |= bit
+
+    def __lookahead(self, so: StructuredObject, index: int, structured_objects) -> frozenset[tuple] | None:
+        sequences = first_sequences(so.structure.component_defs, so.structure.component_specs, index, LOOKAHEAD,
+                                    self.tokenizer_items, structured_objects, lambda remaining: {(STOP,)},
+                                    frozenset([so.name]))
+        if len(sequences) > MAX_SEQUENCES or any(sequence[0] == STOP for sequence in sequences):
+            return None
+        return frozenset(sequences)
+
+    def candidates(self, value: str, is_typename: bool, is_name: bool, skip_first_expressions: bool = False,
+                   mask: int | None = None, expressions_allowed: bool = True) -> list[StructuredObject]:
+        """
+        Structures, in spec order, that could start at a token with the given value. is_typename and
+        is_name tell if the token can be a typename or an existing global name. Given a mask from
+        StructureFilter.mask, only the structures in it are returned. Structures only parsed in
+        expressions are left out unless expressions_allowed.
+        """
+        if expressions_allowed:
+            index = self.after_expressions if skip_first_expressions else self.from_start
+        else:
+            index = self.statements_after_expressions if skip_first_expressions else self.statements_from_start
+        groups = [group for group in (
+            index.literals.get(value),
+            index.always,
+            index.typenames if is_typename else None,
+            index.names if is_name else None,
+            index.expressions,
+            index.others,
+        ) if group]
+
+        entries = groups[0] if len(groups) == 1 else merge(*groups, key=lambda entry: entry[0])
+        if mask is None:
+            return [so for _, so in entries]
+        return [so for ordinal, so in entries if (mask >> ordinal) & 1]
+
+    def lookahead_matches(self, so: StructuredObject, tokens, skip_first_expressions: bool = False,
+                          declared_types: Collection[str] = ()) -> bool:
+        """
+        Whether the tokens from the current one on can start so, checking up to LOOKAHEAD tokens.
+        Running out of tokens counts as a match, since structures are parsed up to the end of the input.
+        declared_types are the types declared so far in the parse, which match typenames too.
+        """
+        sequences = self.lookahead.get(so.name)
+        if sequences is None:
+            return True
+        sequences = sequences[1 if skip_first_expressions else 0]
+        if sequences is None:
+            return True
+
+        identifier_types = self.tokenizer_items.identifier_types
+        start = tokens.current_index()
+        peeked = []
+        for sequence in sequences:
+            for i, predicate in enumerate(sequence):
+                if predicate is STOP:
+                    return True
+                if i == len(peeked):
+                    peeked.append(tokens.peek(start + i))
+                token = peeked[i]
+                if token is None:
+                    return True
+                if predicate is ANY:
+                    continue
+                if predicate is TYPENAME:
+                    if identifier_types.get(token.value) not in (TokenType.PrimitiveType, TokenType.Type) and \
+                            token.value not in declared_types:
+                        break
+                elif token.value != predicate:
+                    break
+            else:
+                return True
+        return False
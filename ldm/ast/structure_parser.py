@@ -3,61 +3,20 @@ from __future__ import annotations
 from ldm.ast.type_checking import typespec_matches, type_operator
 from ldm.errors.LDMError import ParsingTracebackError
 from ldm.lib_config2.spec_parsing import string_to_typespec
-from ldm.source_tokenizer.tokenize import Token, TokenizerItems, Tokenizer
+from ldm.source_tokenizer.tokenize import Token, TokenizerItems
 from ldm.ast.parsing_types import (TokenIterator, ParsingItems, ParsingContext, ValueToken,
                                    StructuredObjectInstance, NameInstance, TypenameInstance, SOInstanceItem)
 from ldm.lib_config2.parsing_types import Structure, StructureComponentType, StructureComponent, TypeSpec, \
     ComponentType, StructureFilter, StructureFilterComponent, StructureFilterComponentType, StructuredObject, \
-    Associativity, OperatorType
+    Associativity, OperatorType, CompiledStructure, StructureSpecComponent, ScopeItems, to_filter
 from ldm.source_tokenizer.tokenizer_types import TokenType
 
 
 def to_typespec(token: Token) -> TypeSpec:
-    return TypeSpec(token.value, 0, [])
-
-def to_filter(filter_list: list[dict] | str) -> StructureFilter:
-    if filter_list == 'all':
-        return StructureFilter(all_allowed=True, allow_expressions=True)
-    if filter_list == 'expressions':
-        return StructureFilter(allow_expressions=True)
-
-    filter = StructureFilter()
-
-    for item in filter_list:
-        if item['type'] == 'contains':
-            filter.filters.append(
-                StructureFilterComponent(
-                    StructureFilterComponentType.CONTAINS,
-                    item['contains']
-                )
-            )
-        elif item['type'] == 'excludes':
-            filter.filters.append(
-                StructureFilterComponent(
-                    StructureFilterComponentType.EXCLUDES,
-                    item['excludes']
-                )
-            )
-        elif item['type'] == 'structure':
-            filter.filters.append(
-                StructureFilterComponent(
-                    StructureFilterComponentType.STRUCTURE,
-                    item['structure']
-                )
-            )
-        elif item['type'] == 'and':
-            filter.filters.append(
-                StructureFilterComponent(
-                    StructureFilterComponentType.AND,
-                    to_filter(item['filters']).filters
-                )
-            )
-        elif item['type'] == 'expression':
-            if item['allow'] not in [True, False]:
-                raise ValueError(f'Invalid allow type: {item["allow"]}')
-            filter.allow_expressions = item['allow']
+    return string_to_typespec(token.value)
 
-    return filter
+NO_FILTER = StructureFilter()
+'''Filter of expressions parsed without one. Shared so its compiled masks and variants are reused'''
 
 def check_valid_type(typespec: TypeSpec, items: ParsingItems, context: ParsingContext, exclude: str="") -> bool:
     name = typespec.name
@@ -82,7 +41,7 @@ def check_valid_type(typespec: TypeSpec, items: ParsingItems, context: ParsingCo
     return True
 
 def convert_relative_typespec(t: TypeSpec, node: dict, items: ParsingItems, context: ParsingContext) -> TypeSpec:
-    ts = TypeSpec(t.name, t.num_subtypes, [])
+    name = t.name
 
     if t.name.startswith('$'):
         val = node[t.name[1:]]
@@ -94,17 +53,13 @@ def convert_relative_typespec(t: TypeSpec, node: dict, items: ParsingItems, cont
             return val.operator_fields.result_type
 
         if isinstance(val, NameInstance):
-            ts.name = val.value
+            name = val.value
         else:
-            ts.name = val
-
-    for i in range(len(t.subtypes)):
-        ts.subtypes.append(convert_relative_typespec(t.subtypes[i], node, items, context))
+            name = val
 
-    ts.attributes = t.attributes
-    ts.associated_structure = t.associated_structure
+    subtypes = [convert_relative_typespec(subtype, node, items, context) for subtype in t.subtypes]
 
-    return ts
+    return TypeSpec(name, len(subtypes), subtypes, t.attributes, t.associated_structure)
 
 def combine_dictionaries(dict1: dict, dict2: dict) -> dict:
     result = {}
@@ -115,40 +70,20 @@ def combine_dictionaries(dict1: dict, dict2: dict) -> dict:
     return result
 
 
-def extract_scope_items(component: str, is_type: bool, parsed_variables: dict[str, SOInstanceItem]):
-    if not component.startswith('$'):
+def extract_scope_items(items: ScopeItems, is_type: bool, parsed_variables: dict[str, SOInstanceItem]):
+    if items.literal is not None:
         if is_type:
-            return [string_to_typespec(component)]
-        return [component]
-
-    parts = component[1:].split('.')
-    item = parsed_variables[parts[0]]
-
-    stack = [item]
-
-    for p_num in range(1, len(parts)):
-        p = parts[p_num]
-        sub_items = []
-        for stack_item in stack:
-            if stack_item.item_type == ComponentType.REPEATED_ELEMENT:
-                for i in range(len(stack_item.value)):
-                    if p not in stack_item.value[i].components:
-                        raise ValueError(f'item {p_num+1} ({p}) not found in {component}')
-                    sub_item = stack_item.value[i].components[p]
-                    sub_items.append(sub_item)
-            else:
-                if p not in stack_item.value:
-                    raise ValueError(f'item {p_num+1} ({p}) not found in {component}')
-                sub_item = stack_item.value[p]
-                sub_items.append(sub_item)
-        stack = sub_items
+            return [string_to_typespec(items.literal)]
+        return [items.literal]
+
+    stack = items.path.extract(parsed_variables)
 
     variables = []
 
     if is_type:
         for item in stack:
             if not isinstance(item, TypenameInstance):
-                raise ValueError(f'Component path {component} is of type {item.item_type}, not TypeName')
+                raise ValueError(f'Component path {items.path} is of type {item.item_type}, not TypeName')
             variables.append(item.value)
     else:
         for item in stack:
@@ -158,16 +93,41 @@ def extract_scope_items(component: str, is_type: bool, parsed_variables: dict[st
 
 
 class StructureParser:
-    def __init__(self, items: ParsingItems, tokenizer_items: TokenizerItems):
+    def __init__(self, items: ParsingItems, tokenizer_items: TokenizerItems,
+                 overlay: dict[int, StructureSpecComponent] | None = None):
         self.items = items
         self.tokenizer_items = tokenizer_items
+        self.overlay: dict[int, StructureSpecComponent] = overlay if overlay is not None else {}
+        '''
+        {id of a spec component: the component with the modifiers of the structures being parsed applied}.
+        Replaced rather than changed, so the spec itself is never modified and can be shared between threads.
+        '''
+
+    def __component_spec(self, structure: Structure, name: str) -> StructureSpecComponent:
+        var = structure.component_specs[name]
+        return self.overlay.get(id(var), var) if self.overlay else var
+
+    def __compiled(self, so: StructuredObject) -> CompiledStructure:
+        # specs built by hand are compiled on first use
+        return so.compiled_for(self.tokenizer_items)
+
+    def __identifier_type(self, value: str) -> TokenType | None:
+        """How value is classified, counting the types declared so far in this parse as TokenType.Type"""
+        identifier_type = self.tokenizer_items.identifier_types.get(value)
+        if identifier_type is None and value in self.items.declared_types:
+            return TokenType.Type
+        return identifier_type
 
     def __handle_typename(self, tokens: TokenIterator, context: ParsingContext):
         # get typename, check primitive types
         tn, _ = next(tokens)
+        identifier_type = self.__identifier_type(tn.value)
         # check primitive types - if primitive, return basic TypeSpec
-        if tn.value in self.items.config_spec.primitive_types:
-            return TypenameInstance(ComponentType.TYPENAME, TypeSpec(tn.value, 0, []), tn)
+        if identifier_type == TokenType.PrimitiveType:
+            return TypenameInstance(ComponentType.TYPENAME, string_to_typespec(tn.value), tn)
+        # anything never declared by a create_type structure cannot be a type
+        if identifier_type != TokenType.Type:
+            raise ValueError(f'Invalid type: {tn.value}')
 
         # check variables
         var_type = context.get_global(tn.value)
@@ -176,13 +136,12 @@ class StructureParser:
         if var_type.name != '$type':
             raise ValueError(f'Invalid type: {tn.value}')
 
-        tni = TypenameInstance(ComponentType.TYPENAME, var_type.subtypes[0], tn)
-        tni.value.attributes = var_type.attributes
-        tni.value.associated_structure = var_type.associated_structure
-        return tni
+        value = var_type.subtypes[0].replace(attributes=var_type.attributes,
+                                             associated_structure=var_type.associated_structure)
+        return TypenameInstance(ComponentType.TYPENAME, value, tn)
 
     def __handle_name(self, comp: StructureComponent, structure: Structure, tokens: TokenIterator, context: ParsingContext):
-        var = structure.component_specs[comp.value]
+        var = self.__component_spec(structure, comp.value)
 
         var_type = 'existing-global'
         if 'type' in var.other:
@@ -234,50 +193,35 @@ class StructureParser:
 
     def __handle_expressions(self, tokens: TokenIterator, context: ParsingContext, var_index: int, structure: Structure, parsed_variables):
         comp = structure.component_defs[var_index]
-        var = structure.component_specs[comp.value]
+        var = self.__component_spec(structure, comp.value)
 
-        local = False
-        if 'scope' in var.other:
-            if var.other['scope'] == 'local':
-                local = True
-            elif var.other['scope'] != 'global':
-                raise ParsingTracebackError(f"Unknown scope {var.other['scope']} for expressions")
+        options = var.options
 
         returning_context: ParsingContext | None = None
 
-        if local:
+        if options.local:
             block_context = ParsingContext(context)
             block_context.parent = context
             returning_context = block_context
         else:
             block_context = context
 
-        filter = None
-        if 'filter' in var.other:
-            filter = to_filter(var.other['filter'])
-
-        if 'insert_scope' in var.other:
-            if var.other['insert_scope'] == 'global':
-                raise ValueError("insert_scope can only be used with locally-scoped expressions")
+        filter = options.filter
 
-            ins: list[dict] = var.other['insert_scope']
-            for comp in ins:
-                ct: str = comp['type']
-                cn: str = comp['name']
+        for insertion in options.insert_scope:
+            var_types: list[TypeSpec] = extract_scope_items(insertion.types, True, parsed_variables)
+            var_names: list[str] = extract_scope_items(insertion.names, False, parsed_variables)
 
-                var_types: list[TypeSpec] = extract_scope_items(ct, True, parsed_variables)
-                var_names: list[str] = extract_scope_items(cn, False, parsed_variables)
-
-                if len(var_names) != len(var_types):
-                    if len(var_types) == 1:
-                        var_types = [var_types[0]] * len(var_names)
-                    else:
-                        raise ParsingTracebackError(f'Non-corresponding types and names for scope')
+            if len(var_names) != len(var_types):
+                if len(var_types) == 1:
+                    var_types = [var_types[0]] * len(var_names)
+                else:
+                    raise ParsingTracebackError(f'Non-corresponding types and names for scope')
 
-                for i in range(len(var_names)):
-                    block_context.variables[var_names[i]] = var_types[i]
+            for i in range(len(var_names)):
+                block_context.variables[var_names[i]] = var_types[i]
 
-        sp = StructureParser(self.items, self.tokenizer_items)
+        sp = StructureParser(self.items, self.tokenizer_items, self.overlay)
         if len(structure.component_defs) <= var_index + 1:
             raise ParsingTracebackError(f'Expressions variable in structure must have a following string')
         next_comp_def = structure.component_defs[var_index + 1]
@@ -290,28 +234,25 @@ class StructureParser:
             raise ParsingTracebackError(f'Could not parse expressions')
         return SOInstanceItem(ComponentType.EXPRESSIONS, result, next_token, created_context=returning_context)
 
-    def __handle_repeated_element(self, tokens: TokenIterator, context: ParsingContext, var_index: int, structure: Structure, filter: StructureFilter | None):
+    def __handle_repeated_element(self, tokens: TokenIterator, context: ParsingContext, var_index: int, so: StructuredObject, filter: StructureFilter | None):
+        structure = so.structure
         comp = structure.component_defs[var_index]
-        var = structure.component_specs[comp.value]
-        new_structure = Structure(
-            var.other['components'],
-            comp.inner_structure
-        )
-
         separator = comp.inner_fields['separator']
 
         repeat_end = structure.component_defs[var_index + 1]
         if repeat_end.component_type != StructureComponentType.String:
             raise ParsingTracebackError(f'Variables after repeated structures are not yet supported.')
 
-        sp = StructureParser(self.items, self.tokenizer_items)
+        sp = StructureParser(self.items, self.tokenizer_items, self.overlay)
 
         first_token = tokens.peek()
 
         elements = []
+        inner_object = self.__compiled(so).inner_objects[var_index]
+
         while tokens.peek().value != repeat_end.value:
             try:
-                new_soi = StructuredObjectInstance(StructuredObject("", new_structure), {})
+                new_soi = StructuredObjectInstance(inner_object, {})
                 sp.__parse_single_structure(tokens, new_soi, context, filter=filter, expr_expr_error_on_failure=False)
                 if tokens.peek().value != separator and tokens.peek().value != repeat_end.value:
                     raise ParsingTracebackError(f"Unable to parse component structure at {tokens.peek()}")
@@ -325,41 +266,32 @@ class StructureParser:
 
     def __handle_structure(self, tokens: TokenIterator, context: ParsingContext, var_index: int, structure, parsed_variables: dict[str, SOInstanceItem], filter: StructureFilter | None):
         comp = structure.component_defs[var_index]
-        var = structure.component_specs[comp.value]
+        var = self.__component_spec(structure, comp.value)
         next_structure_name = var.other['structure']
 
         next_structure = self.items.config_spec.structured_objects[next_structure_name]
 
-        originals = {}
-        next_comp_specs = next_structure.structure.component_specs
-        if 'modifiers' in var.other and var.name in var.other['modifiers']:
-            mods = var.other['modifiers'][var.name]
-
-            for item, val in mods.items():
-                if item in next_comp_specs[var.name].other:
-                    originals[item] = next_comp_specs[var.name].other[item]
-                else:
-                    originals[item] = None
-                next_comp_specs[var.name].other[item] = val
+        overlay = self.overlay
+        if var.modifiers is not None and var.name in var.modifiers:
+            target = next_structure.structure.component_specs[var.name]
+            current = overlay.get(id(target), target)
+            self.overlay = {**overlay, id(target): current.with_modifiers(var.modifiers[var.name])}
 
         next_soi = StructuredObjectInstance(next_structure, {})
 
         next_token = tokens.peek()
 
-        self.__parse_single_structure(tokens, next_soi, context, parsed_variables, filter=filter)
-
-        for o, val in originals.items():
-            if val is None:
-                del next_comp_specs[var.name].other[o]
-            else:
-                next_comp_specs[var.name].other[o] = val
+        try:
+            self.__parse_single_structure(tokens, next_soi, context, parsed_variables, filter=filter)
+        finally:
+            self.overlay = overlay
 
         return SOInstanceItem(ComponentType.STRUCTURE, next_soi, next_token)
 
     def __handle_variable(
             self,
             var_index: int,
-            structure: Structure,
+            so: StructuredObject,
             tokens: TokenIterator,
             context: ParsingContext,
             parsed_variables: dict[str, SOInstanceItem],
@@ -367,10 +299,11 @@ class StructureParser:
             last_expression_short: bool = False,
             expr_error_on_failure: bool = True
     ):
+        structure = so.structure
         comp = structure.component_defs[var_index]
         if comp.value not in structure.component_specs:
             raise ParsingTracebackError(f"structure component {comp.value} not found")
-        var = structure.component_specs[comp.value]
+        var = self.__component_spec(structure, comp.value)
 
         if var.base == ComponentType.TYPENAME:
             result = self.__handle_typename(tokens, context)
@@ -382,7 +315,7 @@ class StructureParser:
         elif var.base == ComponentType.EXPRESSIONS:
             result = self.__handle_expressions(tokens, context, var_index, structure, parsed_variables)
         elif var.base == ComponentType.REPEATED_ELEMENT:
-            result = self.__handle_repeated_element(tokens, context, var_index, structure, filter)
+            result = self.__handle_repeated_element(tokens, context, var_index, so, filter)
         elif var.base == ComponentType.STRUCTURE:
             result = self.__handle_structure(tokens, context, var_index, structure, parsed_variables, filter)
 
@@ -396,29 +329,29 @@ class StructureParser:
 
         if token.type == TokenType.Integer:
             if '$int' in init_formats:
-                ts = TypeSpec(init_formats['$int'].ref_type, 0, [])
+                ts = string_to_typespec(init_formats['$int'].ref_type)
                 return ValueToken(token, ts, None)
             raise ParsingTracebackError(f'No initializer format for int')
 
         if token.type == TokenType.Float:
             if '$float' in init_formats:
-                ts = TypeSpec(init_formats['$float'].ref_type, 0, [])
+                ts = string_to_typespec(init_formats['$float'].ref_type)
                 return ValueToken(token, ts, None)
             raise ParsingTracebackError(f'No initializer format for float')
 
         if token.type == TokenType.String:
             if '$string' in init_formats:
-                ts = TypeSpec(init_formats['$string'].ref_type, 0, [])
+                ts = string_to_typespec(init_formats['$string'].ref_type)
                 return ValueToken(token, ts, None)
             raise ParsingTracebackError(f'No initializer format for string')
 
         if token.type == TokenType.ValueKeyword:
             if token.value in init_formats:
-                ts = TypeSpec(init_formats[token.value].ref_type, 0, [])
+                ts = string_to_typespec(init_formats[token.value].ref_type)
                 return ValueToken(token, ts, None)
             raise ParsingTracebackError(f'No initializer format for {token.value}')
 
-        if token.type == TokenType.Identifier:
+        if token.type == TokenType.Identifier or token.type == TokenType.Type:
             v = context.get_global(token.value)
             if v is None:
                 raise ParsingTracebackError(f'{token} not defined at line {token.line}')
@@ -519,26 +452,7 @@ class StructureParser:
             elif not tree and len(stack) > 0:
                 needs_left = True
 
-            if needs_left:
-                filter_comp1 = StructureFilterComponent(StructureFilterComponentType.OPERATOR_TYPE, "binary")
-                filter_comp2 = StructureFilterComponent(StructureFilterComponentType.OPERATOR_TYPE, "unary_left")
-
-                filter_unwanted1 = StructureFilterComponent(StructureFilterComponentType.OPERATOR_TYPE, "internal")
-                filter_unwanted2 = StructureFilterComponent(StructureFilterComponentType.OPERATOR_TYPE, "unary_right")
-            else:
-                filter_comp1 = StructureFilterComponent(StructureFilterComponentType.OPERATOR_TYPE, "internal")
-                filter_comp2 = StructureFilterComponent(StructureFilterComponentType.OPERATOR_TYPE, "unary_right")
-
-                filter_unwanted1 = StructureFilterComponent(StructureFilterComponentType.OPERATOR_TYPE, "binary")
-                filter_unwanted2 = StructureFilterComponent(StructureFilterComponentType.OPERATOR_TYPE, "unary_left")
-
-            af = active_filter.clone()
-            af.add_filter(filter_comp1)
-            af.add_filter(filter_comp2)
-            af.remove_filter(filter_unwanted1)
-            af.remove_filter(filter_unwanted2)
-
-            af.allow_expressions = True
+            af = active_filter.operator_variant(needs_left)
 
             structures = self.__create_structure_list(tokens, context, af, skip_first_expressions=True)
 
@@ -606,7 +520,7 @@ class StructureParser:
                            until="",
                            error_on_failure=True) -> ValueToken | StructuredObjectInstance | ParsingTracebackError:
         if not filter:
-            filter = StructureFilter()
+            filter = NO_FILTER
 
         stack = []
 
@@ -655,6 +569,7 @@ class StructureParser:
         structure_count = from_index
         reference_parsed_variables = referenced_parsed_variables or {}
         structure = soi.so.structure
+        literal_tokens = self.__compiled(soi.so).literal_tokens
 
         while structure_count < len(structure.component_defs) and not tokens.done():
             s = structure.component_defs[structure_count]
@@ -664,7 +579,7 @@ class StructureParser:
                 combined_vars = combine_dictionaries(reference_parsed_variables, soi.components)
                 n, v = self.__handle_variable(
                     structure_count,
-                    structure,
+                    soi.so,
                     tokens,
                     context,
                     combined_vars,
@@ -677,11 +592,10 @@ class StructureParser:
                 structure_count += 1
 
             elif s.component_type == StructureComponentType.String:
-                string_tokens = Tokenizer(self.tokenizer_items).tokenize(s.value)
-                for token in string_tokens:
+                for value in literal_tokens[structure_count]:
                     tn, _ = next(tokens)
-                    if tn.value != token.value:
-                        raise ParsingTracebackError(f'Error on {soi.so.name} Expected {token.value}, got {tn.value} at line {tn.line}')
+                    if tn.value != value:
+                        raise ParsingTracebackError(f'Error on {soi.so.name} Expected {value}, got {tn.value} at line {tn.line}')
                 structure_count += 1
 
     def __create_structure_list(self, tokens: TokenIterator, context: ParsingContext, filter: StructureFilter | None = None, skip_first_expressions: bool = False) -> list[StructuredObjectInstance]:
@@ -692,37 +606,37 @@ class StructureParser:
 
         is_filtering = filter and not filter.all
 
-        for so in self.items.config_spec.structured_objects.values():
-            if so.expression_only and ((filter is None) or (filter and not filter.allow_expressions)):
-                continue
-            if is_filtering and not filter.matches(so):
-                continue
+        identifier_type = self.__identifier_type(token.value)
+        index = self.items.structure_index(self.tokenizer_items)
+        candidates = index.candidates(
+            token.value,
+            identifier_type == TokenType.PrimitiveType or identifier_type == TokenType.Type,
+            context.has_global(token.value),
+            skip_first_expressions,
+            filter.mask(index) if is_filtering else None,
+            filter is not None and filter.allow_expressions
+        )
+
+        for so in candidates:
             if len(so.structure.component_defs) == 0 or (not is_filtering and so.dependent):
                 continue
-            first_component = so.structure.component_defs[0]
-
-            if skip_first_expressions:
-                for ind, d in enumerate(so.structure.component_defs):
-                    if d.component_type != StructureComponentType.Variable or \
-                            so.structure.component_specs[d.value].base != ComponentType.EXPRESSION:
-                        first_component = d
-                        break
+            compiled = self.__compiled(so)
+            first_index = compiled.first_component_index if skip_first_expressions else 0
+            first_component = so.structure.component_defs[first_index]
 
             if first_component.component_type == StructureComponentType.String:
-                # tokenize
-                tokenizer = Tokenizer(self.tokenizer_items)
-                string_tokens = tokenizer.tokenize(first_component.value)
-
+                # multi-character operators are single tokens, so most literals are one token long;
+                # literals made of several tokens must be written without spaces between them
                 cur_index = tokens.current_index()
                 wanted_char = token.char
                 works = True
 
-                for ind, tok in enumerate(string_tokens):
+                for ind, value in enumerate(compiled.literal_tokens[first_index]):
                     t = tokens.peek(cur_index + ind)
-                    if tok.value != t.value or (wanted_char and t.char != wanted_char):
+                    if t is None or value != t.value or (ind and t.char != wanted_char):
                         works = False
                         break
-                    wanted_char += len(tok.value)
+                    wanted_char = t.char + len(value)
 
                 if works:
                     soi = StructuredObjectInstance(so, {})
@@ -744,11 +658,11 @@ class StructureParser:
                         continue
 
                 elif spec_component.base == ComponentType.TYPENAME:
-                    if token.value in self.items.config_spec.primitive_types:
+                    if identifier_type == TokenType.PrimitiveType:
                         component_dict = {spec_component.name: token}
                         soi = StructuredObjectInstance(so, component_dict)
                         possible_structures.append(soi)
-                    else:
+                    elif identifier_type == TokenType.Type:
                         v = context.get_global(token.value)
                         if v is not None and v.name == "$type":
                             component_dict = {spec_component.name: token}
@@ -791,19 +705,28 @@ class StructureParser:
 
         errors_found = []
 
+        index = self.items.structure_index(self.tokenizer_items)
+        expressions_allowed = active_filter is not None and active_filter.allow_expressions
+
         for structure in structures:
-            start_index = 0
-            if skip_first_expressions:
-                for d in structure.so.structure.component_defs:
-                    if d.component_type != StructureComponentType.Variable:
-                        break
-                    if structure.so.structure.component_specs[d.value].base == ComponentType.EXPRESSION:
-                        start_index += 1
-                    else:
-                        break
+            start_index = self.__compiled(structure.so).num_lefts if skip_first_expressions else 0
+
+            # rejected by looking a few tokens ahead, without parsing
+            if not index.lookahead_matches(structure.so, tokens, skip_first_expressions, self.items.declared_types):
+                token = tokens.peek()
+                errors_found.append(ParsingTracebackError(
+                    f"{structure.so.name} error",
+                    ParsingTracebackError(f'Unexpected {token.value} at line {token.line}')
+                ))
+                continue
 
             try:
                 self.__parse_single_structure(tokens, structure, context, from_index=start_index, filter=active_filter, last_expression_short=last_expression_short)
+                # no other candidate can parse from these tokens, so there is nothing to compare against
+                if index.commits_on_match(structure.so, skip_first_expressions, expressions_allowed):
+                    end_index = tokens.index
+                    tokens.goto(cur_index)
+                    return structure, end_index
                 working_structures.append(structure)
                 token_nums.append(tokens.index)
             except ParsingTracebackError as e:
@@ -881,16 +804,17 @@ class StructureParser:
                         self.items,
                         context
                     )
-                    if not typespec_matches(t, so_type):
+                    if not typespec_matches(t, so_type, self.items.type_hierarchy()):
                         if tokens.peek() is None:
                             tokens.goto(tokens.current_index() - 1)
                         raise ParsingTracebackError(f"Type mismatch: {t} != {so_type.name} on line {tokens.peek().line}")
 
-                if cv.attributes:
-                    so_type.attributes = {}
-                    for key, path in cv.attributes.items():
-                        component = extract_scope_items(path, True, max_soi_vars)
-                        so_type.attributes[key] = component
+                if cv.attribute_items:
+                    attributes = {}
+                    for key, items in cv.attribute_items.items():
+                        component = extract_scope_items(items, True, max_soi_vars)
+                        attributes[key] = component
+                    so_type = so_type.replace(attributes=attributes)
 
                 context.variables[name] = so_type
 
@@ -906,22 +830,22 @@ class StructureParser:
 
                 if not check_valid_type(type_type, self.items, context, exclude=type_type.name):
                     raise ParsingTracebackError(f"Invalid type {type_type} for {max_soi.so.name}")
-                full_typespec = TypeSpec("$type", 1, [type_type])
-
                 # get attributes
-                for container in max_soi.so.create_type.fields_containers:
-                    parts = container.replace(' ', '').split('.')
-                    item = max_soi_vars[parts[0]]
-                    for part in parts[1:]:
-                        item = item.value.components[part]
+                attributes = {}
+                for container in max_soi.so.create_type.fields_container_paths:
+                    item = container.extract(max_soi_vars)[0]
                     cont_context = item.created_context
                     if cont_context is None:
                         raise ParsingTracebackError(f"Field container {container} does not have a context defined. Change this item to have local scope.")
                     for var_name, var_type in cont_context.variables.items():
-                        full_typespec.attributes[var_name] = var_type
+                        attributes[var_name] = var_type
 
-                full_typespec.associated_structure = max_soi.so
+                full_typespec = TypeSpec("$type", 1, [type_type], attributes, max_soi.so)
 
                 context.variables[type_type.name] = full_typespec
+                types = self.items.type_hierarchy()
+                if type_type.name not in types:
+                    types.declare(type_type.name)
+                self.items.declared_types.add(type_type.name)
 
         return ast_nodes
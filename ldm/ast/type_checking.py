@@ -1,10 +1,17 @@
+from typing import Mapping
+
 from ldm.ast.parsing_types import ParsingItems, ValueToken, StructuredObjectInstance, ParsingContext, NameInstance, \
     TypenameInstance
-from ldm.lib_config2.parsing_types import TypeSpec, ComponentType, ConfigTypeSpec
+from ldm.lib_config2.parsing_types import TypeSpec, ComponentType, ConfigTypeSpec, TypeHierarchy, OperatorOverload, \
+    OverloadDispatch, ComponentPath, VariableTypePath
 
 
-def typespec_matches(t1: TypeSpec, t2: TypeSpec) -> bool:
-    if t1.name != t2.name:
+def typespec_matches(t1: TypeSpec, t2: TypeSpec, types: TypeHierarchy | None = None) -> bool:
+    """Whether t1 matches t2. Given types, t1 may also be a subtype of t2, but their subtypes must match exactly."""
+    # type specs are interned, so equal types are the same object
+    if t1 is t2:
+        return True
+    if t1.name != t2.name and (types is None or not types.is_subtype(t1.name, t2.name)):
         return False
     if t1.num_subtypes != t2.num_subtypes:
         return False
@@ -20,8 +27,9 @@ def typespec_matches(t1: TypeSpec, t2: TypeSpec) -> bool:
             return False
     return True
 
-def extract_generics(overload_type: ConfigTypeSpec, actual_type: TypeSpec, op: StructuredObjectInstance, parsing_context: ParsingContext) -> dict[str, TypeSpec] | None:
-    if isinstance(actual_type, list) and not overload_type.name.startswith('$typename_attributes'):
+def extract_generics(overload_type: ConfigTypeSpec, actual_type: TypeSpec, op: StructuredObjectInstance, parsing_context: ParsingContext,
+                     variable_types: Mapping[TypeSpec, VariableTypePath]) -> dict[str, TypeSpec] | None:
+    if isinstance(actual_type, (list, tuple)) and not overload_type.name.startswith('$typename_attributes'):
         return None
 
     generics_map = {}
@@ -35,20 +43,24 @@ def extract_generics(overload_type: ConfigTypeSpec, actual_type: TypeSpec, op: S
         else:
             generics_map[generic_name] = actual_type
     elif overload_type.name == '$typename_attributes':
-        overload_inner_type = overload_type.subtypes[0]
-        item = op.extract_from_path(overload_inner_type.name)
+        path = variable_types[overload_type]
+        item = op.extract_from_path(path.variable)
         if len(item) != 1:
             return None
         item = item[0]
         item_type = parsing_context.variables[item.value.value]
-        path_parts = overload_type.path.split('.')
-        for part in path_parts:
+        for part in path.attributes:
+            if isinstance(part, ComponentPath):
+                items = op.extract_from_path(part)
+                if len(items) != 1:
+                    return None
+                part = items[0].value
             if part not in item_type.attributes:
                 return None
             item_type = item_type.attributes[part]
 
-        if isinstance(actual_type, list):
-            if not isinstance(item_type, list) or len(item_type) != len(actual_type):
+        if isinstance(actual_type, (list, tuple)):
+            if not isinstance(item_type, (list, tuple)) or len(item_type) != len(actual_type):
                 return None
             for i in range(len(actual_type)):
                 if not typespec_matches(item_type[i], actual_type[i]):
@@ -61,14 +73,14 @@ def extract_generics(overload_type: ConfigTypeSpec, actual_type: TypeSpec, op: S
             return generics_map
 
     elif overload_type.name == '$typename_attributes_map_full':
-        overload_inner_type = overload_type.subtypes[0]
-        item = op.extract_from_path(overload_inner_type.name)
+        path = variable_types[overload_type]
+        item = op.extract_from_path(path.variable)
         if len(item) != 1:
             return None
         item = item[0]
         item_type = parsing_context.variables[item.value.name]
 
-        keys: list[NameInstance] = op.extract_from_path(overload_type.path)
+        keys: list[NameInstance] = op.extract_from_path(path.keys)
 
         keys_types = []
 
@@ -80,7 +92,7 @@ def extract_generics(overload_type: ConfigTypeSpec, actual_type: TypeSpec, op: S
                 return None
             keys_types.append(item_type.attributes[key.value])
 
-        if not isinstance(actual_type, list) or len(actual_type) != len(keys_types):
+        if not isinstance(actual_type, (list, tuple)) or len(actual_type) != len(keys_types):
             return None
 
         return generics_map
@@ -92,7 +104,7 @@ def extract_generics(overload_type: ConfigTypeSpec, actual_type: TypeSpec, op: S
     if len(overload_type.subtypes) != len(actual_type.subtypes):
         return None
     for i in range(len(overload_type.subtypes)):
-        g = extract_generics(overload_type.subtypes[i], actual_type.subtypes[i], op, parsing_context)
+        g = extract_generics(overload_type.subtypes[i], actual_type.subtypes[i], op, parsing_context, variable_types)
         if g is None:
             return None
         for key in g.keys():
@@ -104,14 +116,54 @@ def extract_generics(overload_type: ConfigTypeSpec, actual_type: TypeSpec, op: S
 
     return generics_map
 
+def match_overload(overload: OperatorOverload, types: dict[str, TypeSpec | list[TypeSpec]], op: StructuredObjectInstance,
+                   parsing_context: ParsingContext) -> dict[str, TypeSpec] | None:
+    """The generics of overload when called with types, or None if it does not take them"""
+    if len(overload.variables) != len(types):
+        return None
+
+    generics_map = {}
+    for key in types.keys():
+        g = extract_generics(overload.variables[key], types[key], op, parsing_context, overload.variable_types)
+        if g is None:
+            return None
+        for name in g.keys():
+            if name in generics_map:
+                if not typespec_matches(generics_map[name], g[name]):
+                    return None
+            else:
+                generics_map[name] = g[name]
+    return generics_map
+
+def resolve_overload(dispatch: OverloadDispatch, types: dict[str, TypeSpec | list[TypeSpec]], op: StructuredObjectInstance,
+                     parsing_context: ParsingContext) -> tuple[tuple[OperatorOverload, dict[str, TypeSpec]] | None, bool]:
+    """
+    The first overload in spec order taking types, with its generics, and whether the match read
+    variables in scope, in which case it cannot be reused for other operators with the same types.
+    """
+    signature = dispatch.signature(types)
+    exact = dispatch.exact.get(signature) if signature is not None else None
+    uses_context = False
+    # generic overloads listed before the exact one still take precedence
+    for ordinal, overload, overload_uses_context in dispatch.generic:
+        if exact is not None and ordinal > exact[0]:
+            break
+        uses_context = uses_context or overload_uses_context
+        generics_map = match_overload(overload, types, op, parsing_context)
+        if generics_map is not None:
+            return (overload, generics_map), uses_context
+    if exact is not None:
+        return (exact[1], {}), uses_context
+    return None, uses_context
+
 def type_operator(op: StructuredObjectInstance, parsing_items: ParsingItems, parsing_context: ParsingContext):
     types: dict[str, TypeSpec | list[TypeSpec]] = {}
 
-    var_components = op.so.create_operator.fields
+    field_paths = op.so.create_operator.field_paths
 
-    for i, val_name in enumerate(var_components):
-        if '.' in val_name:
-            comp = op.extract_from_path(val_name)
+    for val_name, path in field_paths.items():
+        if len(path.parts) > 1:
+            comp = op.extract_from_path(path)
         else:
             comp = op.components[val_name]
         if isinstance(comp, StructuredObjectInstance):
@@ -136,54 +188,38 @@ def type_operator(op: StructuredObjectInstance, parsing_items: ParsingItems, par
         else:
             raise ValueError(f"Unexpected component type {comp}")
 
-    generics_map = {}
-
-    for overload in op.so.create_operator.overloads:
-        if len(overload.variables) != len(types):
-            continue
-
-        works = True
-        for key in types.keys():
-            v = types[key]
-            g = extract_generics(overload.variables[key], v, op, parsing_context)
-            if g is None:
-                works = False
-                break
-            for key in g.keys():
-                if key in generics_map:
-                    if not typespec_matches(generics_map[key], g[key]):
-                        works = False
-                        break
-                else:
-                    generics_map[key] = g[key]
-
-        if works:
-            if overload.return_type.name == '$typename':
-                op.operator_fields.result_type = generics_map[overload.return_type.subtypes[0].name]
-            elif overload.return_type.name == '$typename_field':
-                inner_type = overload.return_type.subtypes[0]
-                path = overload.return_type.path.split('.')
-                item = op.extract_from_path(inner_type.name)
-                if len(item) != 1:
-                    raise ValueError(f"Could not find item {inner_type.name[1:]}")
-                item = item[0]
-                item_type = parsing_context.variables[item.value.value]
-
-                for part in path:
-                    if part.startswith('$'):
-                        items = op.extract_from_path(part)
-                        if len(items) != 1:
-                            raise ValueError(f"Could not find item {part}")
-                        item = items[0]
-                        part = item.value
-                    if part not in item_type.attributes:
-                        raise ValueError(f"Could not find attribute {part}")
-                    item_type = item_type.attributes[part]
-                op.operator_fields.result_type = item_type
-            else:
-                op.operator_fields.result_type = overload.return_type
-            return
-
-    raise ValueError(f"No overload found for operator {op.so.name} with types {types}")
-
+    # argument types are interned, so equal combinations have equal keys
+    memo_key = (op.so.name, tuple(tuple(t) if isinstance(t, list) else t for t in types.values()))
+    resolved = parsing_items.resolved_overloads.get(memo_key)
+    if resolved is None:
+        resolved, uses_context = resolve_overload(op.so.create_operator.get_dispatch(), types, op, parsing_context)
+        if resolved is not None and not uses_context:
+            parsing_items.resolved_overloads[memo_key] = resolved
+
+    if resolved is None:
+        raise ValueError(f"No overload found for operator {op.so.name} with types {types}")
+
+    overload, generics_map = resolved
+    if overload.return_type.name == '$typename':
+        op.operator_fields.result_type = generics_map[overload.return_type.subtypes[0].name]
+    elif overload.return_type.name == '$typename_field':
+        path = overload.variable_types[overload.return_type]
+        item = op.extract_from_path(path.variable)
+        if len(item) != 1:
+            raise ValueError(f"Could not find item {path.variable.head}")
+        item = item[0]
+        item_type = parsing_context.variables[item.value.value]
 
+        for part in path.attributes:
+            if isinstance(part, ComponentPath):
+                items = op.extract_from_path(part)
+                if len(items) != 1:
+                    raise ValueError(f"Could not find item {part}")
+                item = items[0]
+                part = item.value
+            if part not in item_type.attributes:
+                raise ValueError(f"Could not find attribute {part}")
+            item_type = item_type.attributes[part]
+        op.operator_fields.result_type = item_type
+    else:
+        op.operator_fields.result_type = overload.return_type
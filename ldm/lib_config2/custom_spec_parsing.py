@@ -1,5 +1,7 @@
 from __future__ import annotations
 from dataclasses import dataclass
+from typing import Any
+import re
 
 '''
 @ creates an object
@@ -15,6 +17,205 @@ class ConfigObject:
     object_type: str
     object_direct_arguments: list[str]
     object_arguments: list[str]
-    object_properties: dict[str, ConfigObject]
+    object_properties: list[ConfigObject] | None
+    '''Objects inside the braces, in order. None if the object has no braces.'''
+    line: int = 0
+    '''Line the object starts on, for errors'''
 
+    def get_property(self, name: str) -> ConfigObject | None:
+        """First property with the given type, or None"""
+        for prop in self.object_properties or []:
+            if prop.object_type == name:
+                return prop
+        return None
 
+
+WHITESPACE = re.compile(r'\s*')
+WORD = re.compile(r'[^\s@{}\[\]]+')
+OBJECT_TYPE = re.compile(r'@([^\s@{}\[\]()]+)')
+
+
+def line_at(source: str, index: int) -> int:
+    """Line of index in source. Counts from the start, so only used for errors."""
+    return source.count('\n', 0, index) + 1
+
+
+def parse_config(source: str) -> list[ConfigObject]:
+    """Parses the top-level objects of a .ldm_spec / .ldm_def source in a single pass"""
+    roots: list[ConfigObject] = []
+    open_objects: list[ConfigObject] = []
+    '''objects whose braces are open, innermost last'''
+    current: ConfigObject | None = None
+    '''object whose arguments are being read'''
+
+    line = 1
+    counted = 0
+    '''index up to which newlines are counted into line, which only moves forward'''
+
+    i = WHITESPACE.match(source, 0).end()
+    n = len(source)
+    while i < n:
+        c = source[i]
+        if c == '@':
+            m = OBJECT_TYPE.match(source, i)
+            if m is None:
+                raise ValueError(f"Expected an object name after @ at line {line_at(source, i)}")
+            line += source.count('\n', counted, i)
+            counted = i
+            current = ConfigObject(m.group(1), [], [], None, line)
+            i = m.end()
+            if i < n and source[i] == '(':
+                close = source.find(')', i)
+                if close == -1:
+                    raise ValueError(f"Unclosed ( at line {line_at(source, i)}")
+                current.object_direct_arguments = source[i + 1:close].split()
+                i = close + 1
+            (open_objects[-1].object_properties if open_objects else roots).append(current)
+        elif c == '{':
+            if current is None or current.object_properties is not None:
+                raise ValueError(f"{{ does not follow an object at line {line_at(source, i)}")
+            current.object_properties = []
+            open_objects.append(current)
+            current = None
+            i += 1
+        elif c == '}':
+            if not open_objects:
+                raise ValueError(f"Unmatched }} at line {line_at(source, i)}")
+            open_objects.pop()
+            current = None
+            i += 1
+        elif c == '[':
+            # strings may contain brackets, as long as they are balanced
+            depth = 0
+            j = i
+            while j < n:
+                if source[j] == '[':
+                    depth += 1
+                elif source[j] == ']':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                j += 1
+            if j == n:
+                raise ValueError(f"Unclosed [ at line {line_at(source, i)}")
+            if current is None:
+                raise ValueError(f"String outside of an object at line {line_at(source, i)}")
+            current.object_arguments.append(source[i + 1:j].strip())
+            i = j + 1
+        elif c == ']':
+            raise ValueError(f"Unmatched ] at line {line_at(source, i)}")
+        else:
+            m = WORD.match(source, i)
+            if current is None:
+                raise ValueError(f"{m.group()} is outside of an object at line {line_at(source, i)}")
+            current.object_arguments.append(m.group())
+            i = m.end()
+        i = WHITESPACE.match(source, i).end()
+
+    if open_objects:
+        raise ValueError(f"@{open_objects[-1].object_type} at line {open_objects[-1].line} is never closed")
+    return roots
+
+
+LIST_PROPERTIES: dict[str, tuple[str | None, str | None] | None] = {
+    'components': ('base', 'name'),
+    'insert_scope': ('type', 'name'),
+    'filter': ('type', None),
+    'filters': ('type', None),
+    'methods': (None, 'name'),
+    'arguments': (None, 'name'),
+    'fields': None,
+    'overload_fields': None,
+    'fields_containers': None,
+}
+'''
+Properties holding lists, with how their entries @kind argument { ... } are converted:
+(key of the kind, key of the argument). A None kind key drops the kind, and a None argument key stores the
+argument under the kind, like {"type": "structure", "structure": argument}. Lists without an entry
+format hold the arguments of the property.
+'''
+NAMED_PROPERTIES = frozenset(['attributes', 'modifiers', 'component_structures'])
+'''Properties whose own properties are named by the spec author, so are never list properties'''
+BOOLEAN_PROPERTIES = frozenset(['constructor', 'optional', 'dependent', 'expression_only', 'allow'])
+INTEGER_PROPERTIES = frozenset(['precedence'])
+
+
+def config_scalar(obj: ConfigObject, value: str) -> str | int | bool:
+    key = obj.object_type
+    if key in INTEGER_PROPERTIES:
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"@{key} at line {obj.line} must be an integer, not {value}")
+    if key in BOOLEAN_PROPERTIES and value in ('true', 'false'):
+        return value == 'true'
+    return value
+
+
+def config_properties(obj: ConfigObject, named: bool = False) -> dict[str, Any]:
+    result = {}
+    for prop in obj.object_properties:
+        if prop.object_type in result:
+            raise ValueError(f"@{prop.object_type} is set twice in @{obj.object_type} at line {obj.line}")
+        result[prop.object_type] = config_value(prop, named)
+    return result
+
+
+def config_entry(obj: ConfigObject, keys: tuple[str | None, str | None]) -> dict[str, Any]:
+    kind_key, argument_key = keys
+    if len(obj.object_arguments) > 1:
+        raise ValueError(f"@{obj.object_type} at line {obj.line} takes at most one argument")
+    entry = {}
+    if kind_key is not None:
+        entry[kind_key] = obj.object_type
+    if obj.object_arguments:
+        entry[argument_key or obj.object_type] = obj.object_arguments[0]
+    if obj.object_properties is not None:
+        entry.update(config_properties(obj))
+    return entry
+
+
+def config_value(obj: ConfigObject, named: bool = False) -> Any:
+    """
+    The JSON value of a property. Properties with braces become dicts, or lists for list properties;
+    properties without become their argument, a list of their arguments, or true if they have none.
+    """
+    if obj.object_direct_arguments:
+        raise ValueError(f"@{obj.object_type} at line {obj.line} cannot take direct arguments in a spec")
+
+    key = obj.object_type
+    if not named and key in LIST_PROPERTIES:
+        entry_keys = LIST_PROPERTIES[key]
+        if obj.object_properties is None:
+            return list(obj.object_arguments)
+        if obj.object_arguments or (entry_keys is None and obj.object_properties):
+            raise ValueError(f"@{key} at line {obj.line} must hold either arguments or entries")
+        return [config_entry(entry, entry_keys) for entry in obj.object_properties]
+
+    if obj.object_properties is not None:
+        if obj.object_arguments:
+            raise ValueError(f"@{key} at line {obj.line} cannot have both arguments and properties")
+        return config_properties(obj, named=not named and key in NAMED_PROPERTIES)
+    if len(obj.object_arguments) == 0:
+        return True
+    if len(obj.object_arguments) == 1:
+        return config_scalar(obj, obj.object_arguments[0])
+    return [config_scalar(obj, a) for a in obj.object_arguments]
+
+
+def config_to_items(objects: list[ConfigObject]) -> list[dict[str, Any]]:
+    """
+    Converts top-level objects @type name { ... } to the items parse_spec and
+    add_structure_definitions_to_spec take, like {"type": type, "name": name, ...}
+    """
+    return [config_entry(obj, ('type', 'name')) for obj in objects]
+
+
+def read_config_file(filename: str) -> list[dict[str, Any]]:
+    """The spec or definition items in a .ldm_spec / .ldm_def file"""
+    with open(filename) as f:
+        source = f.read()
+    try:
+        return config_to_items(parse_config(source))
+    except ValueError as e:
+        raise ValueError(f"{filename}: {e}") from e
@@ -167,6 +167,40 @@ def add_def_to_structured(type: str, arg: dict[str, Any], spec: Spec):
         so.create_operator.precedence = aco['precedence']
 
 
+def structure_signature(defs: list[StructureComponent], specs: dict[str, StructureSpecComponent]) -> tuple:
+    """What a structure matches: its literals and the kinds of its variables, ignoring variable names"""
+    signature = []
+    for d in defs:
+        if d.component_type != StructureComponentType.Variable:
+            signature.append((d.component_type, d.value))
+            continue
+        spec_component = specs[d.value]
+        inner = None
+        if d.inner_structure is not None:
+            inner = (structure_signature(d.inner_structure, spec_component.other['components']),
+                     (d.inner_fields or {}).get('separator'))
+        signature.append((d.component_type, spec_component.base, spec_component.other.get('structure'), inner))
+    return tuple(signature)
+
+
+def check_structures(spec: Spec):
+    """
+    Raises a ValueError if two structures have the same structure, since the parser would only ever pick
+    the first. Operators that only share a trigger and operator type are reported as ambiguities by
+    the StructureIndex instead.
+    """
+    signatures: dict[tuple, str] = {}
+    for so in spec.structured_objects.values():
+        defs = so.structure.component_defs
+        if len(defs) == 0:
+            continue
+
+        signature = structure_signature(defs, so.structure.component_specs)
+        if signature in signatures:
+            raise ValueError(f"Structures {signatures[signature]} and {so.name} have the same structure")
+        signatures[signature] = so.name
+
+
 def add_structure_definitions_to_spec(spec: Spec, args: list[dict[str, str]]):
     for arg in args:
         comp_type = arg['type']
@@ -182,3 +216,5 @@ def add_structure_definitions_to_spec(spec: Spec, args: list[dict[str, str]]):
             spec.expression_separators[arg['value']] = es
         else:
             raise ValueError(f"Unknown component type {comp_type}")
+
+    check_structures(spec)
@@ -1,110 +1,194 @@
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from enum import Enum
-from typing import Protocol, Any
+from threading import Lock
+from types import MappingProxyType
+from typing import Protocol, Any, Mapping
+from weakref import WeakValueDictionary
 
 
 # SPECS
-@dataclass
 class TypeSpec:
+    """
+    A type and its subtypes. TypeSpecs are interned and immutable: constructing a TypeSpec equal to an
+    existing one returns that same object, so equal types compare by identity and can be used as dict
+    and set keys. Use replace to get a TypeSpec with some fields changed.
+    Every field is part of a type, path included, and the associated structure is compared by identity:
+    types of two StructuredObjects that are equal but separate objects, such as the same struct declared
+    twice, are different types.
+    """
+    __slots__ = ('name', 'num_subtypes', 'subtypes', 'attributes', 'associated_structure', 'path', '__weakref__')
+
     name: str
     '''name of the type'''
     num_subtypes: int
     '''number of subtypes'''
-    subtypes: list[TypeSpec]
-    '''list of subtypes'''
-    attributes: dict[str, TypeSpec | list[TypeSpec]]
-
-    associated_structure: StructuredObject | None = None
-    def __init__(self, name: str, num_subtypes: int, subtypes: list[TypeSpec], attributes: dict[str, TypeSpec | list[TypeSpec]] | None =None):
-        self.name = name
-        self.num_subtypes = num_subtypes
-        self.subtypes = subtypes
-        self.attributes = attributes or {}
-
-    def extract_from_path(self, path: str) -> str | TypeSpec:
-        if path == "":
-            return self
-
-        path_parts = path.split('.')
+    subtypes: tuple[TypeSpec, ...]
+    '''subtypes, in order'''
+    attributes: Mapping[str, TypeSpec | tuple[TypeSpec, ...]]
+    '''read-only map of attribute names to types, with lists of types stored as tuples'''
+    associated_structure: StructuredObject | None
+    path: str
+    '''path after the closing bracket in a spec, like attr in $typename_attributes<$var>.attr'''
+
+    _interned: WeakValueDictionary = WeakValueDictionary()
+    _intern_lock = Lock()
+
+    def __new__(cls, name: str, num_subtypes: int, subtypes: list[TypeSpec] | tuple[TypeSpec, ...],
+                attributes: Mapping[str, TypeSpec | list[TypeSpec] | tuple[TypeSpec, ...]] | None = None,
+                associated_structure: StructuredObject | None = None, path: str = ""):
+        subtypes = tuple(subtypes)
+        if num_subtypes != len(subtypes):
+            raise ValueError(f"Type {name} has {len(subtypes)} subtypes, expected {num_subtypes}")
+        attributes = {key: tuple(value) if isinstance(value, list) else value
+                      for key, value in (attributes or {}).items()}
+        # structured objects are not hashable, but the interned TypeSpec keeps its structure alive
+        key = (name, subtypes, frozenset(attributes.items()), id(associated_structure), path)
+
+        with cls._intern_lock:
+            typespec = cls._interned.get(key)
+            if typespec is None:
+                typespec = object.__new__(cls)
+                object.__setattr__(typespec, 'name', name)
+                object.__setattr__(typespec, 'num_subtypes', num_subtypes)
+                object.__setattr__(typespec, 'subtypes', subtypes)
+                object.__setattr__(typespec, 'attributes', MappingProxyType(attributes))
+                object.__setattr__(typespec, 'associated_structure', associated_structure)
+                object.__setattr__(typespec, 'path', path)
+                cls._interned[key] = typespec
+        return typespec
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"TypeSpec is immutable, use replace to change {key}")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"TypeSpec is immutable, cannot delete {key}")
+
+    def __reduce__(self):
+        # unpickling goes through __new__ so loaded types are interned too
+        return TypeSpec, (self.name, self.num_subtypes, self.subtypes, dict(self.attributes),
+                          self.associated_structure, self.path)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def replace(self, **changes) -> TypeSpec:
+        """The interned TypeSpec with the given fields changed, num_subtypes following subtypes"""
+        fields = {
+            'name': self.name,
+            'subtypes': self.subtypes,
+            'attributes': self.attributes,
+            'associated_structure': self.associated_structure,
+            'path': self.path,
+        }
+        fields.update(changes)
+        return TypeSpec(fields['name'], len(fields['subtypes']), fields['subtypes'], fields['attributes'],
+                        fields['associated_structure'], fields['path'])
+
+    def extract_from_path(self, path: TypePath) -> str | TypeSpec:
         current = self
-        for part in path_parts:
-            if part == 'name':
+        for step, arg in path.steps:
+            if step == 'name':
                 return current.name
-            elif part == 'sub':
-                sub_parts = part.split('_')
-                sub_num = int(sub_parts[1])
-                if sub_num >= len(current.subtypes):
-                    raise RuntimeError(f"Subtype {sub_num} does not exist in {current.name}")
-                current = current.subtypes[sub_num]
-            elif part == 'attr':
-                attr_parts = part.split('_')
-                attr_name = attr_parts[1]
-                if attr_name not in current.attributes:
-                    raise RuntimeError(f"Attribute {attr_name} does not exist in {current.name}")
-                current = current.attributes[attr_name]
+            elif step == 'sub':
+                if arg >= len(current.subtypes):
+                    raise RuntimeError(f"Subtype {arg} does not exist in {current.name}")
+                current = current.subtypes[arg]
+            elif step == 'attr':
+                if arg not in current.attributes:
+                    raise RuntimeError(f"Attribute {arg} does not exist in {current.name}")
+                current = current.attributes[arg]
 
         return current
 
-
-    def __eq__(self, other):
-        if not isinstance(other, TypeSpec):
-            return False
-        if self.name != other.name or self.num_subtypes != other.num_subtypes:
-            return False
-
-        for i in range(self.num_subtypes):
-            if self.subtypes[i] != other.subtypes[i]:
-                return False
-
-        if set(self.attributes.keys()) != set(other.attributes.keys()):
-            return False
-
-        for key, value in self.attributes.items():
-            if value != other.attributes[key]:
-                return False
-
-        return True
-
     def __str__(self):
         return f"{self.name}{'<' + ', '.join([str(i) for i in self.subtypes]) + '>' if self.num_subtypes > 0 else ''}"
 
     def __repr__(self):
         return str(self)
 
-class ConfigTypeSpec(TypeSpec):
-    def __init__(
-            self,
-            name: str,
-            num_subtypes: int,
-            subtypes: list[TypeSpec],
-            attributes: dict[str, TypeSpec | list[TypeSpec]] | None =None,
-            path: str | None = None):
-        super().__init__(name, num_subtypes, subtypes, attributes)
-        self.path: str = path or ""
+
+ConfigTypeSpec = TypeSpec
+'''Type specs read from a spec file, which may have a path. Kept as a name for TypeSpec'''
+
+
+@dataclass(frozen=True)
+class TypePath:
+    """
+    A path into a TypeSpec, like sub_0.attr_x.name, split when the translation loads. Steps are ('sub', index),
+    ('attr', name) or ('name', None), which ends the path.
+    """
+    steps: tuple[tuple[str, Any], ...]
+
+    @staticmethod
+    def parse(path: str) -> TypePath:
+        if path == "":
+            return TypePath(())
+        steps = []
+        for part in path.split('.'):
+            if steps and steps[-1][0] == 'name':
+                raise ValueError(f"Type path {path} continues after name")
+            if part == 'name':
+                steps.append(('name', None))
+            elif part.startswith('sub_') and part[4:].isdigit():
+                steps.append(('sub', int(part[4:])))
+            elif part.startswith('attr_') and len(part) > 5:
+                steps.append(('attr', part[5:]))
+            else:
+                raise ValueError(f"Unknown part {part} in type path {path}")
+        return TypePath(tuple(steps))
+
+
+class Frozen:
+    """Spec object that can be made read-only by Spec.freeze. Setting an attribute of a frozen object raises."""
+    frozen = False
+
+    def __setattr__(self, key, value):
+        if self.frozen:
+            raise AttributeError(f"{type(self).__name__} is frozen, cannot set {key}")
+        object.__setattr__(self, key, value)
+
+
+def freeze_value(value, seen: set[int]):
+    """value with dicts made read-only mappings and lists made tuples, freezing every Frozen object in it"""
+    if isinstance(value, Frozen):
+        if not value.frozen and id(value) not in seen:
+            seen.add(id(value))
+            for key, item in vars(value).items():
+                object.__setattr__(value, key, freeze_value(item, seen))
+            object.__setattr__(value, 'frozen', True)
+        return value
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze_value(item, seen) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_value(item, seen) for item in value)
+    return value
 
 @dataclass
-class MethodArgument:
+class MethodArgument(Frozen):
     name: str
     type: str
     optional: bool
 
 
 @dataclass
-class Method:
+class Method(Frozen):
     name: str
     args: list[MethodArgument]
     return_type: str
 
 
 @dataclass
-class ValueKeyword:
+class ValueKeyword(Frozen):
     name: str
     value_type: str
 
 
 @dataclass
-class StructureComponent:
+class StructureComponent(Frozen):
     component_type: StructureComponentType
     value: str
     inner_structure: list[StructureComponent] | None = None
@@ -122,7 +206,7 @@ class ComponentType(Enum):
 
 
 @dataclass
-class StructureSpecComponent:
+class StructureSpecComponent(Frozen):
     base: ComponentType
     '''Spec component type: typename, name, expression, etc.'''
     name: str
@@ -138,10 +222,28 @@ class StructureSpecComponent:
     repeated_element:
         components: list with more StructureSpecComponents
     '''
+    options: ExpressionsOptions | None = field(default=None, compare=False, repr=False)
+    '''Options of an expressions component, compiled from other when the component is created'''
+    modifiers: dict[str, ComponentModifiers] | None = field(default=None, compare=False, repr=False)
+    '''Modifiers of a structure component, compiled from other, by the name of the component they modify'''
+
+    def __post_init__(self):
+        if self.base == ComponentType.EXPRESSIONS and self.options is None:
+            self.options = ExpressionsOptions(**expressions_options(self.other))
+        if self.base == ComponentType.STRUCTURE and self.modifiers is None and 'modifiers' in self.other:
+            self.modifiers = {name: ComponentModifiers(dict(mods), expressions_options(mods))
+                              for name, mods in self.other['modifiers'].items()}
+
+    def with_modifiers(self, modifiers: ComponentModifiers) -> StructureSpecComponent:
+        """This component as modified by a structure that parses its structure"""
+        options = self.options
+        if options is not None and modifiers.options:
+            options = replace(options, **modifiers.options)
+        return StructureSpecComponent(self.base, self.name, {**self.other, **modifiers.other}, options)
 
 
 @dataclass
-class Structure:
+class Structure(Frozen):
     component_specs: dict[str, StructureSpecComponent]
     component_defs: list[StructureComponent]
 
@@ -152,7 +254,7 @@ class ScopeOptions(Enum):
     GLOBAL = 'global'
 
 @dataclass
-class CreateVariable:
+class CreateVariable(Frozen):
     """
     Components defining how a StructuredObject creates a value (variable).
     This registers a value as a variable *inside the parser* with a given name and type.
@@ -167,9 +269,15 @@ class CreateVariable:
     check_type: str | None
     """The value / expression to check to make sure the typing is correct"""
     attributes: dict[str, str] | None = None
+    attribute_items: dict[str, ScopeItems] | None = field(default=None, compare=False, repr=False)
+    """attributes compiled to the components they refer to"""
+
+    def __post_init__(self):
+        if self.attributes is not None and self.attribute_items is None:
+            self.attribute_items = {key: ScopeItems.parse(path) for key, path in self.attributes.items()}
 
 @dataclass
-class CreateType:
+class CreateType(Frozen):
     """
     Components defining how a StructuredObject creates a type. It makes this component available
     as a type in the selected scope.
@@ -180,23 +288,128 @@ class CreateType:
     """The scope of the component: local or global"""
     fields_containers: list[str] | None = None
     """Variables inside which created variables and types are added to that type's field list."""
+    fields_container_paths: tuple[ComponentPath, ...] = field(default=(), compare=False, repr=False)
+    """fields_containers compiled to component paths"""
+
+    def __post_init__(self):
+        if self.fields_containers and not self.fields_container_paths:
+            self.fields_container_paths = tuple(ComponentPath.parse(c) for c in self.fields_containers)
 
 @dataclass
-class OperatorOverload:
+class OperatorOverload(Frozen):
     name: str
     return_type: ConfigTypeSpec
     variables: dict[str, ConfigTypeSpec]
+    variable_types: dict[TypeSpec, VariableTypePath] | None = field(default=None, compare=False, repr=False)
+    '''Paths of the types in the overload read from variables in scope, like $typename_field<$left>.$right'''
+
+    def __post_init__(self):
+        if self.variable_types is None:
+            self.variable_types = {}
+            for t in [self.return_type, *self.variables.values()]:
+                add_variable_type_paths(t, self.variable_types)
 
     def __str__(self):
         return f"<{self.name}|{self.variables.values()}>"
 
+GENERIC_TYPE_NAMES = frozenset(['$typename', '$typename_attributes', '$typename_attributes_map_full'])
+'''Overload type names that stand for the types of the values they are matched with'''
+CONTEXT_TYPE_NAMES = frozenset(['$typename_attributes', '$typename_attributes_map_full'])
+'''Generic overload type names matched against the attributes of variables in scope'''
+VARIABLE_TYPE_NAMES = CONTEXT_TYPE_NAMES | {'$typename_field'}
+'''Overload type names whose type is read from a variable in scope'''
+
+
+@dataclass(frozen=True)
+class VariableTypePath:
+    """
+    How an overload type like $typename_field<$left>.$right reads its type: the component naming the
+    variable, then the path after the closing bracket
+    """
+    variable: ComponentPath
+    attributes: tuple[str | ComponentPath, ...] = ()
+    '''attributes followed from the variable's type: names, or components whose values are the names'''
+    keys: ComponentPath | None = None
+    '''for $typename_attributes_map_full, the components naming every attribute of the type'''
+
+    @staticmethod
+    def parse(t: TypeSpec) -> VariableTypePath:
+        if t.num_subtypes != 1 or not t.subtypes[0].name.startswith('$'):
+            raise ValueError(f"{t.name} must wrap a $component, not {t}")
+        variable = ComponentPath.parse(t.subtypes[0].name)
+        if t.name == '$typename_attributes_map_full':
+            return VariableTypePath(variable, keys=ComponentPath.parse(t.path))
+        if t.path == "":
+            raise ValueError(f"{t.name}<{t.subtypes[0].name}> must be followed by a path")
+        attributes = tuple(ComponentPath.parse(p) if p.startswith('$') else p for p in t.path.split('.'))
+        return VariableTypePath(variable, attributes)
+
+    def component_paths(self) -> list[ComponentPath]:
+        paths = [self.variable, *(a for a in self.attributes if isinstance(a, ComponentPath))]
+        if self.keys is not None:
+            paths.append(self.keys)
+        return paths
+
+
+def add_variable_type_paths(t: TypeSpec, paths: dict[TypeSpec, VariableTypePath]):
+    if t.name in VARIABLE_TYPE_NAMES:
+        if t not in paths:
+            paths[t] = VariableTypePath.parse(t)
+        return
+    for sub in t.subtypes:
+        add_variable_type_paths(sub, paths)
+
+
+def type_shape(t: TypeSpec) -> tuple:
+    """What a concrete overload type is matched on: the type's name and the shapes of its subtypes"""
+    return t.name, tuple(type_shape(sub) for sub in t.subtypes)
+
+
+def type_uses_names(t: TypeSpec, names: frozenset[str]) -> bool:
+    return t.name in names or any(type_uses_names(sub, names) for sub in t.subtypes)
+
+
+class OverloadDispatch:
+    """
+    Overloads of an operator indexed for type checking. Overloads with only concrete argument types
+    are found by the shapes of the argument types; the rest are kept in a list to be matched in order.
+    Entries hold the overload's ordinal, so the first matching overload in spec order still wins.
+    """
+    def __init__(self, fields: list[str], overloads: list[OperatorOverload]):
+        self.fields = list(fields)
+        self.overload_count = len(overloads)
+        self.exact: dict[tuple, tuple[int, OperatorOverload]] = {}
+        '''{shapes of the argument types, in field order: first overload taking them}'''
+        self.generic: list[tuple[int, OperatorOverload, bool]] = []
+        '''(ordinal, overload, whether matching it reads variables in scope), in spec order'''
+
+        for ordinal, overload in enumerate(overloads):
+            variables = overload.variables
+            if len(variables) == len(self.fields) and all(f in variables for f in self.fields) and \
+                    not any(type_uses_names(variables[f], GENERIC_TYPE_NAMES) for f in self.fields):
+                self.exact.setdefault(tuple(type_shape(variables[f]) for f in self.fields), (ordinal, overload))
+            else:
+                uses_context = any(type_uses_names(t, CONTEXT_TYPE_NAMES) for t in variables.values())
+                self.generic.append((ordinal, overload, uses_context))
+
+    def signature(self, types: dict[str, TypeSpec | list[TypeSpec]]) -> tuple | None:
+        """Key of types in exact, or None if a field holds a list of types, which only generic overloads take"""
+        signature = []
+        for f in self.fields:
+            t = types.get(f)
+            if not isinstance(t, TypeSpec):
+                return None
+            signature.append(type_shape(t))
+        return tuple(signature)
+
+
 class Associativity(Enum):
     LEFT_TO_RIGHT = 0
     RIGHT_TO_LEFT = 1
     NONE = 2
 
 @dataclass
-class CreateOperator:
+class CreateOperator(Frozen):
     fields: list[str]
     '''The fields in the operator's structure that are adjusted for each overload / used to determine the output type'''
 
@@ -210,6 +423,24 @@ class CreateOperator:
     '''The overloads of the operator. Contains the return type and the types of the variables 
     for each combination of types'''
 
+    dispatch: OverloadDispatch | None = field(default=None, compare=False, repr=False)
+    '''Index of the overloads, built by parse_spec or on first use'''
+
+    field_paths: dict[str, ComponentPath] | None = field(default=None, compare=False, repr=False)
+    '''fields compiled to component paths'''
+
+    def __post_init__(self):
+        if self.field_paths is None:
+            self.field_paths = {f: ComponentPath.parse(f) for f in self.fields}
+
+    def get_dispatch(self) -> OverloadDispatch:
+        """The overload index, rebuilt if overloads were added since"""
+        dispatch = self.dispatch
+        if dispatch is None or dispatch.overload_count != len(self.overloads):
+            dispatch = OverloadDispatch(self.fields, self.overloads)
+            self.dispatch = dispatch
+        return dispatch
+
     def overload_matches(self, overload: OperatorOverload):
         """Checks if an overload configuration matches the operator structure"""
         # Get all variable names from structure components
@@ -219,8 +450,38 @@ class CreateOperator:
         # Check if all variables in overload exist in structure
         return structure_vars == overload_vars
 
+class ItemsCache:
+    """
+    Objects built from a spec object for some tokenizer items, such as compilations of a frozen
+    StructuredObject or the StructureIndex of a Spec, keyed by the id of the items. Each object holds its
+    items as tokenizer_items, so an id is not reused while cached. Kept out of freezing, pickling and
+    copies, since the objects are rebuilt on demand.
+    """
+    MAX_ENTRIES = 8
+    '''Tokenizer items kept at once; the cache starts over when it is full'''
+
+    def __init__(self):
+        self.entries: dict[int, Any] = {}
+        self._lock = Lock()
+
+    def get(self, tokenizer_items) -> Any:
+        value = self.entries.get(id(tokenizer_items))
+        if value is not None and value.tokenizer_items is tokenizer_items:
+            return value
+        return None
+
+    def put(self, value):
+        with self._lock:
+            if len(self.entries) >= self.MAX_ENTRIES:
+                self.entries = {}
+            self.entries[id(value.tokenizer_items)] = value
+
+    def __reduce__(self):
+        return ItemsCache, ()
+
+
 @dataclass
-class StructuredObject:
+class StructuredObject(Frozen):
     name: str
     '''Structure name. Used only to keep track of each structure.'''
     structure: Structure
@@ -238,15 +499,115 @@ class StructuredObject:
     '''
     expression_only: bool = False
     """When true, only uses this structure for expressions. Cannot be used as a standalone structure."""
+    compiled: CompiledStructure | None = field(default=None, compare=False, repr=False)
+    """Parse metadata built by compile. Must be rebuilt if the structure is changed afterwards."""
+    compile_cache: ItemsCache = field(default_factory=ItemsCache, compare=False, repr=False)
+    """Compilations for other tokenizer items, kept once the structure is frozen and compiled cannot be replaced"""
+
+    def compile(self, tokenizer_items=None) -> CompiledStructure:
+        """
+        Precomputes everything the parser derives from the structure alone. Literal components are split
+        into tokens with tokenizer_items; without them, literal_tokens is left empty.
+        """
+        structure = self.structure
+        defs = structure.component_defs
+
+        variable_defs = tuple(d for d in defs if d.component_type == StructureComponentType.Variable)
+
+        num_lefts = 0
+        for d in defs:
+            if d.component_type != StructureComponentType.Variable or \
+                    structure.component_specs[d.value].base != ComponentType.EXPRESSION:
+                break
+            num_lefts += 1
+
+        first_is_expression = num_lefts > 0
+        last_is_expression = len(defs) > 0 and defs[-1].component_type == StructureComponentType.Variable and \
+            structure.component_specs[defs[-1].value].base == ComponentType.EXPRESSION
+        if first_is_expression and last_is_expression:
+            operator_type = OperatorType.BINARY
+        elif first_is_expression:
+            operator_type = OperatorType.UNARY_LEFT
+        elif last_is_expression:
+            operator_type = OperatorType.UNARY_RIGHT
+        else:
+            operator_type = OperatorType.INTERNAL
+
+        literal_tokens = None
+        if tokenizer_items is not None:
+            literal_tokens = tuple(tokenizer_items.literal_tokens(d.value)
+                                   if d.component_type == StructureComponentType.String else None
+                                   for d in defs)
+
+        inner_objects = []
+        for d in defs:
+            spec_component = structure.component_specs.get(d.value) \
+                if d.component_type == StructureComponentType.Variable else None
+            if spec_component is not None and spec_component.base == ComponentType.REPEATED_ELEMENT:
+                inner = StructuredObject("", Structure(spec_component.other['components'], d.inner_structure))
+                inner.compile(tokenizer_items)
+                inner_objects.append(inner)
+            else:
+                inner_objects.append(None)
+
+        compiled = CompiledStructure(
+            variable_defs=variable_defs,
+            num_lefts=num_lefts,
+            first_component_index=num_lefts if num_lefts < len(defs) else 0,
+            operator_type=operator_type,
+            literal_tokens=literal_tokens,
+            inner_objects=tuple(inner_objects),
+            tokenizer_items=tokenizer_items
+        )
+        # frozen structures are compiled by Spec.freeze; compilations for other tokenizer items go to the cache
+        if not self.frozen:
+            self.compiled = compiled
+        else:
+            self.compile_cache.put(compiled)
+        return compiled
+
+    def compiled_for(self, tokenizer_items) -> CompiledStructure:
+        """The structure compiled with tokenizer_items, compiling it first if it was not"""
+        compiled = self.compiled
+        if compiled is None or compiled.tokenizer_items is not tokenizer_items:
+            compiled = self.compile_cache.get(tokenizer_items) or self.compile(tokenizer_items)
+        return compiled
+
+    def get_compiled(self, tokenizer_items=None) -> CompiledStructure:
+        """The compiled structure, compiling it first if it was not, or was for other tokenizer items"""
+        if tokenizer_items is None and self.compiled is not None:
+            return self.compiled
+        return self.compiled_for(tokenizer_items)
 
     def get_nth_component(self, n: int):
-        defs = self.structure.component_defs
-        def_vars: list[StructureComponent] = list(
-            filter(lambda v: v.component_type == StructureComponentType.Variable, defs)
-        )
-        sc = def_vars[n]
+        sc = self.get_compiled().variable_defs[n]
         return self.structure.component_specs[sc.value]
 
+
+@dataclass(frozen=True)
+class CompiledStructure:
+    """Parse metadata of a StructuredObject that does not change once the spec is loaded"""
+    variable_defs: tuple[StructureComponent, ...]
+    """Variable components, in structure order"""
+    num_lefts: int
+    """Number of expression components the structure starts with"""
+    first_component_index: int
+    """Index of the first component that is not a leading expression, 0 if every component is one"""
+    operator_type: OperatorType
+    """Operator type the structure has if it creates an operator"""
+    literal_tokens: tuple[tuple[str, ...] | None, ...] | None
+    """Token values of each String component, None for other components"""
+    inner_objects: tuple[StructuredObject | None, ...]
+    """Compiled structure of each repeated element component, None for other components"""
+    tokenizer_items: Any = None
+    """The TokenizerItems literal_tokens were split with"""
+
+
+def compile_structures(spec: Spec, tokenizer_items=None):
+    """Compiles every structured object of spec"""
+    for so in spec.structured_objects.values():
+        so.compile(tokenizer_items)
+
 #### STRUCTURE FILTERS ####
 
 class StructureFilterComponentType(Enum):
@@ -256,6 +617,29 @@ class StructureFilterComponentType(Enum):
     EXCLUDES = "excludes",
     OPERATOR_TYPE = "operator_type"
 
+OPERATOR_FILTER_TYPES = ('binary', 'unary_right', 'unary_left', 'internal')
+
+
+def operator_filter_type(structure: StructuredObject) -> str | None:
+    """
+    Which operator type filter a structure falls under, by whether it starts and ends with an
+    expression, or None if it has no components
+    """
+    defs = structure.structure.component_defs
+    if len(defs) == 0:
+        return None
+
+    def is_expression(component: StructureComponent) -> bool:
+        return component.component_type == StructureComponentType.Variable and \
+            structure.structure.component_specs[component.value].base == ComponentType.EXPRESSION
+
+    first_is_expr = is_expression(defs[0])
+    last_is_expr = is_expression(defs[-1])
+    if first_is_expr:
+        return 'binary' if last_is_expr else 'unary_left'
+    return 'unary_right' if last_is_expr else 'internal'
+
+
 @dataclass
 class StructureFilterComponent:
     type: StructureFilterComponentType
@@ -296,50 +680,37 @@ class StructureFilterComponent:
         elif self.type == StructureFilterComponentType.OPERATOR_TYPE:
             if not structure.create_operator:
                 return False
-            match self.value:
-                case "binary":
-                    first_val = structure.structure.component_defs[0]
-                    last_val = structure.structure.component_defs[-1]
-                    if first_val.component_type != StructureComponentType.Variable or last_val.component_type != StructureComponentType.Variable:
-                        return False
-
-                    first_is_expr = structure.structure.component_specs[first_val.value].base == ComponentType.EXPRESSION
-                    last_is_expr = structure.structure.component_specs[last_val.value].base == ComponentType.EXPRESSION
-                    return first_is_expr and last_is_expr
-                case "unary_right":
-                    first_val = structure.structure.component_defs[0]
-                    if first_val.component_type == StructureComponentType.Variable:
-                        if structure.structure.component_specs[first_val.value].base == ComponentType.EXPRESSION:
-                            return False
-
-                    last_val = structure.structure.component_defs[-1]
-                    if last_val.component_type != StructureComponentType.Variable:
-                        return False
-                    return structure.structure.component_specs[last_val.value].base == ComponentType.EXPRESSION
-                case "unary_left":
-                    last_val = structure.structure.component_defs[-1]
-                    if last_val.component_type == StructureComponentType.Variable:
-                        if structure.structure.component_specs[last_val.value].base == ComponentType.EXPRESSION:
-                            return False
-
-                    first_val = structure.structure.component_defs[0]
-                    if first_val.component_type != StructureComponentType.Variable:
-                        return False
-                    return structure.structure.component_specs[first_val.value].base == ComponentType.EXPRESSION
-
-                case "internal":
-                    first_val = structure.structure.component_defs[0]
-                    last_val = structure.structure.component_defs[-1]
-                    if first_val.component_type == StructureComponentType.Variable:
-                        if structure.structure.component_specs[first_val.value].base == ComponentType.EXPRESSION:
-                            return False
-                    if last_val.component_type == StructureComponentType.Variable:
-                        if structure.structure.component_specs[last_val.value].base == ComponentType.EXPRESSION:
-                            return False
-                    return True
+            if self.value not in OPERATOR_FILTER_TYPES:
+                raise RuntimeError(f"Structure filter does not support operator type query for {self.value}")
+            return operator_filter_type(structure) == self.value
+
+    def mask(self, index) -> int:
+        """Bitmask of the structures this component matches, over the structure ordinals of a StructureIndex"""
+        if self.type == StructureFilterComponentType.AND:
+            mask = index.all_mask
+            for item in self.value:
+                mask &= item.mask(index)
+            return mask
 
-                case _:
-                    raise RuntimeError(f"Structure filter does not support operator type query for {self.value}")
+        elif self.type == StructureFilterComponentType.STRUCTURE:
+            ordinal = index.ordinals.get(self.value)
+            return 0 if ordinal is None else 1 << ordinal
+
+        elif self.type == StructureFilterComponentType.CONTAINS:
+            if self.value not in index.contains_masks:
+                raise RuntimeError(f"Structure filter does not support contains query for {self.value}")
+            return index.contains_masks[self.value]
+
+        elif self.type == StructureFilterComponentType.EXCLUDES:
+            if self.value not in index.contains_masks:
+                raise RuntimeError(f"Structure filter does not support excludes query for {self.value}")
+            return index.all_mask & ~index.contains_masks[self.value]
+
+        elif self.type == StructureFilterComponentType.OPERATOR_TYPE:
+            if self.value not in index.operator_type_masks:
+                raise RuntimeError(f"Structure filter does not support operator type query for {self.value}")
+            return index.operator_type_masks[self.value]
+        return 0
 
     def __eq__(self, other):
         return self.type == other.type and self.value == other.value
@@ -353,12 +724,16 @@ class StructureFilter:
         self.all = all_allowed
         self.allow_expressions = allow_expressions
         self.filters = filters or []
+        # compiled masks and operator variants, reset whenever filters are added or removed
+        self.compiled_mask: tuple | None = None
+        self.variants: dict[bool, StructureFilter] = {}
 
     def clone(self):
         return StructureFilter(self.all, self.allow_expressions, self.filters[:])
 
     def add_filter(self, filter_component: StructureFilterComponent):
         self.filters.append(filter_component)
+        self.__invalidate()
 
     def matches(self, structure: StructuredObject) -> bool:
         if self.all:
@@ -370,11 +745,250 @@ class StructureFilter:
                 return True
         return False
 
+    def mask(self, index) -> int:
+        """
+        Bitmask over the structure ordinals of a StructureIndex of the structures this filter
+        matches, the same as matches. Cached until filters are added or removed.
+        """
+        # one tuple, so a filter shared between threads never pairs a mask with the wrong index
+        compiled = self.compiled_mask
+        if compiled is not None and compiled[0] is index and compiled[1] == self.all and \
+                compiled[2] == self.allow_expressions:
+            return compiled[3]
+
+        if self.all:
+            mask = index.all_mask
+        elif self.allow_expressions and len(self.filters) == 0:
+            mask = 0
+        else:
+            mask = 0
+            for f in self.filters:
+                mask |= f.mask(index)
+
+        self.compiled_mask = (index, self.all, self.allow_expressions, mask)
+        return mask
+
+    def operator_variant(self, needs_left: bool) -> StructureFilter:
+        """
+        This filter with expressions allowed and, if needs_left, only binary and unary_left operators
+        added, or else only internal and unary_right ones. Cached until filters are added or removed.
+        """
+        variant = self.variants.get(needs_left)
+        if variant is not None:
+            return variant
+
+        if needs_left:
+            wanted, unwanted = ("binary", "unary_left"), ("internal", "unary_right")
+        else:
+            wanted, unwanted = ("internal", "unary_right"), ("binary", "unary_left")
+
+        variant = self.clone()
+        for operator_type in wanted:
+            variant.add_filter(StructureFilterComponent(StructureFilterComponentType.OPERATOR_TYPE, operator_type))
+        for operator_type in unwanted:
+            variant.remove_filter(StructureFilterComponent(StructureFilterComponentType.OPERATOR_TYPE, operator_type))
+        variant.allow_expressions = True
+
+        self.variants[needs_left] = variant
+        return variant
+
     def remove_filter(self, ref_filter: StructureFilterComponent):
         self.filters = list(filter(
             lambda x: x != ref_filter,
             self.filters
         ))
+        self.__invalidate()
+
+    def __invalidate(self):
+        self.compiled_mask = None
+        self.variants = {}
+
+
+FILTER_QUERIES = ('create_variable', 'create_type', 'create_operator')
+
+
+def to_filter(filter_list: list[dict] | str) -> StructureFilter:
+    if filter_list == 'all':
+        return StructureFilter(all_allowed=True, allow_expressions=True)
+    if filter_list == 'expressions':
+        return StructureFilter(allow_expressions=True)
+    if isinstance(filter_list, str):
+        raise ValueError(f'Invalid filter: {filter_list}')
+
+    filter = StructureFilter()
+
+    for item in filter_list:
+        item_type = item.get('type')
+        if item_type in ('contains', 'excludes', 'structure') and item_type not in item:
+            raise ValueError(f'Filter {item} must specify {item_type}')
+
+        if item_type == 'contains':
+            if item['contains'] not in FILTER_QUERIES:
+                raise ValueError(f'Structure filter does not support contains query for {item["contains"]}')
+            filter.filters.append(
+                StructureFilterComponent(
+                    StructureFilterComponentType.CONTAINS,
+                    item['contains']
+                )
+            )
+        elif item_type == 'excludes':
+            if item['excludes'] not in FILTER_QUERIES:
+                raise ValueError(f'Structure filter does not support excludes query for {item["excludes"]}')
+            filter.filters.append(
+                StructureFilterComponent(
+                    StructureFilterComponentType.EXCLUDES,
+                    item['excludes']
+                )
+            )
+        elif item_type == 'structure':
+            filter.filters.append(
+                StructureFilterComponent(
+                    StructureFilterComponentType.STRUCTURE,
+                    item['structure']
+                )
+            )
+        elif item_type == 'and':
+            filter.filters.append(
+                StructureFilterComponent(
+                    StructureFilterComponentType.AND,
+                    to_filter(item['filters']).filters
+                )
+            )
+        elif item_type == 'expression':
+            if item.get('allow') not in [True, False]:
+                raise ValueError(f'Invalid allow type: {item.get("allow")}')
+            filter.allow_expressions = item['allow']
+        else:
+            raise ValueError(f'Unknown filter type {item_type}')
+
+    return filter
+
+#### COMPONENT PATHS ####
+
+@dataclass(frozen=True)
+class ComponentPath:
+    """
+    A dotted path to components of a structure instance, like $arguments.type, split once when the spec
+    loads. A step into a repeated element fans out to the component in every repetition.
+    """
+    parts: tuple[str, ...]
+
+    @staticmethod
+    def parse(path: str) -> ComponentPath:
+        if not isinstance(path, str):
+            raise ValueError(f'Invalid component path {path}')
+        parts = tuple(path.replace(' ', '').removeprefix('$').split('.'))
+        if not all(parts):
+            raise ValueError(f'Invalid component path {path}')
+        return ComponentPath(parts)
+
+    @property
+    def head(self) -> str:
+        return self.parts[0]
+
+    def __str__(self):
+        return '$' + '.'.join(self.parts)
+
+    def extract(self, components: Mapping[str, Any]) -> list:
+        """
+        The items at the path in the components of a structure instance, one per repetition of the
+        repeated elements on the way. Raises a ValueError if a component is missing.
+        """
+        if self.parts[0] not in components:
+            raise ValueError(f'item 1 ({self.parts[0]}) not found in {self}')
+        items = [components[self.parts[0]]]
+        for p_num in range(1, len(self.parts)):
+            part = self.parts[p_num]
+            sub_items = []
+            for item in items:
+                elements = item.value if item.item_type == ComponentType.REPEATED_ELEMENT else (item.value,)
+                for element in elements:
+                    if part not in element.components:
+                        raise ValueError(f'item {p_num + 1} ({part}) not found in {self}')
+                    sub_items.append(element.components[part])
+            items = sub_items
+        return items
+
+    def check(self, so: StructuredObject, structured_objects: Mapping[str, StructuredObject]) -> StructureSpecComponent:
+        """The spec component at the path in so. Raises a ValueError if the path does not exist."""
+        components = so.structure.component_specs
+        for part in self.parts[:-1]:
+            if part not in components:
+                raise ValueError(f'Component {part} of path {self} not found in {so.name}')
+            component = components[part]
+            if component.base == ComponentType.REPEATED_ELEMENT:
+                components = component.other['components']
+            elif component.base == ComponentType.STRUCTURE and component.other.get('structure') in structured_objects:
+                components = structured_objects[component.other['structure']].structure.component_specs
+            else:
+                raise ValueError(f'Path {self} in {so.name} continues past {part}, which has no components')
+        if self.parts[-1] not in components:
+            raise ValueError(f'Component {self.parts[-1]} of path {self} not found in {so.name}')
+        return components[self.parts[-1]]
+
+#### EXPRESSIONS OPTIONS ####
+
+@dataclass(frozen=True)
+class ScopeItems:
+    """
+    Types or names an expressions component adds to its scope: a literal, or a $path to components of
+    the structure being parsed
+    """
+    literal: str | None
+    path: ComponentPath | None = None
+
+    @staticmethod
+    def parse(component: str) -> ScopeItems:
+        if not isinstance(component, str):
+            raise ValueError(f'Invalid scope item {component}')
+        if not component.startswith('$'):
+            return ScopeItems(component)
+        return ScopeItems(None, ComponentPath.parse(component))
+
+
+@dataclass(frozen=True)
+class ScopeInsertion:
+    types: ScopeItems
+    names: ScopeItems
+
+
+@dataclass(frozen=True)
+class ExpressionsOptions:
+    """How an expressions component parses its block: the scope, filter and variables added to the scope"""
+    local: bool = False
+    filter: StructureFilter | None = None
+    insert_scope: tuple[ScopeInsertion, ...] = ()
+
+    def __post_init__(self):
+        if self.insert_scope and not self.local:
+            raise ValueError("insert_scope can only be used with locally-scoped expressions")
+
+
+@dataclass(frozen=True)
+class ComponentModifiers:
+    """Changes a structure component makes to a component of the structure it parses"""
+    other: dict[str, Any]
+    options: dict[str, Any]
+    '''ExpressionsOptions fields set by other'''
+
+
+def expressions_options(other: Mapping[str, Any]) -> dict[str, Any]:
+    """The ExpressionsOptions fields set in the other dict of a component or modifier"""
+    options = {}
+    if 'scope' in other:
+        if other['scope'] not in ('local', 'global'):
+            raise ValueError(f"Unknown scope {other['scope']} for expressions")
+        options['local'] = other['scope'] == 'local'
+    if 'filter' in other:
+        options['filter'] = to_filter(other['filter'])
+    if 'insert_scope' in other:
+        insertions = []
+        for item in other['insert_scope']:
+            if not isinstance(item, Mapping) or 'type' not in item or 'name' not in item:
+                raise ValueError(f'insert_scope item {item} must specify type and name')
+            insertions.append(ScopeInsertion(ScopeItems.parse(item['type']), ScopeItems.parse(item['name'])))
+        options['insert_scope'] = tuple(insertions)
+    return options
 
 #### TYPES ####
 
@@ -393,11 +1007,11 @@ class GeneralType(Protocol):
 
 
 @dataclass
-class PrimitiveTypeInitialize:
+class PrimitiveTypeInitialize(Frozen):
     type: str
 
 @dataclass
-class PrimitiveType:
+class PrimitiveType(Frozen):
     spec: TypeSpec
     '''TypeSpec of the primitive type'''
     superclass: TypeSpec | None
@@ -448,12 +1062,12 @@ class OperatorType(Enum):
 #### OTHER: EXPRESSION SEPARATORS ####
 
 @dataclass
-class ExpressionSeparator:
+class ExpressionSeparator(Frozen):
     name: str
     value: str
 
 @dataclass
-class Spec:
+class Spec(Frozen):
     primitive_types: dict[str, PrimitiveType]
     '''{typename: PrimitiveType}'''
     structured_objects: dict[str, StructuredObject]
@@ -461,7 +1075,32 @@ class Spec:
     initializer_formats: dict[str, InitializationSpec]
     '''{Operator name (NOT trigger): Operator}'''
     expression_separators: dict[str, ExpressionSeparator]
-    
+    type_hierarchy: TypeHierarchy | None = field(default=None, compare=False, repr=False)
+    '''Subtype closure of the primitive types, built by parse_spec or on first use'''
+    structure_indexes: ItemsCache = field(default_factory=ItemsCache, compare=False, repr=False)
+    '''StructureIndex of the structured objects for each tokenizer items, built on the first parse with them'''
+
+    def get_type_hierarchy(self) -> TypeHierarchy:
+        if self.type_hierarchy is None:
+            self.type_hierarchy = TypeHierarchy.from_primitive_types(self.primitive_types)
+        return self.type_hierarchy
+
+    def freeze(self, tokenizer_items=None) -> Spec:
+        """
+        Makes the spec and everything in it read-only so one spec can be shared by parses running on
+        several threads, and returns it. Everything built lazily from the spec is built first, with the
+        structures compiled for tokenizer_items, which should be the items the parses use.
+        Frozen specs cannot be pickled, so snapshots must be written before freezing.
+        """
+        if self.frozen:
+            return self
+        self.get_type_hierarchy()
+        for so in self.structured_objects.values():
+            so.get_compiled(tokenizer_items)
+            if so.create_operator is not None:
+                so.create_operator.get_dispatch()
+        freeze_value(self, set())
+        return self
 
 # DEFINITIONS
 class StructureComponentType(Enum):
@@ -477,7 +1116,7 @@ class InitializationType(Enum):
 
 
 @dataclass
-class InitializationSpec:
+class InitializationSpec(Frozen):
     ref_type: str
     '''Name of the type it maps to. ex: true to bool'''
     init_type: InitializationType
@@ -491,3 +1130,94 @@ class TypeTreeNode:
     type: PrimitiveType
     parent: TypeTreeNode | None
     children: list[TypeTreeNode]
+
+
+class TypeHierarchy:
+    """
+    Transitive closure of the superclass relation, as bitsets of ancestors and descendants indexed by
+    type id. Every type is its own ancestor and descendant. Types not in the hierarchy are only
+    related to themselves.
+    """
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        '''{type name: type id}'''
+        self.ancestors: list[int] = []
+        '''bitset of the ancestors of each type id, including itself'''
+        self.descendants: list[int] = []
+        '''bitset of the descendants of each type id, including itself'''
+
+    @staticmethod
+    def from_type_tree(roots: list[TypeTreeNode]) -> TypeHierarchy:
+        hierarchy = TypeHierarchy()
+        # parents are declared before their children
+        stack = list(reversed(roots))
+        while stack:
+            node = stack.pop()
+            hierarchy.declare(node.type.spec.name, node.parent.type.spec.name if node.parent else None)
+            stack.extend(reversed(node.children))
+        return hierarchy
+
+    @staticmethod
+    def from_primitive_types(primitive_types: dict[str, PrimitiveType]) -> TypeHierarchy:
+        roots = []
+        nodes = {name: TypeTreeNode(pt, None, []) for name, pt in primitive_types.items()}
+        for name, node in nodes.items():
+            superclass = node.type.superclass
+            if superclass is None:
+                roots.append(node)
+            elif superclass.name not in nodes:
+                raise ValueError(f"Superclass {superclass} not found for type {name}")
+            else:
+                node.parent = nodes[superclass.name]
+                node.parent.children.append(node)
+        hierarchy = TypeHierarchy.from_type_tree(roots)
+        hierarchy.check_complete(primitive_types)
+        return hierarchy
+
+    def check_complete(self, primitive_types: dict[str, PrimitiveType]):
+        # types in a superclass cycle are never reached from a root
+        missing = [name for name in primitive_types if name not in self.ids]
+        if missing:
+            raise ValueError(f"Types {', '.join(missing)} are their own superclass")
+
+    def declare(self, name: str, superclass: str | None = None):
+        """Adds a type with no subtypes yet"""
+        if name in self.ids:
+            raise ValueError(f"Type {name} is already declared")
+        if superclass is not None and superclass not in self.ids:
+            raise ValueError(f"Superclass {superclass} not found for type {name}")
+
+        type_id = len(self.ancestors)
+        bit = 1 << type_id
+        ancestors = bit
+        if superclass is not None:
+            ancestors |= self.ancestors[self.ids[superclass]]
+        self.ids[name] = type_id
+        self.ancestors.append(ancestors)
+        self.descendants.append(bit)
+
+        remaining = ancestors & ~bit
+        while remaining:
+            lowest = remaining & -remaining
+            self.descendants[lowest.bit_length() - 1] |= bit
+            remaining ^= lowest
+
+    def is_subtype(self, name: str, ancestor: str) -> bool:
+        """Whether type name is ancestor or one of its descendants"""
+        if name == ancestor:
+            return True
+        type_id = self.ids.get(name)
+        ancestor_id = self.ids.get(ancestor)
+        if type_id is None or ancestor_id is None:
+            return False
+        return (self.ancestors[type_id] >> ancestor_id) & 1 == 1
+
+    def copy(self) -> TypeHierarchy:
+        hierarchy = TypeHierarchy()
+        hierarchy.ids = dict(self.ids)
+        hierarchy.ancestors = list(self.ancestors)
+        hierarchy.descendants = list(self.descendants)
+        return hierarchy
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.ids
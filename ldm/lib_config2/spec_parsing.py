@@ -1,4 +1,5 @@
 from .parsing_types import *
+from functools import lru_cache
 from typing import Any
 
 
@@ -6,6 +7,7 @@ def parse_primitive_type_initialize(arg: dict[str, any]) -> PrimitiveTypeInitial
     return PrimitiveTypeInitialize(arg['type'])
 
 
+@lru_cache(maxsize=4096)
 def string_to_typespec(arg: str) -> TypeSpec:
     if '<' not in arg:
         return TypeSpec(arg, 0, [])
@@ -35,7 +37,7 @@ def string_to_typespec(arg: str) -> TypeSpec:
     else:
         path = ""
 
-    return ConfigTypeSpec(arg[:arg.index('<')], len(types), types, path=path)
+    return TypeSpec(arg[:arg.index('<')], len(types), types, path=path)
 
 
 def parse_primitive_type(arg: dict[str, Any]) -> PrimitiveType:
@@ -239,6 +241,79 @@ def parse_general_structure(arg: dict[str, Any]) -> StructuredObject:
     )
 
 
+def check_structure_components(structured_objects: dict[str, StructuredObject]):
+    """
+    Raises a ValueError if a structure component parses a structure that does not exist, has
+    modifiers that do not apply to the component they modify, or if a component path in a structure
+    does not lead to a component
+    """
+    def check(so: StructuredObject, components: Mapping[str, StructureSpecComponent]):
+        for component in components.values():
+            if component.base == ComponentType.REPEATED_ELEMENT:
+                check(so, component.other['components'])
+            if component.base != ComponentType.STRUCTURE:
+                continue
+            name = component.other.get('structure')
+            if name not in structured_objects:
+                raise ValueError(f"Structure {name} used by {so.name} not found")
+            if component.modifiers is None or component.name not in component.modifiers:
+                continue
+            target_so = structured_objects[name]
+            target = target_so.structure.component_specs.get(component.name)
+            if target is None:
+                raise ValueError(f"Structure {name} has no component {component.name} for {so.name} to modify")
+            modified = target.with_modifiers(component.modifiers[component.name])
+            # scope items are read from the variables of both the modifying and the modified structure
+            for insertion in modified.options.insert_scope if modified.options is not None else ():
+                for items in (insertion.types, insertion.names):
+                    if items.path is not None:
+                        items.path.check(so if items.path.head in so.structure.component_specs else target_so,
+                                         structured_objects)
+
+    def check_paths(so: StructuredObject):
+        if so.create_variable is not None and so.create_variable.attribute_items:
+            for items in so.create_variable.attribute_items.values():
+                if items.path is not None:
+                    items.path.check(so, structured_objects)
+        if so.create_type is not None:
+            for path in so.create_type.fields_container_paths:
+                path.check(so, structured_objects)
+        if so.create_operator is not None:
+            for path in so.create_operator.field_paths.values():
+                path.check(so, structured_objects)
+            for overload in so.create_operator.overloads:
+                for variable_type in overload.variable_types.values():
+                    for path in variable_type.component_paths():
+                        path.check(so, structured_objects)
+
+    for so in structured_objects.values():
+        check(so, so.structure.component_specs)
+        check_paths(so)
+
+
+def attach_overload(structured_objects: dict[str, StructuredObject], overload: OperatorOverload):
+    if overload.name not in structured_objects:
+        raise ValueError(f'type {overload.name} does not exist for overload to connect to')
+    op = structured_objects[overload.name]
+    if not op.create_operator:
+        raise ValueError(f"Structure {overload.name} is not an operator")
+    if not op.create_operator.overload_matches(overload):
+        raise ValueError(f'operator overload {overload} does not match operator structure for operator {op.name}')
+    op.create_operator.overloads.append(overload)
+
+
+def add_value_keyword_formats(primitive_types: dict[str, PrimitiveType], init_formats: dict[str, InitializationSpec]):
+    for pt in primitive_types.values():
+        if len(pt.value_keywords) == 0:
+            continue
+        for keyword in pt.value_keywords:
+            if keyword.name in init_formats:
+                raise ValueError(f"Value keyword {keyword.name} already exists")
+            init_formats[keyword.name] = InitializationSpec(keyword.value_type,
+                                                            InitializationType.LITERAL,
+                                                            keyword.name)
+
+
 def parse_spec(arg: list[dict[str, Any]]) -> Spec:
     primitive_types: dict[str, PrimitiveType] = {}
     structured_objects: dict[str, StructuredObject] = {}
@@ -270,33 +345,27 @@ def parse_spec(arg: list[dict[str, Any]]) -> Spec:
                 raise ValueError(f"Unknown type {item['type']}")
     
     for overload in operator_overloads:
-        if overload.name not in structured_objects:
-            raise ValueError(f'type {overload.name} does not exist for overload to connect to')
-        op = structured_objects[overload.name]
-        if not op.create_operator:
-            raise ValueError(f"Structure {overload.name} is not an operator")
-        if not op.create_operator.overload_matches(overload):
-            raise ValueError(f'operator overload {overload} does not match operator structure for operator {op.name}')
-        op.create_operator.overloads.append(overload)
+        attach_overload(structured_objects, overload)
+
+    check_structure_components(structured_objects)
+
+    for so in structured_objects.values():
+        if so.create_operator:
+            so.create_operator.get_dispatch()
 
     # build type tree
     type_tree_roots = build_type_tree(primitive_types)
     init_formats = build_init_formats_from_type_tree(type_tree_roots)
+    type_hierarchy = TypeHierarchy.from_type_tree(type_tree_roots)
+    type_hierarchy.check_complete(primitive_types)
 
-    for pt in primitive_types.values():
-        if len(pt.value_keywords) == 0:
-            continue
-        for keyword in pt.value_keywords:
-            if keyword.name in init_formats:
-                raise ValueError(f"Value keyword {keyword.name} already exists")
-            init_formats[keyword.name] = InitializationSpec(keyword.value_type,
-                                                            InitializationType.LITERAL,
-                                                            keyword.name)
+    add_value_keyword_formats(primitive_types, init_formats)
 
     return Spec(
         primitive_types=primitive_types,
         structured_objects=structured_objects,
         initializer_formats=init_formats,
         expression_separators=expression_separators,
+        type_hierarchy=type_hierarchy,
     )
 
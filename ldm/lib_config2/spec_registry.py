@@ -0,0 +1,279 @@
+from __future__ import annotations
+from dataclasses import dataclass, field, replace
+from threading import Event, Lock, Thread
+from typing import Any
+import json
+import os
+
+from ldm.ast.parsing_types import ParsingItems
+from ldm.ast.structure_index import StructureIndex
+from ldm.lib_config2.parsing_types import Spec, StructuredObject, ExpressionSeparator
+from ldm.lib_config2.spec_parsing import parse_spec, parse_primitive_type, parse_value_keyword, \
+    parse_general_structure, parse_operator_overload, attach_overload, build_type_tree, \
+    build_init_formats_from_type_tree, add_value_keyword_formats, check_structure_components
+from ldm.lib_config2.def_parsing import add_structure_definitions_to_spec, add_def_to_structured, \
+    add_value_keyword_def, check_structures
+from ldm.lib_config2.spec_snapshot import read_items
+from ldm.source_tokenizer.tokenize import TokenizerItems, collect_operators
+from ldm.translation.translate import TranslationItems
+
+
+@dataclass
+class SpecSource:
+    """The items of a spec and its definitions, grouped by what they build"""
+    primitive_types: list[dict]
+    value_keywords: list[dict]
+    value_keyword_names: list[dict]
+    '''value_keyword items of the definitions, which give the keywords their typed names'''
+    structures: dict[str, tuple[dict, dict | None, list[dict]]]
+    '''{structure name: (spec item, definition item, operator_overload items)}, in spec order'''
+    expression_separators: list[dict]
+    incremental: bool
+    '''False if the items hold anything only a full parse_spec handles'''
+
+    @staticmethod
+    def from_items(spec_items: list[dict[str, Any]], def_items: list[dict[str, Any]]) -> SpecSource:
+        source = SpecSource([], [], [], {}, [], True)
+        overloads: dict[str, list[dict]] = {}
+        definitions: dict[str, dict] = {}
+        for item in spec_items:
+            match item['type']:
+                case 'primitive_type':
+                    source.primitive_types.append(item)
+                case 'value_keyword':
+                    source.value_keywords.append(item)
+                case 'structure' if item['name'] not in source.structures:
+                    source.structures[item['name']] = (item, None, [])
+                case 'operator_overload':
+                    overloads.setdefault(item['name'], []).append(item)
+                case _:
+                    source.incremental = False
+        for item in def_items:
+            match item['type']:
+                case 'structure' if item['name'] not in definitions:
+                    definitions[item['name']] = item
+                case 'value_keyword':
+                    source.value_keyword_names.append(item)
+                case 'expression_separator':
+                    source.expression_separators.append(item)
+                case _:
+                    source.incremental = False
+
+        # overloads and definitions of missing structures are reported by the full parse
+        if not overloads.keys() <= source.structures.keys() or not definitions.keys() <= source.structures.keys():
+            source.incremental = False
+        for name, (item, _, _) in source.structures.items():
+            source.structures[name] = (item, definitions.get(name), overloads.get(name, []))
+        return source
+
+
+@dataclass
+class SpecVersion:
+    """One loaded version of a spec. Never changed once built, so parses can keep using it after a reload."""
+    number: int
+    spec: Spec
+    tokenizer_items: TokenizerItems
+    translation: TranslationItems | None
+    index: StructureIndex
+    source: SpecSource = field(repr=False)
+    rebuilt: frozenset[str] = frozenset()
+    '''Names of the structures parsed for this version rather than taken from the previous one'''
+
+    def parsing_items(self) -> ParsingItems:
+        """ParsingItems for a new parse with this version, sharing its structure index"""
+        items = ParsingItems(self.spec)
+        items.index = self.index
+        return items
+
+
+def build_spec(source: SpecSource, spec_items: list[dict], def_items: list[dict],
+               previous: SpecVersion | None) -> tuple[Spec, frozenset[str]]:
+    """
+    The spec for source and the names of the structures parsed for it. Structures whose items are
+    unchanged since previous are taken from it, as are the primitive types and value keyword formats
+    if their items are unchanged; anything else a full parse_spec would do is redone.
+    """
+    old = previous.source if previous is not None else None
+    if old is None or not source.incremental or not old.incremental or \
+            source.primitive_types != old.primitive_types:
+        spec = parse_spec(spec_items)
+        add_structure_definitions_to_spec(spec, def_items)
+        return spec, frozenset(spec.structured_objects)
+
+    old_spec = previous.spec
+    if source.value_keywords == old.value_keywords and source.value_keyword_names == old.value_keyword_names:
+        primitive_types = old_spec.primitive_types
+    else:
+        primitive_types = {}
+        for item in source.primitive_types:
+            primitive_types[item['name']] = parse_primitive_type(item)
+        for item in source.value_keywords:
+            vk = parse_value_keyword(item)
+            if vk.value_type not in primitive_types:
+                raise ValueError(f"Value type {vk.value_type} not found")
+            primitive_types[vk.value_type].value_keywords.append(vk)
+
+    if source.expression_separators == old.expression_separators:
+        expression_separators = old_spec.expression_separators
+    else:
+        expression_separators = {}
+        for item in source.expression_separators:
+            expression_separators[item['value']] = ExpressionSeparator(item['name'], item['value'])
+
+    structured_objects: dict[str, StructuredObject] = {}
+    rebuilt = set()
+    for name, recipe in source.structures.items():
+        if old.structures.get(name) == recipe:
+            structured_objects[name] = old_spec.structured_objects[name]
+        else:
+            structured_objects[name] = parse_general_structure(recipe[0])
+            rebuilt.add(name)
+    for name in rebuilt:
+        for item in source.structures[name][2]:
+            attach_overload(structured_objects, parse_operator_overload(item))
+    check_structure_components(structured_objects)
+
+    if primitive_types is old_spec.primitive_types:
+        initializer_formats = old_spec.initializer_formats
+    else:
+        initializer_formats = build_init_formats_from_type_tree(build_type_tree(primitive_types))
+        add_value_keyword_formats(primitive_types, initializer_formats)
+
+    spec = Spec(primitive_types, structured_objects, initializer_formats, expression_separators,
+                type_hierarchy=old_spec.type_hierarchy)
+    if initializer_formats is not old_spec.initializer_formats:
+        for item in source.value_keyword_names:
+            add_value_keyword_def(spec, item)
+    for name in rebuilt:
+        definition = source.structures[name][1]
+        if definition is not None:
+            add_def_to_structured('structure', definition, spec)
+        if structured_objects[name].create_operator is not None:
+            structured_objects[name].create_operator.get_dispatch()
+    check_structures(spec)
+    return spec, frozenset(rebuilt)
+
+
+def build_version(number: int, spec_items: list[dict], def_items: list[dict], translation_items: list[dict] | None,
+                  previous: SpecVersion | None, freeze: bool) -> SpecVersion:
+    source = SpecSource.from_items(spec_items, def_items)
+    spec, rebuilt = build_spec(source, spec_items, def_items, previous)
+
+    tokenizer_items = None
+    if previous is not None:
+        old = previous.tokenizer_items
+        if spec.primitive_types is previous.spec.primitive_types and \
+                spec.expression_separators is previous.spec.expression_separators and \
+                collect_operators(spec, spec.expression_separators) == old.operators:
+            tokenizer_items = old
+    if tokenizer_items is None:
+        tokenizer_items = TokenizerItems.from_spec(spec)
+        tokenizer_items.pattern
+        if previous is not None:
+            # structures shared with the previous version stay compiled for its tokenizer items
+            for name, so in spec.structured_objects.items():
+                if name not in rebuilt:
+                    spec.structured_objects[name] = replace(so, compiled=None)
+
+    for so in spec.structured_objects.values():
+        so.get_compiled(tokenizer_items)
+
+    translation = None
+    if translation_items is not None:
+        translation = TranslationItems(translation_items, spec)
+
+    index = StructureIndex(spec.structured_objects, tokenizer_items,
+                           previous.index if previous is not None else None)
+    spec.structure_indexes.put(index)
+    if freeze:
+        spec.freeze(tokenizer_items)
+    return SpecVersion(number, spec, tokenizer_items, translation, index, source, rebuilt)
+
+
+class SpecRegistry:
+    """
+    Holds the current version of a spec loaded from its spec, definition and optional translation
+    files, and reloads it when they change. A reload only parses the structures whose items changed
+    and reuses the rest of the previous version, which is left as it was: parses that started on it
+    finish on it, and parses started after the reload get the new version.
+    """
+    def __init__(self, spec_file: str, def_file: str, translation_file: str | None = None, freeze: bool = True):
+        self.files = [spec_file, def_file, translation_file]
+        self.freeze = freeze
+        '''Whether versions are frozen with Spec.freeze'''
+        self.current: SpecVersion | None = None
+        self.error: Exception | None = None
+        '''Error of the last failed reload while watching. The previous version stays current.'''
+        self.__stats: list[tuple[int, int] | None] = []
+        self.__reload_lock = Lock()
+        self.__stop = Event()
+        self.__watcher: Thread | None = None
+        self.reload()
+
+    def get(self) -> SpecVersion:
+        return self.current
+
+    def parsing_items(self) -> ParsingItems:
+        """ParsingItems for a new parse with the current version"""
+        return self.current.parsing_items()
+
+    def __file_stats(self) -> list[tuple[int, int] | None]:
+        stats = []
+        for file in self.files:
+            if file is None:
+                stats.append(None)
+                continue
+            st = os.stat(file)
+            stats.append((st.st_mtime_ns, st.st_size))
+        return stats
+
+    def reload(self) -> SpecVersion:
+        """
+        Reads the files and swaps in a version built from them. If building fails, the error is
+        raised and the current version is kept.
+        """
+        with self.__reload_lock:
+            # recorded before building, so a failed reload is only retried once the files change again
+            self.__stats = self.__file_stats()
+            spec_file, def_file, translation_file = self.files
+            translation_items = None
+            if translation_file is not None:
+                with open(translation_file) as f:
+                    translation_items = json.load(f)
+            previous = self.current
+            version = build_version(previous.number + 1 if previous is not None else 0,
+                                    read_items(spec_file), read_items(def_file), translation_items,
+                                    previous, self.freeze)
+            self.current = version
+            return version
+
+    def poll(self) -> bool:
+        """Reloads if any file was modified since the last load. Returns whether a new version was swapped in."""
+        if self.__file_stats() == self.__stats:
+            return False
+        self.reload()
+        return True
+
+    def watch(self, interval: float = 1.0):
+        """Polls the files every interval seconds on a daemon thread, until close"""
+        if self.__watcher is not None:
+            return
+        self.__stop.clear()
+        self.__watcher = Thread(target=self.__watch, args=(interval,), daemon=True)
+        self.__watcher.start()
+
+    def __watch(self, interval: float):
+        while not self.__stop.wait(interval):
+            try:
+                if self.poll():
+                    self.error = None
+            except Exception as e:
+                # any error of a reload is kept, so a malformed file cannot stop the watcher
+                self.error = e
+
+    def close(self):
+        """Stops watching the files"""
+        self.__stop.set()
+        if self.__watcher is not None:
+            self.__watcher.join()
+            self.__watcher = None
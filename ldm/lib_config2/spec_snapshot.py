@@ -0,0 +1,155 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+from ldm.lib_config2.custom_spec_parsing import read_config_file
+from ldm.lib_config2.parsing_types import Spec, compile_structures
+from ldm.lib_config2.spec_parsing import parse_spec
+from ldm.lib_config2.def_parsing import add_structure_definitions_to_spec
+from ldm.source_tokenizer.tokenize import TokenizerItems
+from ldm.translation.translate import TranslationItems
+
+
+SNAPSHOT_VERSION = 10
+'''Bumped whenever the pickled classes change shape, so older snapshots are rebuilt'''
+SNAPSHOT_MAGIC = b'LDMSPEC'
+KEY_SIZE = hashlib.sha256().digest_size
+RACY_SECONDS = 2
+'''Files modified this recently may change again without their modification time changing'''
+
+
+@dataclass
+class CompiledSpec:
+    """Everything built from a spec, its definitions and optionally a translation before parsing starts"""
+    spec: Spec
+    tokenizer_items: TokenizerItems
+    translation: TranslationItems | None = None
+    loaded_from_snapshot: bool = False
+
+
+def read_items(filename: str) -> list[dict]:
+    """The items of a JSON spec or definition file, or of a .ldm_spec / .ldm_def file"""
+    if filename.endswith(('.ldm_spec', '.ldm_def')):
+        return read_config_file(filename)
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compile_spec(spec_file: str, def_file: str, translation_file: str | None = None) -> CompiledSpec:
+    """Reads and resolves a spec, its definitions and translation from their files"""
+    spec = parse_spec(read_items(spec_file))
+    add_structure_definitions_to_spec(spec, read_items(def_file))
+
+    translation = None
+    if translation_file is not None:
+        with open(translation_file) as f:
+            translation = TranslationItems(json.load(f), spec)
+
+    tokenizer_items = TokenizerItems.from_spec(spec)
+    # compiled now so the snapshot holds them
+    tokenizer_items.pattern
+    compile_structures(spec, tokenizer_items)
+    return CompiledSpec(spec, tokenizer_items, translation)
+
+
+def snapshot_key(files: list[str | None]) -> bytes:
+    """Hash of the snapshot format and the contents of every input file"""
+    h = hashlib.sha256(f'{SNAPSHOT_VERSION}\0'.encode())
+    for file in files:
+        if file is None:
+            h.update(b'\0none\0')
+            continue
+        with open(file, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.digest()
+
+
+def stat_key(files: list[str | None]) -> bytes | None:
+    """
+    Hash of the snapshot format and the path, size and modification time of every input file, or None
+    if a file was modified too recently for its modification time to show later changes
+    """
+    h = hashlib.sha256(f'{SNAPSHOT_VERSION}\0'.encode())
+    now = time.time_ns()
+    for file in files:
+        if file is None:
+            h.update(b'\0none\0')
+            continue
+        st = os.stat(file)
+        if now - st.st_mtime_ns < RACY_SECONDS * 1_000_000_000:
+            return None
+        h.update(f'{os.path.abspath(file)}\0{st.st_size}\0{st.st_mtime_ns}\0'.encode())
+    return h.digest()
+
+
+def read_snapshot(snapshot_file: str, files: list[str | None]) -> tuple[CompiledSpec | None, bool]:
+    """
+    The CompiledSpec in snapshot_file, or None if it is missing, stale or unreadable, and whether the
+    snapshot should be rewritten. Input files are only hashed if their modification times changed.
+    """
+    try:
+        with open(snapshot_file, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                return None, True
+            stored_stats = f.read(KEY_SIZE)
+            stored_key = f.read(KEY_SIZE)
+            stats = stat_key(files)
+            stale_stats = stats is None or stats != stored_stats
+            if stale_stats and snapshot_key(files) != stored_key:
+                return None, True
+            compiled = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError):
+        return None, True
+    if not isinstance(compiled, CompiledSpec):
+        return None, True
+    compiled.loaded_from_snapshot = True
+    # rewritten so the new modification times are recorded, once they are old enough to be trusted
+    return compiled, stale_stats and stats is not None
+
+
+def write_snapshot(snapshot_file: str, files: list[str | None], compiled: CompiledSpec):
+    directory = os.path.dirname(os.path.abspath(snapshot_file))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            # an all-zero stat key never matches, so recently modified files are hashed on the next load
+            f.write(stat_key(files) or bytes(KEY_SIZE))
+            f.write(snapshot_key(files))
+            loaded_from_snapshot = compiled.loaded_from_snapshot
+            compiled.loaded_from_snapshot = False
+            try:
+                pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+            finally:
+                compiled.loaded_from_snapshot = loaded_from_snapshot
+        os.replace(temp_path, snapshot_file)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def load_spec(spec_file: str, def_file: str, translation_file: str | None = None,
+              snapshot_file: str | None = None) -> CompiledSpec:
+    """
+    Loads a compiled spec from snapshot_file (by default next to spec_file), compiling it and
+    writing a new snapshot if the snapshot is missing or any input file changed since it was written.
+    Spec and definition files can be JSON, or .ldm_spec and .ldm_def files.
+    """
+    if snapshot_file is None:
+        snapshot_file = spec_file + '.snapshot'
+    files = [spec_file, def_file, translation_file]
+
+    compiled, rewrite = read_snapshot(snapshot_file, files)
+    if compiled is None:
+        compiled = compile_spec(spec_file, def_file, translation_file)
+    if rewrite:
+        write_snapshot(snapshot_file, files, compiled)
+    return compiled
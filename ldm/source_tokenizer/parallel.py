@@ -0,0 +1,100 @@
+from .tokenizer_types import Token, TokenTable
+from .tokenize import Tokenizer, TokenizerItems
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+
+
+worker_tokenizer: Tokenizer | None = None
+'''Tokenizer of the current worker process, built once by init_worker'''
+
+
+def init_worker(items: TokenizerItems):
+    global worker_tokenizer
+    worker_tokenizer = Tokenizer(items)
+
+
+def tokenize_chunk(chunk: str, offset: int, line: int,
+                   endpos: int | None = None) -> tuple[array, array, array, array, array]:
+    """
+    Tokenizes chunk[:endpos], part of a larger source that starts at offset, on the newline ending line
+    (or at the start of the source). The chunk may run on past endpos to the newline after it, so
+    errors near the end read as they do in a full scan. Returns the arrays of a TokenTable in source
+    coordinates.
+    """
+    table = TokenTable(chunk)
+    append = table.append
+    for token_type, start, end, token_line, char in worker_tokenizer._scan(chunk, 0, line, 0, endpos):
+        append(token_type, start + offset, end + offset, token_line, char)
+    return table.types, table.starts, table.lengths, table.lines, table.chars
+
+
+def split_chunks(source: str, chunk_size: int) -> list[tuple[int, int]]:
+    """
+    Splits source into (start, end) ranges of about chunk_size characters. Every range after the first
+    starts on a newline; string literals cannot contain newlines, so no token crosses a boundary.
+    """
+    ranges = []
+    start = 0
+    while start < len(source):
+        end = source.find('\n', start + max(chunk_size, 1))
+        if end == -1:
+            end = len(source)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+class ParallelTokenizer:
+    """
+    Tokenizes huge sources by splitting them at newlines and scanning the chunks in a process pool.
+    The TokenizerItems are sent to each worker once, when the pool starts, and the pool is kept for
+    the life of the tokenizer since the items do not change. Output is identical to Tokenizer.
+    """
+    def __init__(self, items: TokenizerItems, max_workers: int | None = None, chunk_size: int = 1 << 20):
+        self.items = items
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.executor: ProcessPoolExecutor | None = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.max_workers, initializer=init_worker, initargs=(self.items,))
+        return self.executor
+
+    def tokenize(self, source: str) -> list[Token]:
+        return list(self.tokenize_table(source))
+
+    def tokenize_table(self, source: str) -> TokenTable:
+        ranges = split_chunks(source, self.chunk_size)
+        if len(ranges) <= 1:
+            return Tokenizer(self.items).tokenize_table(source)
+
+        executor = self._executor()
+        futures = []
+        line = 1
+        for start, end in ranges:
+            # the newline starting the next chunk is included, so a string left open ends on it
+            futures.append(executor.submit(tokenize_chunk, source[start:end + 1], start, line, end - start))
+            line += source.count('\n', start, end)
+
+        table = TokenTable(source)
+        # results are collected in order, so the first malformed chunk raises, as in Tokenizer
+        for future in futures:
+            types, starts, lengths, lines, chars = future.result()
+            table.types.extend(types)
+            table.starts.extend(starts)
+            table.lengths.extend(lengths)
+            table.lines.extend(lines)
+            table.chars.extend(chars)
+        return table
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
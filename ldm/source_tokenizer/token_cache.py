@@ -0,0 +1,188 @@
+from .tokenizer_types import Token, TokenTable
+from .tokenize import Tokenizer, TokenizerItems
+from collections import OrderedDict
+from array import array
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+
+
+CACHE_FORMAT_VERSION = 1
+CACHE_SUFFIX = '.tokens'
+HEADER = struct.Struct('<4sHcQ')
+'''magic, format version, byte order of the arrays, token count'''
+MAGIC = b'LDMT'
+
+
+def items_fingerprint(items: TokenizerItems) -> str:
+    """Hash of everything in items that changes how a source is tokenized"""
+    h = hashlib.sha256()
+    h.update(f'{CACHE_FORMAT_VERSION}\0'.encode())
+    for name, token_type in sorted(items.identifier_types.items()):
+        h.update(f'identifier {name} {token_type.name}\0'.encode())
+    for separator in sorted(items.expression_separators):
+        h.update(f'separator {separator}\0'.encode())
+    for operator in sorted(items.operators):
+        h.update(f'operator {operator}\0'.encode())
+    return h.hexdigest()
+
+
+def source_key(source: str, fingerprint: str) -> str:
+    h = hashlib.sha256(source.encode('utf-8', 'surrogatepass'))
+    h.update(fingerprint.encode())
+    return h.hexdigest()
+
+
+class TokenCache:
+    """
+    Directory of tokenized sources, keyed by a hash of the source and of the TokenizerItems.
+    Each entry holds the arrays of a TokenTable; the source itself is not stored. The least
+    recently used entries are removed once the directory grows past max_bytes.
+    """
+    def __init__(self, directory: str | os.PathLike, max_bytes: int = 256 << 20):
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        '''{key: file size}, least recently used first'''
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        # access times of earlier runs are kept as file modification times
+        files = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(CACHE_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    # evicted by another build since the listing
+                    continue
+                files.append((stat.st_mtime, filename[:-len(CACHE_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, key: str, source: str) -> TokenTable | None:
+        """
+        The cached TokenTable of source under key, or None on a miss. A key missing from the index is
+        still looked up on disk, since another build may have written it after the index was loaded.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            table = read_table(data, source)
+            os.utime(path)
+        except FileNotFoundError:
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        except (OSError, ValueError):
+            self._remove(key)
+            self.misses += 1
+            return None
+        known = key in self.entries
+        self.entries[key] = len(data)
+        self.entries.move_to_end(key)
+        self.hits += 1
+        if not known:
+            self._evict()
+        return table
+
+    def put(self, key: str, table: TokenTable):
+        data = write_table(table)
+        # written to a temporary file first so concurrent builds never read a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self.entries[key] = len(data)
+        self.entries.move_to_end(key)
+        self._evict()
+
+    def size(self) -> int:
+        return sum(self.entries.values())
+
+    def _evict(self):
+        total = self.size()
+        while total > self.max_bytes and len(self.entries) > 1:
+            key, size = next(iter(self.entries.items()))
+            self._remove(key)
+            total -= size
+
+    def _remove(self, key: str):
+        self.entries.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for key in list(self.entries):
+            self._remove(key)
+
+
+def write_table(table: TokenTable) -> bytes:
+    table.apply_shifts()
+    byte_order = b'<' if sys.byteorder == 'little' else b'>'
+    return b''.join([HEADER.pack(MAGIC, CACHE_FORMAT_VERSION, byte_order, len(table)),
+                     table.types.tobytes(), table.starts.tobytes(), table.lengths.tobytes(),
+                     table.lines.tobytes(), table.chars.tobytes()])
+
+
+def read_table(data: bytes, source: str) -> TokenTable:
+    if len(data) < HEADER.size:
+        raise ValueError("Token cache entry is truncated")
+    magic, version, byte_order, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != CACHE_FORMAT_VERSION:
+        raise ValueError("Token cache entry has an unknown format")
+
+    table = TokenTable(source)
+    offset = HEADER.size
+    for name in ['types', 'starts', 'lengths', 'lines', 'chars']:
+        values = getattr(table, name)
+        end = offset + count * values.itemsize
+        if end > len(data):
+            raise ValueError("Token cache entry is truncated")
+        values.frombytes(data[offset:end])
+        if byte_order != (b'<' if sys.byteorder == 'little' else b'>'):
+            values.byteswap()
+        offset = end
+    if offset != len(data):
+        raise ValueError("Token cache entry has trailing data")
+    return table
+
+
+class CachingTokenizer(Tokenizer):
+    """Tokenizer that reuses the tokens of sources it, or an earlier run, has already tokenized"""
+    def __init__(self, items: TokenizerItems, cache: TokenCache):
+        super().__init__(items)
+        self.cache = cache
+        self.fingerprint = items_fingerprint(items)
+
+    def _key(self, source: str) -> str:
+        return source_key(source, self.fingerprint)
+
+    def tokenize(self, source: str) -> list[Token]:
+        return list(self.tokenize_table(source))
+
+    def tokenize_table(self, source: str) -> TokenTable:
+        key = self._key(source)
+        table = self.cache.get(key, source)
+        if table is None:
+            table = super().tokenize_table(source)
+            self.cache.put(key, table)
+        return table
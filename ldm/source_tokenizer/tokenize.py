@@ -1,15 +1,341 @@
-from .tokenizer_types import Token, TokenType
-from ldm.lib_config2.parsing_types import PrimitiveType, ExpressionSeparator
-from dataclasses import dataclass
+from __future__ import annotations
+from .tokenizer_types import Token, TokenType, TokenTable, SourceText
+from ldm.lib_config2.parsing_types import PrimitiveType, ExpressionSeparator, Spec, StructureComponent, \
+    StructureComponentType
+from dataclasses import dataclass, field
+from functools import cached_property
+from types import MappingProxyType
+from typing import Mapping, Iterator, IO
+import codecs
+import mmap
+import os
+import re
+
+
+NUMBERS = "1234567890"
+ALPHABET = "_qwertyuiopasdfghjklzxcvbnmQWERTYUIOPLKJHGFDSAZXCVBNM"
+WHITESPACE = " \t\n\r"
+
+UNCLOSED_STRING = re.compile(r'[^"\n\0]*')
+OPERATOR_RUN = re.compile(r'[^\w\s"]+')
 
 
 @dataclass
 class TokenizerItems:
     primitive_types: dict[str, PrimitiveType]
     expression_separators: dict[str, ExpressionSeparator]
+    keywords: set[str] = field(default_factory=set)
+    operators: set[str] = field(default_factory=set)
+    """Multi-character operators, emitted as one token by maximal munch"""
+
+    def __post_init__(self):
+        self.identifier_types: Mapping[str, TokenType] = build_identifier_types(self)
+        """
+        Read-only map of every reserved identifier to the token type it is classified as. Fixed once the
+        items are built: types declared while parsing are kept by the parse, in ParsingItems.declared_types.
+        """
+        self.literal_cache: dict[str, tuple[str, ...]] = {}
+
+    @classmethod
+    def from_spec(cls, spec: Spec, keywords: set[str] | None = None) -> TokenizerItems:
+        """Items for tokenizing sources of spec, with the multi-character operators of its structures"""
+        items = cls(spec.primitive_types, spec.expression_separators, keywords or set())
+        items.operators = collect_operators(spec, items.expression_separators)
+        return items
+
+    def literal_tokens(self, literal: str) -> tuple[str, ...]:
+        """Values of the tokens a structure literal is made of, as these items tokenize it"""
+        values = self.literal_cache.get(literal)
+        if values is None:
+            values = tuple(t.value for t in Tokenizer(self).tokenize(literal))
+            self.literal_cache[literal] = values
+        return values
+
+    def __getstate__(self):
+        # mappingproxy cannot be pickled, so ship the underlying dict
+        state = self.__dict__.copy()
+        state['identifier_types'] = dict(self.identifier_types)
+        return state
+
+    def __setstate__(self, state):
+        state['identifier_types'] = MappingProxyType(state['identifier_types'])
+        self.__dict__.update(state)
+
+    @cached_property
+    def pattern(self) -> re.Pattern:
+        """Master regex for the tokenizer, compiled once per set of items"""
+        return compile_token_pattern(self)
+
+
+def build_identifier_types(items: TokenizerItems) -> Mapping[str, TokenType]:
+    identifier_types: dict[str, TokenType] = {}
+    for keyword in items.keywords:
+        identifier_types[keyword] = TokenType.Keyword
+    for pt in items.primitive_types.values():
+        for vk in pt.value_keywords:
+            identifier_types[vk.name] = TokenType.ValueKeyword
+    # primitive types take priority over value keywords of the same name
+    for name in items.primitive_types:
+        identifier_types[name] = TokenType.PrimitiveType
+    return MappingProxyType(identifier_types)
+
+
+def collect_operators(spec: Spec, expression_separators) -> set[str]:
+    """Every run of two or more operator characters in the literal components of the spec's structures"""
+    operators = set()
+
+    def add_literals(components: list[StructureComponent]):
+        for component in components:
+            if component.component_type == StructureComponentType.String:
+                for run in OPERATOR_RUN.findall(component.value):
+                    for part in re.split('|'.join(map(re.escape, expression_separators)) or '$^', run):
+                        if len(part) > 1:
+                            operators.add(part)
+            elif component.inner_structure:
+                add_literals(component.inner_structure)
+
+    for so in spec.structured_objects.values():
+        add_literals(so.structure.component_defs)
+    return operators
+
+
+def operator_trie_pattern(operators: set[str]) -> str:
+    """
+    Regex matching the longest of operators at a position, built from a trie of the operators so
+    operators sharing a prefix share its match: {'=', '==', '=>'} becomes =(?:=|>)?
+    """
+    trie: dict = {}
+    for operator in operators:
+        node = trie
+        for c in operator:
+            node = node.setdefault(c, {})
+        node[''] = {}
+
+    def node_pattern(node: dict) -> str:
+        branches = [re.escape(c) + node_pattern(child) for c, child in sorted(node.items()) if c]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            if len(branches) == 1 and len(branches[0]) > 1:
+                pattern = '(?:' + pattern + ')'
+            pattern += '?'
+        return pattern
+
+    return node_pattern(trie)
+
+
+def compile_token_pattern(items: TokenizerItems) -> re.Pattern:
+    """
+    Builds a single regex with one named group per token class. Alternatives are tried in order,
+    so expression separators take priority over whitespace and operators, and the trailing
+    catch-all makes every other character a single-character operator. Spaces and tabs are
+    consumed as a prefix of the following token; newline runs are matched on their own so
+    line numbers can be tracked without inspecting every token. Multi-character operators are
+    tried before the single-character fallback, longest first.
+    """
+    separators = [s for s in items.expression_separators if len(s) == 1]
+    spaces = re.escape(''.join(c for c in WHITESPACE if c not in separators and c != '\n'))
+
+    groups = []
+    if separators:
+        groups.append(f"(?P<separator>[{''.join(re.escape(s) for s in separators)}])")
+    if '\n' not in separators:
+        groups.append(f"(?P<newline>\n[\n{spaces}]*)")
+    groups += [
+        r'(?P<string>"[^"\n\0]*")',
+        r'(?P<bad_string>")',
+        r'(?P<integer>[0-9]+(?![0-9A-Za-z_.]))',
+        r'(?P<float>[0-9]+\.[0-9]*(?![0-9A-Za-z_.]))',
+        r'(?P<bad_number>[0-9]+\.?[0-9]*)',
+        r'(?P<identifier>[A-Za-z_][A-Za-z0-9_]*)',
+    ]
+    single_operator = f'[^{spaces}]' if spaces else '.'
+    if items.operators:
+        groups.append(f'(?P<operator>{operator_trie_pattern(items.operators)}|{single_operator})')
+    else:
+        groups.append(f'(?P<operator>{single_operator})')
+    prefix = f"[{spaces}]*" if spaces else ""
+    return re.compile(prefix + '(?:' + '|'.join(groups) + ')', re.DOTALL)
+
+
+GROUP_TOKEN_TYPES = {
+    'separator': TokenType.ExpressionSeparator,
+    'string': TokenType.String,
+    'integer': TokenType.Integer,
+    'float': TokenType.Float,
+    'identifier': TokenType.Identifier,
+    'operator': TokenType.Operator,
+}
 
 
 class Tokenizer:
+    """
+    Tokenizer driven by the master regex of its TokenizerItems. Each regex match is one token
+    (or one run of newlines), so the Python-level loop runs once per token instead of once per character.
+    """
+    def __init__(self, items: TokenizerItems):
+        self.items = items
+
+    def _scan(self, source: str, pos: int = 0, line: int = 1, line_start: int = 0, endpos: int | None = None):
+        """
+        Yields (token type, start, end, line, char) for every token in source[pos:endpos].
+        line_start is the offset of the newline that began the current line (0 on the first line),
+        so a token's char is its distance from that newline, matching the original tokenizer.
+        Since no token spans a newline, any newline is a safe place to start or stop scanning.
+        """
+        pattern = self.items.pattern
+        identifier_type = self.items.identifier_types.get
+        group_types = [GROUP_TOKEN_TYPES.get(name) for name in [None, *pattern.groupindex]]
+        if endpos is None:
+            endpos = len(source)
+
+        for m in pattern.finditer(source, pos, endpos):
+            group = m.lastindex
+            start, end = m.span(group)
+            token_type = group_types[group]
+
+            if token_type is TokenType.Identifier:
+                yield identifier_type(source[start:end], token_type), start, end, line, start - line_start + 1
+            elif token_type is TokenType.String:
+                yield token_type, start + 1, end - 1, line, start - line_start + 2
+            elif token_type is TokenType.ExpressionSeparator:
+                if source[start] == '\n':
+                    line += 1
+                    line_start = start
+                yield token_type, start, end, line, start - line_start + 1
+            elif token_type is not None:
+                yield token_type, start, end, line, start - line_start + 1
+            else:
+                kind = m.lastgroup
+                if kind == 'newline':
+                    line += source.count('\n', start, end)
+                    line_start = source.rindex('\n', start, end)
+                elif kind == 'bad_string':
+                    if UNCLOSED_STRING.match(source, end).end() < len(source):
+                        raise ValueError(f"Unexpected newline in string at line {line}")
+                    raise ValueError(f"Unterminated string at line {line}")
+                elif source[end:end + 1] == '.':
+                    raise ValueError(f"Unexpected . in number at line {line}")
+                else:
+                    raise ValueError(f"Unexpected character in number at line {line}")
+
+    def tokenize(self, source: str) -> list[Token]:
+        return [Token(token_type, source[start:end], line, char)
+                for token_type, start, end, line, char in self._scan(source)]
+
+    def tokenize_table(self, source: str) -> TokenTable:
+        """Tokenizes source into a TokenTable instead of a list of Tokens"""
+        table = TokenTable(source)
+        append = table.append
+        for token_type, start, end, line, char in self._scan(source):
+            append(token_type, start, end, line, char)
+        return table
+
+    def retokenize(self, table: TokenTable, offset: int, removed: int, inserted: str) -> TokenTable:
+        """
+        Updates table, a TokenTable of this tokenizer, after the edit that replaces removed characters
+        at offset in its source with inserted. Since no token spans a newline, only the lines touched
+        by the edit are rescanned; later tokens are shifted without being rescanned.
+        If the edited lines do not tokenize, the ValueError is raised and table is left unchanged.
+        """
+        text = table.text
+        if not isinstance(text, SourceText):
+            text = table.text = SourceText(text)
+        if offset < 0 or removed < 0 or offset + removed > len(text):
+            raise ValueError(f"Edit at {offset} removing {removed} characters is outside the source")
+
+        # damaged window: from the start of the first edited line to the newline ending the last one
+        window_start = text.line_start(offset)
+        window_end = text.line_end(offset + removed)
+        first = table.find(window_start)
+        last = table.find(window_end)
+        line = 1 + text.newlines_before(window_start)
+        line_delta = inserted.count('\n') - (text.newlines_before(offset + removed) - text.newlines_before(offset))
+
+        # only the window is rebuilt, with the newline after it so errors read the same as in tokenize
+        tail = text[offset + removed:window_end + 1]
+        window = text[window_start:offset] + inserted + tail
+        replacement = TokenTable(window)
+        append = replacement.append
+        endpos = len(window) - (window_end < len(text))
+        for token_type, start, end, token_line, char in self._scan(window, 0, line, -1 if window_start else 0,
+                                                                   endpos):
+            append(token_type, start + window_start, end + window_start, token_line, char)
+
+        text.replace(offset, removed, inserted)
+        table.splice(first, last, replacement, len(inserted) - removed, line_delta)
+        return table
+
+    def iter_tokens(self, source: str | os.PathLike | IO, chunk_size: int = 1 << 16, use_mmap: bool = False,
+                    encoding: str = 'utf-8') -> Iterator[Token]:
+        """
+        Lazily tokenizes a file, reading it in chunks of chunk_size. source is a path (a str is always
+        treated as a path, use tokenize for source text), a text or binary file object, or an mmap.
+        With use_mmap, a path is memory-mapped instead of read. Reads are split at the last newline,
+        so at most one line is carried over between chunks.
+        """
+        # text read since the last scan, joined only once a chunk brings a newline
+        pending: list[str] = []
+        line, line_start = 1, 0
+
+        for chunk in read_chunks(source, chunk_size, use_mmap, encoding):
+            pending.append(chunk)
+            if '\n' not in chunk:
+                continue
+            buffer = ''.join(pending)
+            cut = buffer.rfind('\n')
+            if cut <= 0:
+                pending = [buffer]
+                continue
+
+            for token_type, start, end, token_line, char in self._scan(buffer, 0, line, line_start, cut):
+                yield Token(token_type, buffer[start:end], token_line, char)
+
+            last_newline = buffer.rfind('\n', 0, cut)
+            if last_newline != -1:
+                line += buffer.count('\n', 0, cut)
+                line_start = last_newline
+            line_start -= cut
+            pending = [buffer[cut:]]
+
+        buffer = ''.join(pending)
+        for token_type, start, end, token_line, char in self._scan(buffer, 0, line, line_start):
+            yield Token(token_type, buffer[start:end], token_line, char)
+
+
+def read_chunks(source: str | os.PathLike | IO, chunk_size: int, use_mmap: bool = False,
+                encoding: str = 'utf-8') -> Iterator[str]:
+    """Yields decoded text from a path, file object or mmap, chunk_size units at a time"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            if use_mmap and os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    yield from read_chunks(mapped, chunk_size, encoding=encoding)
+            else:
+                yield from read_chunks(f, chunk_size, encoding=encoding)
+        return
+
+    # multibyte characters may be split across reads of binary files and mmaps
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        data = source.read(chunk_size)
+        if not data:
+            break
+        if isinstance(data, bytes):
+            data = decoder.decode(data)
+        yield data
+
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+class CharTokenizer:
+    """
+    The original character-at-a-time state machine. Tokenizer produces the same token stream;
+    this is kept as the reference implementation it is checked against.
+    """
     def __init__(self, items: TokenizerItems):
         self.items = items
         self.source = ""
@@ -26,9 +352,9 @@ class Tokenizer:
         self.starting_index = 0
         self.line = 1
 
-        self.NUMBERS = "1234567890"
-        self.ALPHABET = "_qwertyuiopasdfghjklzxcvbnmQWERTYUIOOPLKJHGFDSAZXCVBNM"
-        self.WHITESPACE = " \t\n\r"
+        self.NUMBERS = NUMBERS
+        self.ALPHABET = ALPHABET
+        self.WHITESPACE = WHITESPACE
 
         self.char_ind = 0
 
@@ -84,16 +410,10 @@ class Tokenizer:
         self.eat(c, count=False)
 
     def __handle_operator(self, c: str):
-        if c != '\0' and c not in self.ALPHABET and c not in self.NUMBERS and c not in self.WHITESPACE:
-            self.tokens.append(Token(TokenType.Operator, self.running_str, self.line, self.starting_index))
-            self.__reset_state()
-            self.char_ind -= 1
-            self.eat(c, count=False)
-        else:
-            self.tokens.append(Token(TokenType.Operator, self.running_str, self.line, self.starting_index))
-            self.__reset_state()
-            self.char_ind -= 1
-            self.eat(c, count=False)
+        self.tokens.append(Token(TokenType.Operator, self.running_str, self.line, self.starting_index))
+        self.__reset_state()
+        self.char_ind -= 1
+        self.eat(c, count=False)
 
     def eat(self, c: str, count: bool=True):
         if count:
@@ -108,7 +428,7 @@ class Tokenizer:
             if c in self.items.expression_separators:
                 self.tokens.append(Token(TokenType.ExpressionSeparator, c, self.line, self.starting_index))
                 return
-            
+
             if c in self.WHITESPACE:
                 return
             if c == "\"":
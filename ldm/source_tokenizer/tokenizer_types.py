@@ -1,3 +1,8 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import repeat
+from operator import add
 from enum import Enum
 from dataclasses import dataclass
 
@@ -21,7 +26,13 @@ class TokenType(Enum):
     RPAREN = ")",
 
 
-@dataclass
+TOKEN_TYPES: list[TokenType] = list(TokenType)
+'''Token types by their code in a TokenTable'''
+TOKEN_TYPE_CODES: dict[TokenType, int] = {t: i for i, t in enumerate(TOKEN_TYPES)}
+'''Codes of each token type in a TokenTable'''
+
+
+@dataclass(slots=True)
 class Token:
     type: TokenType
     value: str
@@ -33,3 +44,267 @@ class Token:
 
     def __eq__(self, other):
         return self.type == other.type and self.value == other.value
+
+
+class PrefixSums:
+    """Fenwick tree over a list of counts, for point updates and prefix sums in O(log n)"""
+
+    def __init__(self, values: list[int]):
+        tree = [0, *values]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def add(self, index: int, delta: int):
+        tree = self.tree
+        index += 1
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    def prefix(self, index: int) -> int:
+        """Sum of the first index values"""
+        tree = self.tree
+        total = 0
+        while index > 0:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+    def find(self, value: int) -> int:
+        """Number of leading values whose sum is at most value, so the index of the value containing it"""
+        tree = self.tree
+        index = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            if index + step < len(tree) and tree[index + step] <= value:
+                index += step
+                value -= tree[index]
+            step >>= 1
+        return index
+
+
+class SourceText:
+    """
+    Source text split into chunks that each end with a newline, so an edit copies one chunk instead
+    of the whole source. Chunk sizes and newline counts are kept in PrefixSums, so offsets and lines
+    are found without walking the chunks. Since no token spans a newline, every token value is a slice
+    of one chunk.
+    """
+    CHUNK_SIZE = 1 << 14
+    """Characters after which a chunk is ended at the next newline"""
+
+    def __init__(self, source: str):
+        self.chunks = self.split(source) or ['']
+        self.length = len(source)
+        self.text: str | None = source
+        '''The joined chunks, or None until they are next needed'''
+        self.sizes = self.newlines = PrefixSums([])
+        self.index_chunks()
+
+    @classmethod
+    def split(cls, source: str) -> list[str]:
+        chunks = []
+        start = 0
+        while start < len(source):
+            cut = source.find('\n', start + cls.CHUNK_SIZE - 1)
+            if cut == -1:
+                chunks.append(source[start:])
+                break
+            chunks.append(source[start:cut + 1])
+            start = cut + 1
+        return chunks
+
+    def index_chunks(self):
+        self.sizes = PrefixSums([len(chunk) for chunk in self.chunks])
+        self.newlines = PrefixSums([chunk.count('\n') for chunk in self.chunks])
+
+    def locate(self, offset: int) -> tuple[int, int]:
+        """Index and start offset of the chunk holding the character at offset"""
+        index = min(self.sizes.find(offset), len(self.chunks) - 1)
+        return index, self.sizes.prefix(index)
+
+    def line_start(self, offset: int) -> int:
+        """Offset of the first character on the line holding offset"""
+        index, chunk_start = self.locate(offset)
+        return chunk_start + self.chunks[index].rfind('\n', 0, offset - chunk_start) + 1
+
+    def line_end(self, offset: int) -> int:
+        """Offset of the newline ending the line holding offset, or the length of the source"""
+        index, chunk_start = self.locate(offset)
+        end = self.chunks[index].find('\n', offset - chunk_start)
+        return self.length if end == -1 else chunk_start + end
+
+    def newlines_before(self, offset: int) -> int:
+        index, chunk_start = self.locate(offset)
+        return self.newlines.prefix(index) + self.chunks[index].count('\n', 0, offset - chunk_start)
+
+    def replace(self, offset: int, removed: int, inserted: str):
+        """Replaces removed characters at offset with inserted"""
+        first, first_start = self.locate(offset)
+        last, last_start = self.locate(offset + removed) if removed else (first, first_start)
+        old = self.chunks[first]
+        text = old[:offset - first_start] + inserted + self.chunks[last][offset + removed - last_start:]
+        if first == last and len(text) < 2 * self.CHUNK_SIZE and text.endswith('\n') == old.endswith('\n'):
+            self.chunks[first] = text
+            self.sizes.add(first, len(text) - len(old))
+            self.newlines.add(first, text.count('\n') - old.count('\n'))
+        else:
+            # chunks are only split or merged here, so the sums are rebuilt once per CHUNK_SIZE characters
+            self.chunks[first:last + 1] = self.split(text)
+            if not self.chunks:
+                self.chunks.append('')
+            self.index_chunks()
+        self.length += len(inserted) - removed
+        self.text = None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key: slice) -> str:
+        if self.text is not None:
+            return self.text[key]
+        index, chunk_start = self.locate(key.start)
+        if key.stop - chunk_start <= len(self.chunks[index]):
+            return self.chunks[index][key.start - chunk_start:key.stop - chunk_start]
+        return str(self)[key]
+
+    def __str__(self):
+        if self.text is None:
+            self.text = ''.join(self.chunks)
+        return self.text
+
+
+class TokenTable:
+    """
+    Tokens stored as parallel arrays over the source they were read from. Every token value is a
+    slice of the source, so only its start and length are kept. Token objects are created on access.
+    """
+
+    def __init__(self, source: str):
+        self.text: str | SourceText = source
+        '''The source, turned into a SourceText once it is edited'''
+        self.types = array('B')
+        '''Token type codes, indexes into TOKEN_TYPES'''
+        self.starts = array('q')
+        '''Offset of each token's value in the source, before pending shifts'''
+        self.lengths = array('I')
+        self.lines = array('q')
+        '''Line of each token, before pending shifts'''
+        self.chars = array('I')
+        self.shift_indices: list[int] = []
+        '''Sorted first token indexes of the shifts left pending by splice'''
+        self.shift_starts: list[int] = []
+        '''Start offset delta of every token from the matching shift index up to the next one'''
+        self.shift_lines: list[int] = []
+        '''Line delta of every token from the matching shift index up to the next one'''
+
+    @property
+    def source(self) -> str:
+        return str(self.text)
+
+    def append(self, token_type: TokenType, start: int, end: int, line: int, char: int):
+        self.types.append(TOKEN_TYPE_CODES[token_type])
+        self.starts.append(start)
+        self.lengths.append(end - start)
+        self.lines.append(line)
+        self.chars.append(char)
+
+    def token_type(self, index: int) -> TokenType:
+        return TOKEN_TYPES[self.types[index]]
+
+    def pending_shift(self, index: int) -> tuple[int, int]:
+        """Start offset and line deltas still pending for the token at index"""
+        if index < 0:
+            index += len(self)
+        n = bisect_right(self.shift_indices, index)
+        if n == 0:
+            return 0, 0
+        return self.shift_starts[n - 1], self.shift_lines[n - 1]
+
+    def start(self, index: int) -> int:
+        if self.shift_indices:
+            return self.starts[index] + self.pending_shift(index)[0]
+        return self.starts[index]
+
+    def line(self, index: int) -> int:
+        if self.shift_indices:
+            return self.lines[index] + self.pending_shift(index)[1]
+        return self.lines[index]
+
+    def value(self, index: int) -> str:
+        start = self.start(index)
+        return self.text[start:start + self.lengths[index]]
+
+    def find(self, offset: int) -> int:
+        """Index of the first token whose value starts at or after offset"""
+        if not self.shift_indices:
+            return bisect_left(self.starts, offset)
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self.start(mid) < offset:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def splice(self, first: int, last: int, replacement: TokenTable, offset_delta: int, line_delta: int):
+        """
+        Replaces tokens [first, last) with the tokens of replacement, whose positions must already be
+        final, then shifts every later token by offset_delta characters and line_delta lines.
+        The shift is recorded as pending rather than applied, so a splice does not touch later tokens;
+        it only updates the pending shifts after first.
+        """
+        # stored positions of the new tokens are offset so the shifts already pending at first cancel out
+        pending_offset, pending_line = self.pending_shift(first)
+        self.types[first:last] = replacement.types
+        self.starts[first:last] = array('q', [s - pending_offset for s in replacement.starts])
+        self.lengths[first:last] = replacement.lengths
+        self.lines[first:last] = array('q', [l - pending_line for l in replacement.lines])
+        self.chars[first:last] = replacement.chars
+
+        indices, starts, lines = self.shift_indices, self.shift_starts, self.shift_lines
+        after = first + len(replacement)
+        moved = after - last
+        # shifts of the replaced tokens and the new one all start at the first token after the replacement
+        p = bisect_right(indices, first)
+        q = bisect_right(indices, last, p)
+        before = (starts[p - 1], lines[p - 1]) if p else (0, 0)
+        at_after = (starts[q - 1], lines[q - 1]) if q > p else before
+        at_after = (at_after[0] + offset_delta, at_after[1] + line_delta)
+        if p and indices[p - 1] == after:
+            # nothing was inserted at a shift point, so its shift is replaced
+            p -= 1
+            before = (starts[p - 1], lines[p - 1]) if p else (0, 0)
+        merged = [after] if at_after != before and after < len(self) else []
+        indices[p:] = merged + [index + moved for index in indices[q:]]
+        starts[p:] = [at_after[0]] * len(merged) + [d + offset_delta for d in starts[q:]]
+        lines[p:] = [at_after[1]] * len(merged) + [d + line_delta for d in lines[q:]]
+
+    def apply_shifts(self):
+        """Writes every pending shift into the start and line arrays, for code that reads them directly"""
+        ends = self.shift_indices[1:] + [len(self)]
+        for index, end, start_delta, line_delta in zip(self.shift_indices, ends, self.shift_starts,
+                                                       self.shift_lines):
+            self.starts[index:end] = array('q', map(add, self.starts[index:end], repeat(start_delta)))
+            self.lines[index:end] = array('q', map(add, self.lines[index:end], repeat(line_delta)))
+        self.shift_indices, self.shift_starts, self.shift_lines = [], [], []
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index: int | slice) -> Token | list[Token]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        start = self.start(index)
+        return Token(TOKEN_TYPES[self.types[index]],
+                     self.text[start:start + self.lengths[index]],
+                     self.line(index),
+                     self.chars[index])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
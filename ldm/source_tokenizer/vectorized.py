@@ -0,0 +1,170 @@
+from .tokenizer_types import Token, TokenType, TokenTable, TOKEN_TYPES, TOKEN_TYPE_CODES
+from .tokenize import Tokenizer, TokenizerItems, WHITESPACE
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# character classes of the prepass
+SPACE, NEWLINE, SEPARATOR, QUOTE, DIGIT, ALPHA, DOT, OTHER, STRING = range(9)
+
+
+def build_class_table(items: TokenizerItems):
+    """Class of every ASCII character; any other character is an operator, as in the master regex"""
+    table = np.full(128, OTHER, dtype=np.uint8)
+    for c in WHITESPACE:
+        table[ord(c)] = SPACE
+    table[ord('\n')] = NEWLINE
+    table[ord('"')] = QUOTE
+    table[ord('.')] = DOT
+    for c in range(ord('0'), ord('9') + 1):
+        table[c] = DIGIT
+    for c in range(ord('a'), ord('z') + 1):
+        table[c] = ALPHA
+        table[c - 32] = ALPHA
+    table[ord('_')] = ALPHA
+    for s in items.expression_separators:
+        if len(s) == 1:
+            table[ord(s)] = SEPARATOR
+    return table
+
+
+def supports_items(items: TokenizerItems) -> bool:
+    """
+    The prepass only handles single-character operators, and separators that are whitespace
+    or punctuation other than . and \"
+    """
+    if items.operators:
+        return False
+    return all(len(s) != 1 or (s.isascii() and (s in WHITESPACE or not (s.isalnum() or s in '_."')))
+               for s in items.expression_separators)
+
+
+class VectorizedTokenizer(Tokenizer):
+    """
+    Tokenizer for very large sources. Every character is classified with NumPy and token boundaries
+    are found with vectorized comparisons, so Python only runs once per identifier when classifying it.
+    Output is identical to Tokenizer; malformed sources are rescanned by Tokenizer to raise the same error.
+    Requires numpy.
+    """
+    def __init__(self, items: TokenizerItems):
+        if np is None:
+            raise RuntimeError("VectorizedTokenizer requires numpy")
+        super().__init__(items)
+        self.class_table = build_class_table(items)
+        self.supported = supports_items(items)
+
+    def tokenize(self, source: str) -> list[Token]:
+        table = self.tokenize_table(source)
+        return [Token(TOKEN_TYPES[token_type], source[start:start + length], line, char)
+                for token_type, start, length, line, char
+                in zip(table.types, table.starts, table.lengths, table.lines, table.chars)]
+
+    def tokenize_table(self, source: str) -> TokenTable:
+        if not self.supported or not source:
+            return super().tokenize_table(source)
+        boundaries = self._boundaries(source)
+        if boundaries is None:
+            # malformed source: the scanner raises the same error the regular tokenizer would
+            return super().tokenize_table(source)
+        starts, ends, type_codes, is_newline = boundaries
+
+        identifier_type = self.items.identifier_types.get
+        identifiers = np.flatnonzero(type_codes == TOKEN_TYPE_CODES[TokenType.Identifier])
+        for i, start, end in zip(identifiers.tolist(), starts[identifiers].tolist(), ends[identifiers].tolist()):
+            token_type = identifier_type(source[start:end])
+            if token_type is not None:
+                type_codes[i] = TOKEN_TYPE_CODES[token_type]
+
+        line_numbers = np.cumsum(is_newline, dtype=np.int64)
+        line_starts = np.maximum.accumulate(np.where(is_newline, np.arange(len(source)), 0))
+        # a string token may start on its closing quote, which is never past the end of the source
+        lines = line_numbers[starts] + 1
+        chars = starts - line_starts[starts] + 1
+
+        table = TokenTable(source)
+        table.types = array('B', type_codes.tobytes())
+        table.starts = array('q', starts.astype(np.int64).tobytes())
+        table.lengths = array('I', (ends - starts).astype(np.uint32).tobytes())
+        table.lines = array('q', lines.astype(np.int64).tobytes())
+        table.chars = array('I', chars.astype(np.uint32).tobytes())
+        return table
+
+    def _boundaries(self, source: str):
+        """
+        Returns the starts, ends and type codes of every token in source, along with a mask of its
+        newlines, or None if source is malformed. Identifiers are all given the Identifier code.
+        """
+        if source.isascii():
+            codes = np.frombuffer(source.encode('ascii'), dtype=np.uint8)
+            classes = self.class_table[codes]
+        else:
+            codes = np.frombuffer(source.encode('utf-32-le'), dtype=np.uint32)
+            classes = np.where(codes < 128, self.class_table[np.minimum(codes, 127)], OTHER).astype(np.uint8)
+        n = len(classes)
+
+        # strings: quotes pair up in order and may not contain a newline or a null character
+        is_quote = classes == QUOTE
+        quotes = np.flatnonzero(is_quote)
+        if len(quotes) % 2:
+            return None
+        opens, closes = quotes[0::2], quotes[1::2]
+        breaks = np.cumsum((codes == 10) | (codes == 0))
+        if np.any(breaks[closes] != breaks[opens]):
+            return None
+        in_string = (np.cumsum(is_quote) % 2 == 1) | is_quote
+        classes = np.where(in_string, STRING, classes)
+
+        # words: runs of letters and digits; a run starting with a digit is a number
+        word = (classes == DIGIT) | (classes == ALPHA)
+        previous_word = np.concatenate(([False], word[:-1]))
+        run_starts = np.flatnonzero(word & ~previous_word)
+        run_ids = np.cumsum(word & ~previous_word) - 1
+        run_is_number = classes[run_starts] == DIGIT
+        run_has_alpha = np.zeros(len(run_starts), dtype=bool)
+        run_has_alpha[run_ids[classes == ALPHA]] = True
+        if np.any(run_is_number & run_has_alpha):
+            return None
+
+        # a dot right after a number continues it, along with the digits following the dot
+        dots = np.flatnonzero(classes == DOT)
+        dots = dots[dots > 0]
+        dots = dots[word[dots - 1]]
+        number_dots = dots[run_is_number[run_ids[dots - 1]]]
+        after_dot = np.append(classes, SPACE)[number_dots + 1]
+        if np.any((after_dot == DOT) | (after_dot == ALPHA)):
+            return None
+        fractions = number_dots[after_dot == DIGIT] + 1
+        # the digits after a number's dot may not be followed by another dot
+        fraction_runs = run_ids[fractions]
+        run_ends = np.flatnonzero(word & ~np.append(word[1:], False)) + 1
+        if np.any(np.append(classes, SPACE)[run_ends[fraction_runs]] == DOT):
+            return None
+
+        continues = word & previous_word
+        continues[number_dots] = True
+        continues[fractions] = True
+        token_char = (classes != SPACE) & (classes != NEWLINE) & (classes != STRING)
+        token_starts = np.flatnonzero(token_char & ~continues)
+        token_ends = np.flatnonzero(token_char & ~np.append(continues[1:], False)) + 1
+
+        start_classes = classes[token_starts]
+        type_codes = np.full(len(token_starts), TOKEN_TYPE_CODES[TokenType.Operator], dtype=np.uint8)
+        type_codes[start_classes == SEPARATOR] = TOKEN_TYPE_CODES[TokenType.ExpressionSeparator]
+        type_codes[start_classes == ALPHA] = TOKEN_TYPE_CODES[TokenType.Identifier]
+        dotted = np.zeros(n + 1, dtype=np.int64)
+        dotted[number_dots + 1] = 1
+        dotted = np.cumsum(dotted)
+        is_float = dotted[token_ends] != dotted[token_starts]
+        type_codes[start_classes == DIGIT] = TOKEN_TYPE_CODES[TokenType.Integer]
+        type_codes[(start_classes == DIGIT) & is_float] = TOKEN_TYPE_CODES[TokenType.Float]
+
+        starts = np.concatenate((token_starts, opens + 1))
+        ends = np.concatenate((token_ends, closes))
+        type_codes = np.concatenate((type_codes, np.full(len(opens), TOKEN_TYPE_CODES[TokenType.String],
+                                                         dtype=np.uint8)))
+        order = np.argsort(starts, kind='stable')
+        return starts[order], ends[order], type_codes[order], codes == 10
@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from typing import Any
 
 from ldm.lib_config2.parsing_types import Spec, \
-    StructureSpecComponent, ComponentType
+    StructureSpecComponent, ComponentType, TypePath
 from ldm.ast.parsing_types import (ParsingItems,
                                    ValueToken,
                                    TypeSpec,
@@ -22,6 +22,7 @@ def parse_component_structure(arg: dict, spec_components: dict[str, StructureSpe
             continue
 
         if component.value.startswith('.'):
+            component.type_path = TypePath.parse(component.value[1:])
             continue
 
         try:
@@ -132,13 +133,7 @@ def matches_type(expression_type: TypeSpec, necessary_type, parsing_items: Parsi
     if necessary_type not in types:
         raise RuntimeError(f'Primitive type "{necessary_type}" not found in spec')
 
-    val = types[necessary_type]
-    while val.superclass:
-        if val.superclass == expression_type:
-            return True
-        val = types[val.superclass.name]
-
-    return False
+    return parsing_items.type_hierarchy().is_subtype(necessary_type, expression_type.name)
 
 
 def translate_value_token(value_token: ValueToken, translation: TranslationItems) -> str:
@@ -168,7 +163,7 @@ def translate_typename(typename: TypenameInstance, translation: TranslationItems
             if component.value[0] != '.':
                 raise RuntimeError('Created type translate variable must start with a . to signify fields from typename')
 
-            result = tn.extract_from_path(component.value[1:])
+            result = tn.extract_from_path(component.type_path)
 
             if not isinstance(result, str):
                 raise RuntimeError('Created type translate variable must end in a name component')
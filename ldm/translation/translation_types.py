@@ -2,6 +2,8 @@ from __future__ import annotations
 from enum import Enum
 from dataclasses import dataclass
 
+from ldm.lib_config2.parsing_types import TypePath
+
 
 class TranslationStructureComponentType(Enum):
     String = 1
@@ -17,6 +19,8 @@ class TranslationStructureComponent:
     """The value of the component. Variables usually start with "$"."""
     inner_structure: list[TranslationStructureComponent] | None = None
     inner_fields: dict[str, str] | None = None
+    type_path: TypePath | None = None
+    """For variables starting with ".", the path into the created type, compiled when the translation loads"""
 
 
 def parse_translate_into_components(structure: str) -> list[TranslationStructureComponent]:
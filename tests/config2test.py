@@ -2,10 +2,20 @@ import unittest
 import sys
 sys.path.append('..')
 
+import copy
 import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
 from ldm.lib_config2.spec_parsing import parse_spec, string_to_typespec
 from ldm.lib_config2.def_parsing import add_structure_definitions_to_spec
-from ldm.lib_config2.parsing_types import OperatorType
+from ldm.lib_config2.parsing_types import OperatorType, TypeSpec, TypePath, compile_structures
+from ldm.source_tokenizer.tokenize import TokenizerItems
+from ldm.ast.structure_index import StructureIndex
+from ldm.lib_config2.spec_snapshot import load_spec, write_snapshot
+from ldm.lib_config2.custom_spec_parsing import parse_config, config_to_items, read_config_file
 
 
 class MyTestCase(unittest.TestCase):
@@ -56,6 +66,66 @@ class MyTestCase(unittest.TestCase):
         assert spec.subtypes[1].subtypes[0].name == 'float'
         assert len(spec.subtypes[1].subtypes[0].subtypes) == 0
 
+    def test_typespec_interning(self):
+        int_type = TypeSpec('int', 0, [])
+        float_type = TypeSpec('float', 0, [])
+        map_type = TypeSpec('map', 2, [int_type, float_type])
+
+        # equal types are the same object
+        assert TypeSpec('int', 0, []) is int_type
+        assert string_to_typespec('map<int, float>') is map_type
+        assert string_to_typespec('map<int, float>').subtypes[0] is int_type
+        assert string_to_typespec('map<float, int>') is not map_type
+        assert len({int_type, TypeSpec('int', 0, []), map_type}) == 2
+
+        # attributes and paths are part of the type
+        with_attributes = map_type.replace(attributes={'x': int_type, 'ys': [int_type, float_type]})
+        assert with_attributes is not map_type
+        assert with_attributes is map_type.replace(attributes={'x': int_type, 'ys': (int_type, float_type)})
+        assert with_attributes.attributes['ys'] == (int_type, float_type)
+        assert string_to_typespec('$typename_attributes<$x>.y').path == 'y'
+        assert string_to_typespec('$typename_attributes<$x>.y') is not string_to_typespec('$typename_attributes<$x>.z')
+
+        # the associated structure is compared by identity, not by value
+        with open('test_std_spec.json') as f:
+            struct = parse_spec(json.load(f)).structured_objects['struct']
+        struct_copy = copy.copy(struct)
+        assert struct_copy == struct
+        point = TypeSpec('Point', 0, [], associated_structure=struct)
+        assert TypeSpec('Point', 0, [], associated_structure=struct) is point
+        assert TypeSpec('Point', 0, [], associated_structure=struct_copy) is not point
+        assert TypeSpec('Point', 0, []) is not point
+
+        with self.assertRaises(AttributeError):
+            int_type.name = 'float'
+        with self.assertRaises(ValueError):
+            TypeSpec('int', 1, [])
+        assert pickle.loads(pickle.dumps(with_attributes)) is with_attributes
+
+    def test_type_hierarchy(self):
+        with open('test_std_spec.json') as f:
+            spec = parse_spec(json.load(f))
+        types = spec.type_hierarchy
+
+        assert types.is_subtype('int8', 'int')
+        assert types.is_subtype('int', 'int')
+        assert not types.is_subtype('int', 'int8')
+        assert not types.is_subtype('int8', 'float')
+        assert not types.is_subtype('unknown', 'int')
+        assert types.is_subtype('unknown', 'unknown')
+
+        types = types.copy()
+        types.declare('int4', 'int8')
+        types.declare('node')
+        assert types.is_subtype('int4', 'int')
+        assert not types.is_subtype('node', 'int')
+        assert 'int4' not in spec.type_hierarchy
+        int_descendants = types.descendants[types.ids['int']]
+        assert {name for name, i in types.ids.items() if int_descendants >> i & 1} == {'int', 'int8', 'int4'}
+
+        with self.assertRaises(ValueError):
+            types.declare('int16', 'missing')
+
 
     def test_operator_type_classification(self):
         spec = '''
@@ -180,6 +250,189 @@ class MyTestCase(unittest.TestCase):
             add_structure_definitions_to_spec(spec, def_data)
             assert True
 
+    def test_duplicate_structures(self):
+        with open('test_std_def.json') as f:
+            def_data = json.load(f)
+
+        with open('test_std_spec.json') as f:
+            spec = parse_spec(json.load(f))
+        changed = [dict(item, structure='$left + $right') if item.get('name') == '*' else item for item in def_data]
+        with self.assertRaises(ValueError):
+            add_structure_definitions_to_spec(spec, changed)
+
+        # operators sharing a trigger and operator type still load, and are reported as ambiguous
+        with open('test_std_spec.json') as f:
+            spec = parse_spec(json.load(f))
+        changed = [dict(item, structure='$left ? $right') if item.get('name') == '<' else item for item in def_data]
+        add_structure_definitions_to_spec(spec, changed)
+        index = StructureIndex(spec.structured_objects, TokenizerItems.from_spec(spec))
+        assert index.overlapping('<', True) == ['?:']
+        assert '<' in index.ambiguous[True]
+
+    def test_component_options(self):
+        with open('test_std_spec.json') as f:
+            spec_data = json.load(f)
+        spec = parse_spec(spec_data)
+        objects = spec.structured_objects
+
+        block = objects['main_block'].structure.component_specs['body']
+        assert block.options.local and block.options.filter is None and block.options.insert_scope == ()
+
+        body = objects['function'].structure.component_specs['body']
+        modified = block.with_modifiers(body.modifiers['body'])
+        insertion = modified.options.insert_scope[0]
+        assert insertion.types.path.parts == ('arguments', 'type') and insertion.names.path.parts == ('arguments', 'varname')
+        assert block.options.insert_scope == ()
+
+        struct_body = objects['struct'].structure.component_specs['body']
+        struct_filter = block.with_modifiers(struct_body.modifiers['body']).options.filter
+        assert [f.value for f in struct_filter.filters] == ['struct_initialize_variable']
+
+        # malformed options fail when the spec loads
+        for name, key, value in [('struct', 'filter', [{'type': 'contains', 'contains': 'create_nothing'}]),
+                                 ('struct', 'filter', [{'type': 'everything'}]),
+                                 ('if', 'scope', 'sideways'),
+                                 ('if', 'insert_scope', [{'type': '$type'}]),
+                                 ('function', 'scope', 'global')]:
+            broken = copy.deepcopy(spec_data)
+            item = next(item for item in broken if item['type'] == 'structure' and item['name'] == name)
+            next(c for c in item['components'] if c['name'] == 'body')['modifiers']['body'][key] = value
+            with self.assertRaises(ValueError):
+                parse_spec(broken)
+
+    def test_component_paths(self):
+        with open('test_std_spec.json') as f:
+            spec_data = json.load(f)
+        objects = parse_spec(spec_data).structured_objects
+
+        assert objects['function'].create_variable.attribute_items['arguments'].path.parts == ('arguments', 'type')
+        assert [p.parts for p in objects['struct'].create_type.fields_container_paths] == [('body', 'body')]
+        assert objects['function_call'].create_operator.field_paths['arguments.arg'].parts == ('arguments', 'arg')
+
+        access = objects['. access'].create_operator.overloads[0]
+        field = access.variable_types[access.return_type]
+        assert field.variable.parts == ('left',) and [str(a) for a in field.attributes] == ['$right']
+        create = objects['create_struct'].create_operator.overloads[0]
+        full = create.variable_types[create.variables['fields.value']]
+        assert full.variable.parts == ('struct_name',) and full.keys.parts == ('fields', 'item_name')
+
+        # paths to missing components fail when the spec loads
+        def structure(data: list, name: str) -> dict:
+            return next(item for item in data if item['type'] == 'structure' and item['name'] == name)
+
+        broken_specs = []
+        broken = copy.deepcopy(spec_data)
+        structure(broken, 'struct')['create_type']['fields_containers'] = ['body.nothing']
+        broken_specs.append(broken)
+        broken = copy.deepcopy(spec_data)
+        structure(broken, 'function')['create_variable']['attributes']['arguments'] = '$varname.type'
+        broken_specs.append(broken)
+        broken = copy.deepcopy(spec_data)
+        next(item for item in broken if item['type'] == 'operator_overload' and item['name'] == '. access')['return'] = \
+            '$typename_field<$left>.$middle'
+        broken_specs.append(broken)
+        for broken in broken_specs:
+            with self.assertRaises(ValueError):
+                parse_spec(broken)
+
+        assert TypePath.parse('sub_1.attr_x.name').steps == (('sub', 1), ('attr', 'x'), ('name', None))
+        with self.assertRaises(ValueError):
+            TypePath.parse('name.sub_0')
+
+    def test_compile_structures(self):
+        with open('test_std_spec.json') as f:
+            spec = parse_spec(json.load(f))
+        with open('test_std_def.json') as f:
+            add_structure_definitions_to_spec(spec, json.load(f))
+        tokenizer_items = TokenizerItems.from_spec(spec)
+        compile_structures(spec, tokenizer_items)
+        objects = spec.structured_objects
+
+        assert objects['+'].compiled.operator_type == OperatorType.BINARY
+        assert objects['+'].compiled.num_lefts == 1
+        assert objects['neg'].compiled.operator_type == OperatorType.UNARY_RIGHT
+        assert objects['()'].compiled.operator_type == OperatorType.INTERNAL
+        assert objects['?:'].compiled.literal_tokens == (None, ('?',), None, (':',), None)
+        assert [d.value for d in objects['?:'].compiled.variable_defs] == ['condition', 'if_true', 'if_false']
+        assert objects['?:'].get_nth_component(-1).name == objects['?:'].structure.component_specs['if_false'].name
+        assert objects['+'].get_compiled(tokenizer_items) is objects['+'].compiled
+
+        inner_objects = [o for o in objects['create_struct'].compiled.inner_objects if o is not None]
+        assert len(inner_objects) == 1
+        assert inner_objects[0].compiled.tokenizer_items is tokenizer_items
+
+    def test_spec_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            files = []
+            for name in ['test_std_spec.json', 'test_std_def.json', 'python_std.json']:
+                files.append(os.path.join(directory, name))
+                shutil.copy(name, files[-1])
+
+            compiled = load_spec(*files)
+            assert not compiled.loaded_from_snapshot
+            assert os.path.exists(files[0] + '.snapshot')
+
+            snapshot = load_spec(*files)
+            assert snapshot.loaded_from_snapshot
+            assert snapshot.spec.structured_objects.keys() == compiled.spec.structured_objects.keys()
+            assert snapshot.spec.initializer_formats.keys() == compiled.spec.initializer_formats.keys()
+            assert snapshot.translation.structured_objects.keys() == compiled.translation.structured_objects.keys()
+
+            # any change to an input file makes the snapshot stale
+            with open(files[1]) as f:
+                def_data = json.load(f)
+            with open(files[1], 'w') as f:
+                json.dump(def_data, f, indent=4)
+            assert not load_spec(*files).loaded_from_snapshot
+            assert load_spec(*files).loaded_from_snapshot
+
+            # a snapshot that cannot be written leaves no temporary file behind
+            broken = copy.copy(compiled)
+            broken.translation = lambda: None
+            with self.assertRaises((pickle.PicklingError, AttributeError, TypeError)):
+                write_snapshot(os.path.join(directory, 'broken.snapshot'), files, broken)
+            assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+            assert not os.path.exists(os.path.join(directory, 'broken.snapshot'))
+
+    def test_native_spec_files(self):
+        for native, json_file in [('test_std_spec.ldm_spec', 'test_std_spec.json'),
+                                  ('test_std_def.ldm_def', 'test_std_def.json')]:
+            with open(json_file) as f:
+                assert read_config_file(native) == json.load(f)
+
+        objects = parse_config('@a x { @b(y z) [ $l [ 0 ] ] @c }')
+        assert len(objects) == 1 and objects[0].object_arguments == ['x']
+        b = objects[0].get_property('b')
+        assert b.object_direct_arguments == ['y', 'z'] and b.object_arguments == ['$l [ 0 ]']
+        assert objects[0].get_property('c').object_properties is None
+        objects = parse_config('\n@a {\n  @b [\n\n]\n  @c\n}\n@d')
+        assert [objects[0].line, objects[0].get_property('b').line, objects[0].get_property('c').line,
+                objects[1].line] == [2, 3, 6, 8]
+        for source in ['@a {', '@a } }', 'x @a', '@a { [ x }', '@a { @b 1 @b 2 }']:
+            with self.assertRaises(ValueError):
+                config_to_items(parse_config(source))
+
+        with tempfile.TemporaryDirectory() as directory:
+            files = []
+            for name in ['test_std_spec.ldm_spec', 'test_std_def.ldm_def']:
+                files.append(os.path.join(directory, name))
+                shutil.copy(name, files[-1])
+            # old enough for their modification times to be trusted
+            past = time.time() - 3600
+            for file in files:
+                os.utime(file, (past, past))
+
+            compiled = load_spec(*files)
+            assert not compiled.loaded_from_snapshot
+            assert compiled.spec == load_spec('test_std_spec.json', 'test_std_def.json',
+                                              snapshot_file=os.path.join(directory, 'json.snapshot')).spec
+            assert load_spec(*files).loaded_from_snapshot
+
+            # touching a file without changing it keeps the snapshot
+            os.utime(files[1], (past + 60, past + 60))
+            assert load_spec(*files).loaded_from_snapshot
+            assert load_spec(*files).loaded_from_snapshot
+
 
 
 if __name__ == '__main__':
@@ -9,12 +9,19 @@ from ldm.ast.parsing_types import StructuredObjectInstance
 
 import unittest
 import json
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import tempfile
+import time
 from ldm.lib_config2.spec_parsing import parse_spec
 from ldm.lib_config2.def_parsing import add_structure_definitions_to_spec
 from ldm.source_tokenizer.tokenizer_types import *
 from ldm.ast.parsing import ParsingItems, parse
 from ldm.ast import parsing_types as ast_pt
 import ldm.lib_config2.parsing_types as pt
+from ldm.source_tokenizer.tokenize import TokenizerItems, Tokenizer
+from ldm.lib_config2.spec_registry import SpecRegistry
 from parse_test_spec_definitions import SPEC, TOKENIZER, TOKENIZER_ITEMS
 
 
@@ -464,6 +471,178 @@ class MyTestCase(unittest.TestCase):
             print(e)
             assert True
 
+    def test_parse_from_token_table(self):
+        source = '''
+        int x = 5 + 4.5;
+        int y = 6 * 3;
+        '''
+        ast, _ = parse(TOKENIZER.tokenize_table(source), ParsingItems(SPEC), TOKENIZER_ITEMS)
+
+        assert len(ast) == 2
+        assert ast[0].components['expr'].so.name == '+'
+        assert ast[1].components['varname'].value == 'y'
+
+    def test_structure_index(self):
+        spec = load_setup()
+        tokenizer_items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        parsing_items = ParsingItems(spec)
+        index = parsing_items.structure_index(tokenizer_items)
+        names = list(spec.structured_objects)
+
+        def candidates(value, is_typename=False, is_name=False, skip=False, expressions_allowed=True):
+            return [so.name for so in index.candidates(value, is_typename, is_name, skip,
+                                                       expressions_allowed=expressions_allowed)]
+
+        expressions = [so.name for so in spec.structured_objects.values()
+                       if so.structure.component_defs and
+                       so.structure.component_defs[0].component_type == pt.StructureComponentType.Variable and
+                       so.structure.component_specs[so.structure.component_defs[0].value].base == pt.ComponentType.EXPRESSION]
+
+        assert candidates('x') == expressions
+        assert 'if' in candidates('if') and 'struct' not in candidates('if')
+        assert 'make_variable_standard' in candidates('int', is_typename=True)
+        assert 'make_variable_standard' not in candidates('int')
+        assert candidates('if') == sorted(candidates('if'), key=names.index)
+        assert '+' in candidates('+', skip=True) and '+' not in candidates('x', skip=True)
+        # structures only parsed in expressions are not candidates where expressions are not allowed
+        assert candidates('x', expressions_allowed=False) == \
+               [name for name in expressions if not spec.structured_objects[name].expression_only]
+        assert '+' not in candidates('+', skip=True, expressions_allowed=False)
+        assert parsing_items.structure_index(tokenizer_items) is index
+        # the index is built once per spec and tokenizer items, not once per ParsingItems
+        assert ParsingItems(spec).structure_index(tokenizer_items) is index
+        other_items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        assert ParsingItems(spec).structure_index(other_items) is not index
+
+    def test_structure_lookahead(self):
+        from ldm.ast.structure_index import TYPENAME, ANY
+        from ldm.source_tokenizer.tokenize import Tokenizer
+        spec = load_setup()
+        tokenizer_items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        index = ParsingItems(spec).structure_index(tokenizer_items)
+        objects = spec.structured_objects
+
+        assert index.lookahead['function'][0] == {(TYPENAME, ANY, '(')}
+        assert index.lookahead['make_variable_standard'][0] == {(TYPENAME, ANY, '=')}
+        # leading expressions cannot be looked past, so only the skipped form has a lookahead
+        assert index.lookahead['+'][0] is None
+
+        tokens = ast_pt.TokenIterator(Tokenizer(tokenizer_items).tokenize("int x = 5;"))
+        assert index.lookahead_matches(objects['make_variable_standard'], tokens)
+        assert not index.lookahead_matches(objects['function'], tokens)
+        # running out of tokens is not a mismatch
+        tokens = ast_pt.TokenIterator(Tokenizer(tokenizer_items).tokenize("int x"))
+        assert index.lookahead_matches(objects['function'], tokens)
+
+    def test_structure_ambiguity(self):
+        spec = load_setup()
+        tokenizer_items = TokenizerItems(spec.primitive_types, spec.expression_separators, {'if', 'struct'})
+        index = ParsingItems(spec).structure_index(tokenizer_items)
+        objects = spec.structured_objects
+
+        pairs = {(a.first, a.second, a.skip_first_expressions) for a in index.ambiguities}
+        assert ('-', 'neg', True) in pairs
+        assert ('()', 'function_call', True) in pairs
+        assert ('make_variable_standard', 'function', False) not in pairs
+        # operators starting with an expression could start anywhere
+        assert '+' in index.unpredictable[False]
+
+        for name in ['make_variable_standard', 'function', 'if', 'struct']:
+            assert index.commits_on_match(objects[name], False, False)
+            assert not index.commits_on_match(objects[name], False, True)
+        assert not index.commits_on_match(objects['neg'], True, True)
+        assert index.commits_on_match(objects['+'], True, True)
+
+        # without keywords, if could be declared as a type, so it may start a variable declaration
+        index = ParsingItems(spec).structure_index(TokenizerItems(spec.primitive_types, spec.expression_separators))
+        assert not index.commits_on_match(objects['if'], False, False)
+
+        # a statement that is a prefix of another is reported with it, and neither commits on a match
+        with open('test_std_spec.json') as f:
+            spec_data = json.load(f)
+        with open('test_std_def.json') as f:
+            def_data = json.load(f)
+        for name in ['repeat', 'repeat_until']:
+            spec_data.append({'type': 'structure', 'name': name, 'components': [
+                {'base': 'expression', 'name': 'condition'},
+                {'base': 'structure', 'name': 'body', 'structure': 'main_block',
+                 'modifiers': {'body': {'scope': 'local'}}},
+            ]})
+        def_data.append({'type': 'structure', 'name': 'repeat', 'structure': 'repeat $body ( $condition )'})
+        def_data.append({'type': 'structure', 'name': 'repeat_until',
+                         'structure': 'repeat $body until ( $condition )'})
+        spec = parse_spec(spec_data)
+        add_structure_definitions_to_spec(spec, def_data)
+        tokenizer_items = TokenizerItems(spec.primitive_types, spec.expression_separators,
+                                         {'if', 'struct', 'repeat', 'until'})
+        index = ParsingItems(spec).structure_index(tokenizer_items)
+        assert ('repeat', 'repeat_until', False) in \
+               {(a.first, a.second, a.skip_first_expressions) for a in index.ambiguities}
+        assert index.overlapping('repeat', False, False) == ['repeat_until']
+        assert 'repeat_until' in index.overlapping('repeat', False)
+        assert {'repeat', 'repeat_until'} <= index.ambiguous_statements[False]
+        assert not index.commits_on_match(spec.structured_objects['repeat'], False, False)
+        assert index.commits_on_match(spec.structured_objects['if'], False, False)
+
+    def test_structure_filter_masks(self):
+        from ldm.ast.structure_parser import to_filter
+        spec = load_setup()
+        index = ParsingItems(spec).structure_index(TokenizerItems(spec.primitive_types, spec.expression_separators))
+        structures = [so for so in spec.structured_objects.values() if so.structure.component_defs]
+
+        filters = [
+            to_filter('all'),
+            to_filter('expressions'),
+            to_filter([{'type': 'contains', 'contains': 'create_variable'}]),
+            to_filter([{'type': 'excludes', 'excludes': 'create_operator'}, {'type': 'structure', 'structure': '+'}]),
+            to_filter([{'type': 'and', 'filters': [{'type': 'contains', 'contains': 'create_operator'},
+                                                   {'type': 'excludes', 'excludes': 'create_type'}]}]),
+        ]
+        filters += [f.operator_variant(needs_left) for f in filters for needs_left in (True, False)]
+        for f in filters:
+            mask = f.mask(index)
+            for so in structures:
+                assert bool((mask >> index.ordinals[so.name]) & 1) == f.matches(so), (f, so.name)
+
+        # variants and masks are cached until the filter changes
+        f = to_filter('expressions')
+        assert f.operator_variant(True) is f.operator_variant(True)
+        assert f.mask(index) == 0
+        f.add_filter(pt.StructureFilterComponent(pt.StructureFilterComponentType.STRUCTURE, '+'))
+        assert f.mask(index) == 1 << index.ordinals['+']
+
+    def test_overload_dispatch(self):
+        from ldm.ast.type_checking import resolve_overload
+        int_type = pt.TypeSpec("int", 0, [])
+        float_type = pt.TypeSpec("float", 0, [])
+        generic = pt.TypeSpec("$typename", 1, [pt.TypeSpec("T", 0, [])])
+
+        dispatch = SPEC.structured_objects['+'].create_operator.get_dispatch()
+        assert len(dispatch.exact) == 4 and dispatch.generic == []
+        (overload, _), _ = resolve_overload(dispatch, {"left": float_type, "right": int_type}, None, None)
+        assert overload.return_type is float_type
+
+        # a generic overload listed before an exact one is still tried first
+        overloads = [
+            pt.OperatorOverload("+", float_type, {"left": float_type, "right": float_type}),
+            pt.OperatorOverload("+", generic, {"left": generic, "right": generic}),
+            pt.OperatorOverload("+", float_type, {"left": int_type, "right": int_type}),
+        ]
+        dispatch = pt.OverloadDispatch(["left", "right"], overloads)
+        assert len(dispatch.exact) == 2 and len(dispatch.generic) == 1
+        (overload, generics), uses_context = resolve_overload(dispatch, {"left": int_type, "right": int_type}, None, None)
+        assert overload is overloads[1] and generics == {"T": int_type} and not uses_context
+        (overload, _), _ = resolve_overload(dispatch, {"left": float_type, "right": float_type}, None, None)
+        assert overload is overloads[0]
+        resolved, _ = resolve_overload(dispatch, {"left": int_type, "right": float_type}, None, None)
+        assert resolved is None
+
+        # each operator and type combination is resolved once per parse
+        parsing_items = ParsingItems(SPEC)
+        ast, _ = parse(TOKENIZER.tokenize("int x = 1 + 2;\nint y = 3 + 4 + 5;"), parsing_items, TOKENIZER_ITEMS)
+        assert list(parsing_items.resolved_overloads) == [('+', (int_type, int_type))]
+        assert ast[1].components['expr'].operator_fields.result_type is int_type
+
     def test_if_empty(self):
         source = '''
         if (true){
@@ -624,12 +803,150 @@ class MyTestCase(unittest.TestCase):
         
         int x = p.x;
         """
+        identifier_types = dict(TOKENIZER_ITEMS.identifier_types)
         tokens = TOKENIZER.tokenize(source_code)
 
-        ast, context = parse(tokens, ParsingItems(spec), TOKENIZER_ITEMS)
+        items = ParsingItems(spec)
+        ast, context = parse(tokens, items, TOKENIZER_ITEMS)
 
         assert len(ast) == 3
         assert isinstance(ast[0], ast_pt.StructuredObjectInstance)
 
+        # the declared type belongs to this parse, not to the shared tokenizer items
+        assert items.declared_types == {'Point'}
+        assert dict(TOKENIZER_ITEMS.identifier_types) == identifier_types
+        assert TOKENIZER.tokenize("Point")[0].type == TokenType.Identifier
+        with self.assertRaises(ParsingTracebackError):
+            parse(TOKENIZER.tokenize("Point p = Point {x=6, y=7};"), ParsingItems(spec), TOKENIZER_ITEMS)
+        # nor to the next parse with the same items
+        with self.assertRaises(ParsingTracebackError):
+            parse(TOKENIZER.tokenize("Point p = Point {x=6, y=7};"), items, TOKENIZER_ITEMS)
+        assert items.declared_types == set()
+
+    def test_frozen_spec_parsed_concurrently(self):
+        spec = load_setup().freeze(TOKENIZER_ITEMS)
+        main_block = spec.structured_objects['main_block'].structure.component_specs['body']
+        original = dict(main_block.other)
+
+        with self.assertRaises(AttributeError):
+            spec.structured_objects['if'].name = 'else'
+        with self.assertRaises(TypeError):
+            main_block.other['scope'] = 'global'
+
+        sources = []
+        for i in range(40):
+            sources.append(f'''
+            int f{i}(int x, bool y){{
+                int k = x + {i};
+                y ? x : k + 1;
+            }}
+            if (f{i}({i}, true) < {i}){{
+                int z = {i} * 2;
+            }}
+            f{i}(5, false);
+            struct Point{i} {{
+                int x;
+            }}
+            Point{i} p = Point{i} {{x={i}}};
+            ''')
+        token_lists = [TOKENIZER.tokenize(source) for source in sources]
+        identifier_types = TOKENIZER_ITEMS.identifier_types
+        operators = set(TOKENIZER_ITEMS.operators)
+
+        def parse_source(tokens):
+            return parse(tokens, ParsingItems(spec), TOKENIZER_ITEMS)[0]
+
+        expected = [parse_source(tokens) for tokens in token_lists]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(parse_source, token_lists * 4))
+
+        assert results == expected * 4
+        assert [len(ast) for ast in expected] == [5] * len(sources)
+        assert dict(main_block.other) == original
+        # declaring types does not change the shared tokenizer items
+        assert TOKENIZER_ITEMS.identifier_types is identifier_types
+        assert not any(f'Point{i}' in identifier_types for i in range(len(sources)))
+        assert TOKENIZER_ITEMS.operators == operators
+
+        # other tokenizer items compile the frozen structures once instead of on every use
+        other_items = TokenizerItems.from_spec(spec)
+        assert len(parse(token_lists[0], ParsingItems(spec), other_items)[0]) == 5
+        so = spec.structured_objects['if']
+        compiled = so.compile_cache.get(other_items)
+        assert compiled is not None and compiled.tokenizer_items is other_items
+        assert so.compiled_for(other_items) is compiled
+        assert so.compiled.tokenizer_items is TOKENIZER_ITEMS
+
+    def test_spec_registry_reload(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spec_file = os.path.join(directory, 'spec.json')
+            def_file = os.path.join(directory, 'def.json')
+            shutil.copy('test_std_spec.json', spec_file)
+            shutil.copy('test_std_def.json', def_file)
+            with open(spec_file) as f:
+                spec_data = json.load(f)
+
+            def write_spec(data):
+                with open(spec_file, 'w') as f:
+                    json.dump(data, f)
+
+            def parse_with(version, source):
+                tokens = Tokenizer(version.tokenizer_items).tokenize(source)
+                return parse(tokens, version.parsing_items(), version.tokenizer_items)[0]
+
+            registry = SpecRegistry(spec_file, def_file)
+            first = registry.get()
+            assert not registry.poll()
+
+            # one new overload only rebuilds its operator
+            write_spec(spec_data + [{"type": "operator_overload", "name": "+", "left": "bool", "right": "bool",
+                                     "return": "bool"}])
+            assert registry.poll()
+            second = registry.get()
+            assert second.rebuilt == {'+'}
+            assert second.tokenizer_items is first.tokenizer_items
+            assert second.spec.structured_objects['-'] is first.spec.structured_objects['-']
+            assert second.index.lookahead['-'] is first.index.lookahead['-']
+            assert len(second.spec.structured_objects['+'].create_operator.overloads) == 5
+            assert len(first.spec.structured_objects['+'].create_operator.overloads) == 4
+
+            # parses keep the version they started with
+            source = 'bool b = true + false;'
+            assert parse_with(second, source)[0].so.name == 'make_variable_standard'
+            with self.assertRaises(ValueError):
+                parse_with(first, source)
+
+            # a broken spec keeps the current version
+            write_spec(spec_data + [{"type": "operator_overload", "name": "missing", "return": "int"}])
+            with self.assertRaises(ValueError):
+                registry.poll()
+            assert registry.get() is second
+
+            # changed primitive types rebuild everything
+            spec_data[0]['is'] = 'int'
+            write_spec(spec_data)
+            assert registry.poll()
+            assert registry.get().rebuilt == set(second.spec.structured_objects)
+
+            # the watcher keeps running after a reload fails with any error
+            current = registry.get()
+            write_spec(spec_data + [42])
+            registry.watch(0.01)
+            try:
+                for _ in range(500):
+                    if registry.error is not None:
+                        break
+                    time.sleep(0.01)
+                assert isinstance(registry.error, TypeError)
+                write_spec(spec_data)
+                for _ in range(500):
+                    if registry.error is None:
+                        break
+                    time.sleep(0.01)
+                assert registry.error is None
+                assert registry.get() is not current
+            finally:
+                registry.close()
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,18 @@
 import unittest
+import unittest.mock
 
+import io
 import json
+import os
+import copy
+import random
+import tempfile
 from ldm.lib_config2.spec_parsing import parse_spec
-from ldm.lib_config2.def_parsing import add_structure_definitions_to_spec
-from ldm.source_tokenizer.tokenize import Tokenizer, TokenizerItems
+from ldm.lib_config2.def_parsing import add_structure_definitions_to_spec, parse_structure_into_components
+from ldm.source_tokenizer.tokenize import Tokenizer, TokenizerItems, CharTokenizer
+from ldm.source_tokenizer import vectorized
+from ldm.source_tokenizer.parallel import ParallelTokenizer
+from ldm.source_tokenizer.token_cache import TokenCache, CachingTokenizer
 from ldm.source_tokenizer.tokenizer_types import *
 from ldm.ast.parsing import ParsingItems, parse
 
@@ -73,6 +82,264 @@ class MyTestCase(unittest.TestCase):
         assert tokens[1].type == TokenType.ExpressionSeparator
         assert tokens[1].value == ';'
 
+    def test_parity_with_char_tokenizer(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+
+        pieces = ['int', 'x', 'foo_1', '=', '5', '12.75', '3.', ';', '+', '-', '(', ')', '{', '}',
+                  '"hello world"', '"a;b"', 'true', 'float', '&', '<', '.', ',', ' ', '\t', '\n']
+        rng = random.Random(0)
+        sources = [
+            "int x = 5;\nfloat y = 2.5 * x;",
+            "if (x < 14) {\n    x = 14;\n}\n",
+            'string s = "text with spaces";  ',
+        ]
+        for _ in range(500):
+            sources.append(''.join(rng.choice(pieces) + rng.choice(['', ' ', '\n']) for _ in range(rng.randint(0, 30))))
+
+        def token_stream(tokenizer, source):
+            try:
+                return [(t.type, t.value, t.char) for t in tokenizer.tokenize(source)]
+            except ValueError:
+                return ValueError
+
+        for source in sources:
+            assert token_stream(Tokenizer(items), source) == token_stream(CharTokenizer(items), source), source
+
+    def test_identifier_classification(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators, {'if'})
+        tokens = Tokenizer(items).tokenize("if int true Point")
+        assert [t.type for t in tokens] == [TokenType.Keyword, TokenType.PrimitiveType,
+                                            TokenType.ValueKeyword, TokenType.Identifier]
+
+    def test_line_numbers(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        tokens = Tokenizer(items).tokenize("int x\n\n  = 5;\n")
+
+        assert [t.value for t in tokens] == ['int', 'x', '=', '5', ';']
+        assert [t.line for t in tokens] == [1, 1, 3, 3, 3]
+
+    def test_iter_tokens_matches_tokenize(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        tokenizer = Tokenizer(items)
+        source = 'int x = 12;\n\n  string s = "a long string literal";\nfloat y = 2.5 * x;\n'
+        expected = [(t.type, t.value, t.line, t.char) for t in tokenizer.tokenize(source)]
+
+        with tempfile.NamedTemporaryFile('w', suffix='.ldm', delete=False) as f:
+            f.write(source)
+        try:
+            for chunk_size in [1, 5, 64]:
+                for use_mmap in [False, True]:
+                    tokens = tokenizer.iter_tokens(f.name, chunk_size=chunk_size, use_mmap=use_mmap)
+                    assert [(t.type, t.value, t.line, t.char) for t in tokens] == expected
+                tokens = tokenizer.iter_tokens(io.StringIO(source), chunk_size=chunk_size)
+                assert [(t.type, t.value, t.line, t.char) for t in tokens] == expected
+
+            # a line much longer than a chunk is carried over many reads
+            long_source = 'int z = ' + ' + '.join(['1'] * 2000) + ';\nint w;'
+            tokens = tokenizer.iter_tokens(io.StringIO(long_source), chunk_size=3)
+            assert [(t.type, t.value, t.line, t.char) for t in tokens] == \
+                   [(t.type, t.value, t.line, t.char) for t in tokenizer.tokenize(long_source)]
+        finally:
+            os.unlink(f.name)
+
+    def test_token_table(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        tokenizer = Tokenizer(items)
+        source = 'int x = 12;\nstring s = "text";\nfloat y = 2.5 * x;'
+        tokens = tokenizer.tokenize(source)
+        table = tokenizer.tokenize_table(source)
+
+        assert len(table) == len(tokens)
+        assert [(t.type, t.value, t.line, t.char) for t in table] == [(t.type, t.value, t.line, t.char) for t in tokens]
+        assert table[-1].value == ';'
+        assert table.token_type(5) == TokenType.PrimitiveType
+        assert table.value(8) == 'text'
+
+    def test_retokenize_matches_full_tokenize(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        tokenizer = Tokenizer(items)
+        rng = random.Random(1)
+        pieces = ['int x = 12;', '\n', 'string s = "a b";', ' ', 'y * 2.5', '\n\n', '+', 'name', '"', ';']
+        source = 'int x = 12;\nstring s = "text";\n\nfloat y = 2.5 * x;\n'
+        table = tokenizer.tokenize_table(source)
+
+        for _ in range(300):
+            offset = rng.randint(0, len(source))
+            removed = rng.randint(0, min(6, len(source) - offset))
+            inserted = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 2)))
+            edited = source[:offset] + inserted + source[offset + removed:]
+            try:
+                expected = tokenizer.tokenize(edited)
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    tokenizer.retokenize(table, offset, removed, inserted)
+                assert table.source == source
+                continue
+            tokenizer.retokenize(table, offset, removed, inserted)
+            source = edited
+            assert table.source == source
+            assert [(t.type, t.value, t.line, t.char) for t in table] == \
+                   [(t.type, t.value, t.line, t.char) for t in expected]
+
+    def test_retokenize_across_source_chunks(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        tokenizer = Tokenizer(items)
+        rng = random.Random(3)
+        pieces = ['int x = 12;', '\n', '\n\n', 'y * 2.5', ' ', ';', 'name']
+        source = ''.join(f'int a{i} = {i} * 2;\n\n' if i % 3 else f'float b{i} = a{i - 1};\n' for i in range(40))
+        chunk_size = SourceText.CHUNK_SIZE
+        SourceText.CHUNK_SIZE = 16
+        try:
+            table = tokenizer.tokenize_table(source)
+            for _ in range(300):
+                offset = rng.randint(0, len(source))
+                removed = rng.randint(0, min(12, len(source) - offset))
+                inserted = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 3)))
+                edited = source[:offset] + inserted + source[offset + removed:]
+                try:
+                    expected = tokenizer.tokenize_table(edited)
+                except ValueError:
+                    continue
+                tokenizer.retokenize(table, offset, removed, inserted)
+                source = edited
+                assert [table.start(i) for i in range(len(table))] == list(expected.starts)
+                assert [(t.type, t.value, t.line, t.char) for t in table] == \
+                       [(t.type, t.value, t.line, t.char) for t in expected]
+            assert table.source == source
+            assert len(table.text.chunks) > 1
+        finally:
+            SourceText.CHUNK_SIZE = chunk_size
+
+        table.apply_shifts()
+        assert table.shift_indices == []
+        assert list(table.starts) == list(expected.starts)
+        assert list(table.lines) == list(expected.lines)
+
+    @unittest.skipIf(vectorized.np is None, "numpy is not installed")
+    def test_vectorized_matches_tokenize(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        tokenizer = Tokenizer(items)
+        vectorized_tokenizer = vectorized.VectorizedTokenizer(items)
+        rng = random.Random(2)
+        alphabet = 'ab_19. ."\n;+*\t\0\u00e9intfloattrue'
+        for _ in range(2000):
+            source = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+            try:
+                expected = [(t.type, t.value, t.line, t.char) for t in tokenizer.tokenize(source)]
+            except ValueError as e:
+                expected = str(e)
+            try:
+                actual = [(t.type, t.value, t.line, t.char) for t in vectorized_tokenizer.tokenize(source)]
+            except ValueError as e:
+                actual = str(e)
+            assert actual == expected, repr(source)
+
+    def test_parallel_matches_tokenize(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        tokenizer = Tokenizer(items)
+        source = 'int x = 12;\n\n  string s = "a ; string";\nfloat y = 2.5 * x;\n' * 20
+        expected = [(t.type, t.value, t.line, t.char) for t in tokenizer.tokenize(source)]
+
+        with ParallelTokenizer(items, max_workers=2, chunk_size=40) as parallel_tokenizer:
+            assert [(t.type, t.value, t.line, t.char) for t in parallel_tokenizer.tokenize(source)] == expected
+            executor = parallel_tokenizer.executor
+            # errors read the same as in Tokenizer, even for a string left open at the end of a chunk
+            for bad in [source + '"unterminated\n' + source, 'int x = 1;\n' * 5 + 'string s = "abc\nint y = 2;\n' * 3,
+                        source + 'string s = "abc']:
+                with self.assertRaises(ValueError) as expected_error:
+                    tokenizer.tokenize(bad)
+                for chunk_size in [10, 40]:
+                    parallel_tokenizer.chunk_size = chunk_size
+                    with self.assertRaises(ValueError) as actual_error:
+                        parallel_tokenizer.tokenize(bad)
+                    assert str(actual_error.exception) == str(expected_error.exception)
+            # the pool is started once and kept
+            assert parallel_tokenizer.executor is executor is not None
+
+    def test_spec_operators(self):
+        spec = load_setup()
+        for name, structure in [('==', '$left == $right'), ('->', '$left -> $right'), ('<<=', '$left <<= $right')]:
+            so = copy.deepcopy(spec.structured_objects['<'])
+            so.name = name
+            so.structure.component_defs = parse_structure_into_components(structure)
+            spec.structured_objects[name] = so
+        items = TokenizerItems.from_spec(spec)
+        tokenizer = Tokenizer(items)
+
+        assert items.operators == {'==', '->', '<<='}
+        assert [t.value for t in tokenizer.tokenize('a==b->c<<=d<=e')] == \
+               ['a', '==', 'b', '->', 'c', '<<=', 'd', '<', '=', 'e']
+        assert [t.value for t in tokenizer.tokenize('a = = b')] == ['a', '=', '=', 'b']
+        assert items.literal_tokens('==') == ('==',)
+
+    def test_token_cache(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        source = 'int x = 12;\nstring s = "text";\nPoint p;\n'
+        expected = [(t.type, t.value, t.line, t.char) for t in Tokenizer(items).tokenize(source)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            tokenizer = CachingTokenizer(items, TokenCache(directory))
+            assert [(t.type, t.value, t.line, t.char) for t in tokenizer.tokenize(source)] == expected
+            assert [(t.type, t.value, t.line, t.char) for t in tokenizer.tokenize(source)] == expected
+            assert (tokenizer.cache.hits, tokenizer.cache.misses) == (1, 1)
+
+            # a new cache over the same directory, as in a later build, hits as well
+            cache = TokenCache(directory)
+            assert [(t.type, t.value, t.line, t.char) for t in CachingTokenizer(items, cache).tokenize(source)] == expected
+            assert cache.hits == 1
+
+            # items with Point as a keyword tokenize the source differently, so it is a different entry
+            keyword_items = TokenizerItems(spec.primitive_types, spec.expression_separators, {'Point'})
+            assert CachingTokenizer(keyword_items, cache).tokenize(source)[10].type == TokenType.Keyword
+            assert cache.misses == 1
+
+            cache.max_bytes = cache.size() - 1
+            CachingTokenizer(items, cache).tokenize('int y;')
+            assert len(cache.entries) == 2
+            assert len(os.listdir(directory)) == 2
+
+            # an entry written by another build after this cache loaded its index is still found
+            other = TokenCache(directory)
+            CachingTokenizer(items, other).tokenize('int z;')
+            assert [t.value for t in CachingTokenizer(items, cache).tokenize('int z;')] == ['int', 'z', ';']
+            assert cache.hits == 2
+
+            # a failed write leaves no temporary file behind
+            with self.assertRaises(OSError):
+                cache.put('a/b', Tokenizer(items).tokenize_table('int w;'))
+            assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+            # an entry with bytes after its arrays is corrupt: a miss, and the file is removed
+            key = next(reversed(cache.entries))
+            with open(os.path.join(directory, key + '.tokens'), 'ab') as f:
+                f.write(b'\0')
+            misses = cache.misses
+            assert cache.get(key, 'int z;') is None
+            assert cache.misses == misses + 1
+            assert not os.path.exists(os.path.join(directory, key + '.tokens'))
+
+            # an entry removed by another build between listing and stat is skipped
+            listing = os.listdir(directory)
+            with unittest.mock.patch('os.listdir', return_value=listing + ['evicted.tokens']):
+                assert 'evicted' not in TokenCache(directory).entries
+
+    def test_malformed_literals(self):
+        spec = load_setup()
+        items = TokenizerItems(spec.primitive_types, spec.expression_separators)
+        for source in ['"unterminated', '"split\nstring"', '1.2.3', '12abc']:
+            with self.assertRaises(ValueError):
+                Tokenizer(items).tokenize(source)
+
 
 if __name__ == '__main__':
     unittest.main()